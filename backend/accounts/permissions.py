@@ -16,3 +16,11 @@ class IsAdmin(BasePermission):
 class IsClient(BasePermission):
     def has_permission(self, request, view):
         return request.user.is_authenticated and request.user.roles.filter(name='client').exists()
+
+class IsWorkshopMember(BasePermission):
+    """Obiekt to warsztat: dostęp ma admin, właściciel warsztatu albo jego pracownik."""
+    message = 'Brak dostępu do tego warsztatu.'
+
+    def has_object_permission(self, request, view, obj):
+        user = request.user
+        return user.is_superuser or obj.owner_id == user.pk or obj.employees.filter(user=user).exists()
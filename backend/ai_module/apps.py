@@ -6,4 +6,5 @@ class AiModuleConfig(AppConfig):
     name = 'ai_module'
     
     def ready(self):
+        import ai_module.checks
         import ai_module.signals
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+# Broker i backend wyników w pamięci procesu - każdy proces (web, beat, worker) ma własny
+IN_MEMORY_URLS = ('memory://', 'cache+memory://')
+
+
+@register(Tags.compatibility)
+def check_celery_settings(app_configs, **kwargs):
+    """
+    Zadania z beat i z widoków muszą trafić do workerów przez wspólny broker,
+    a chord przeliczania segmentów potrzebuje backendu wyników. Tryb eager
+    wykonuje wszystko w procesie, więc wtedy ustawienia nie są potrzebne.
+    """
+    if getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+        return []
+
+    errors = []
+    for name in ('CELERY_BROKER_URL', 'CELERY_RESULT_BACKEND'):
+        value = getattr(settings, name, None)
+        if value and value.startswith(IN_MEMORY_URLS):
+            errors.append(Error(
+                f"{name}={value} działa tylko w obrębie jednego procesu - zadania z beat i widoków przepadną.",
+                hint=f"Ustaw {name} na wspólny serwer (np. redis://localhost:6379/0) albo CELERY_TASK_ALWAYS_EAGER=True.",
+                id='ai_module.E001',
+            ))
+    if not getattr(settings, 'CELERY_BROKER_URL', None):
+        errors.append(Warning(
+            "CELERY_BROKER_URL nie jest ustawiony - Celery użyje domyślnego brokera amqp://localhost.",
+            hint="Ustaw CELERY_BROKER_URL w środowisku (np. redis://localhost:6379/0).",
+            id='ai_module.W001',
+        ))
+    if not getattr(settings, 'CELERY_RESULT_BACKEND', None):
+        errors.append(Warning(
+            "CELERY_RESULT_BACKEND nie jest ustawiony - update_client_segments_task (chord) nie wystartuje.",
+            hint="Ustaw CELERY_RESULT_BACKEND w środowisku (np. redis://localhost:6379/0).",
+            id='ai_module.W002',
+        ))
+    return errors
@@ -0,0 +1,171 @@
+import struct
+import zipfile
+import numpy as np
+from ai_module.registry import write_atomically
+
+# Liczba wierszy liczonych naraz - ogranicza pamięć tablicy (wiersze x drzewa)
+PREDICT_CHUNK = 8192
+
+
+def _round_down_to_float32(threshold):
+    """
+    Największy float32 <= progu float64.
+
+    sklearn porównuje cechy rzutowane na float32 z progiem float64; dla x
+    typu float32 warunek `x <= t` jest równoważny `x <= float32_w_dół(t)`,
+    więc progi mogą być trzymane (i czytane) jako float32 bez zmiany wyników.
+    """
+    rounded = threshold.astype(np.float32)
+    too_big = rounded.astype(np.float64) > threshold
+    rounded[too_big] = np.nextafter(rounded[too_big], np.float32(-np.inf))
+    return rounded
+
+
+def export_pipeline(pipeline, path, features, version=''):
+    """
+    Spłaszcza wytrenowany pipeline (StandardScaler + RandomForest/DecisionTree)
+    do ciągłych tablic NumPy i zapisuje je jako nieskompresowany `.npz`.
+
+    Wszystkie drzewa są sklejane w jedną tablicę węzłów; liście wskazują same
+    na siebie, więc ewaluacja to stała liczba kroków `depth` bez rozgałęzień.
+    """
+    steps = dict(getattr(pipeline, 'steps', []))
+    scaler = steps.get('scaler')
+    classifier = steps.get('classifier', pipeline)
+    estimators = getattr(classifier, 'estimators_', [classifier])
+
+    n_features = len(features)
+    if scaler is not None:
+        mean = np.asarray(scaler.mean_, dtype=np.float64)
+        scale = np.asarray(scaler.scale_, dtype=np.float64)
+    else:
+        mean = np.zeros(n_features, dtype=np.float64)
+        scale = np.ones(n_features, dtype=np.float64)
+
+    feature, threshold, children, value, roots = [], [], [], [], []
+    offset = 0
+    depth = 0
+    for estimator in estimators:
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        node_ids = np.arange(n_nodes, dtype=np.int32) + offset
+        is_leaf = tree.children_left == -1
+
+        tree_left = np.where(is_leaf, node_ids, tree.children_left + offset)
+        tree_right = np.where(is_leaf, node_ids, tree.children_right + offset)
+        tree_value = tree.value[:, 0, :].astype(np.float64)
+        tree_value /= tree_value.sum(axis=1, keepdims=True)
+
+        feature.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        threshold.append(_round_down_to_float32(np.where(is_leaf, np.inf, tree.threshold)))
+        # Dzieci węzła i leżą obok siebie: [lewe, prawe] -> indeks 2*i + (x > próg)
+        children.append(np.column_stack([tree_left, tree_right]).ravel().astype(np.int32))
+        value.append(tree_value)
+        roots.append(offset)
+        depth = max(depth, tree.max_depth)
+        offset += n_nodes
+
+    arrays = {
+        'mean': mean,
+        'scale': scale,
+        'feature': np.concatenate(feature),
+        'threshold': np.concatenate(threshold),
+        'children': np.concatenate(children),
+        'value': np.concatenate(value),
+        'roots': np.asarray(roots, dtype=np.int32),
+        'depth': np.asarray(depth, dtype=np.int32),
+        'classes': np.asarray([str(c) for c in classifier.classes_]),
+        'features': np.asarray(features),
+        'version': np.asarray(version),
+    }
+    write_atomically(path, lambda f: np.savez(f, **arrays))
+
+
+def _load_npz(path, mmap=True):
+    """
+    Otwiera `.npz` zapisany przez `np.savez`, mapując tablice w pamięci.
+
+    `np.load` ignoruje `mmap_mode` dla archiwów, więc dla nieskompresowanych
+    wpisów wyliczamy offset danych wewnątrz pliku i tworzymy `np.memmap`
+    - strony są wtedy współdzielone przez wszystkie procesy workerów.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if not mmap or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+
+            f.seek(info.header_offset)
+            local_header = f.read(30)
+            name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            major, minor = np.lib.format.read_magic(f)
+            if (major, minor) == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if dtype.hasobject or not shape or 0 in shape:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+
+            arrays[name] = np.memmap(
+                path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                order='F' if fortran_order else 'C',
+            )
+    return arrays
+
+
+class CompactForest:
+    """Wektorowa ewaluacja spłaszczonego lasu - zamiennik `model.predict` bez sklearn."""
+
+    def __init__(self, arrays):
+        # Widoki ndarray na mapowane strony - bez narzutu podklasy np.memmap
+        arrays = {name: np.asarray(array).view(np.ndarray) for name, array in arrays.items()}
+        self.mean = arrays['mean']
+        self.scale = arrays['scale']
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.children = arrays['children']
+        self.value = arrays['value']
+        self.roots = arrays['roots']
+        self.depth = int(arrays['depth'])
+        self.classes_ = np.asarray(arrays['classes'])
+        self.features = [str(f) for f in arrays['features']]
+        self.version = str(arrays['version'])
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        return cls(_load_npz(path, mmap=mmap))
+
+    def _predict_proba_chunk(self, X):
+        # Ta sama arytmetyka co sklearn: skalowanie w float64, drzewa na float32
+        X = ((X - self.mean) / self.scale).astype(np.float32)
+        n_samples, n_features = X.shape
+        X = X.ravel()
+        row_offsets = (np.arange(n_samples, dtype=np.int32) * n_features)[:, None]
+        # Macierz (wiersze x drzewa) bieżących węzłów - wszystkie drzewa naraz
+        nodes = np.broadcast_to(self.roots, (n_samples, len(self.roots))).copy()
+        for _ in range(self.depth):
+            values = np.take(X, row_offsets + np.take(self.feature, nodes))
+            go_right = values > np.take(self.threshold, nodes)
+            nodes = np.take(self.children, 2 * nodes + go_right)
+        return np.take(self.value, nodes, axis=0).mean(axis=1)
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        if len(X) <= PREDICT_CHUNK:
+            return self._predict_proba_chunk(X)
+        return np.concatenate([
+            self._predict_proba_chunk(X[start:start + PREDICT_CHUNK])
+            for start in range(0, len(X), PREDICT_CHUNK)
+        ])
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
@@ -0,0 +1,246 @@
+import functools
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from datetime import timedelta
+import numpy as np
+from ai_module.registry import CHECK_INTERVAL, DURATION_INDEX_PATH as INDEX_PATH, write_atomically
+
+# Przestrzeń haszowania cech (n-gramy znakowe + marka/model/silnik)
+N_FEATURES = 1 << 18
+NGRAM_RANGE = (3, 5)
+# Waga cech pojazdu względem opisu naprawy (opis jest znormalizowany do 1)
+VEHICLE_WEIGHT = 0.35
+N_NEIGHBORS = 5
+MIN_SIMILARITY = 0.3
+# Szacunki zaokrąglamy do pełnych 5 minut
+ROUND_TO = 300
+MEMO_SIZE = 4096
+
+_WORD_RE = re.compile(r'[^\w]+')
+
+
+def normalize_description(text):
+    """Małe litery, bez znaków diakrytycznych i interpunkcji, pojedyncze spacje."""
+    text = unicodedata.normalize('NFKD', (text or '').lower().replace('ł', 'l'))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(_WORD_RE.sub(' ', text).split())
+
+
+def _hash(token):
+    return zlib.crc32(token.encode('utf-8')) & (N_FEATURES - 1)
+
+
+def vectorize(description, make='', model='', engine=''):
+    """
+    Rzadki wektor cech `(indeksy, wagi)` znormalizowany do długości 1.
+
+    Opis to n-gramy znakowe 3-5 (odporne na literówki i odmianę), z wagą
+    logarytmiczną; marka, model i silnik dochodzą jako osobne tokeny.
+    """
+    counts = {}
+    text = f' {normalize_description(description)} '
+    for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1):
+        for start in range(len(text) - n + 1):
+            bucket = _hash(text[start:start + n])
+            counts[bucket] = counts.get(bucket, 0) + 1
+
+    indices = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+    weights = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    if len(weights):
+        weights /= np.linalg.norm(weights)
+
+    vehicle_tokens = [
+        f'{name}={normalize_description(value)}'
+        for name, value in (('make', make), ('model', f'{make} {model}'), ('engine', engine))
+        if value and value.strip()
+    ]
+    if vehicle_tokens:
+        indices = np.concatenate([indices, [_hash(token) for token in vehicle_tokens]]).astype(np.int32)
+        weights = np.concatenate([weights, np.full(len(vehicle_tokens), VEHICLE_WEIGHT, dtype=np.float32)])
+
+    # Kolizje haszy sumujemy, żeby indeksy były unikalne
+    indices, inverse = np.unique(indices, return_inverse=True)
+    weights = np.bincount(inverse, weights=weights).astype(np.float32)
+    norm = np.linalg.norm(weights)
+    return indices, (weights / norm if norm else weights)
+
+
+class DurationIndex:
+    """
+    Indeks historycznych napraw: macierz cech w układzie CSC (kolumna = cecha),
+    więc podobieństwo zapytania liczone jest tylko po niezerowych cechach.
+    """
+
+    def __init__(self, arrays):
+        from scipy.sparse import csc_matrix
+
+        arrays = {name: np.asarray(array) for name, array in arrays.items()}
+        self.ids = arrays['ids']
+        self.durations = arrays['durations']
+        self.built_at = str(arrays['built_at'])
+        self.version = str(arrays['version'])
+        self.matrix = csc_matrix(
+            (arrays['data'], arrays['indices'], arrays['indptr']), shape=(len(self.ids), N_FEATURES)
+        )
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        from ai_module.compact import _load_npz
+
+        return cls(_load_npz(path))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def estimate_seconds(self, indices, weights):
+        """Średnia czasów najbliższych sąsiadów ważona podobieństwem (None, gdy brak podobnych)."""
+        if not len(self) or not len(indices):
+            return None
+        scores = self.matrix[:, indices] @ weights
+        k = min(N_NEIGHBORS, len(scores))
+        nearest = np.argpartition(-scores, k - 1)[:k]
+        nearest = nearest[scores[nearest] >= MIN_SIMILARITY]
+        if not len(nearest):
+            return None
+        seconds = np.average(self.durations[nearest], weights=scores[nearest])
+        return max(ROUND_TO, int(round(seconds / ROUND_TO)) * ROUND_TO)
+
+
+_lock = threading.Lock()
+_state = {'index': None, 'stamp': None, 'checked': 0.0}
+
+
+def get_index():
+    """Indeks z dysku, przeładowywany po zmianie pliku (jak rejestr modelu segmentacji)."""
+    if time.monotonic() - _state['checked'] < CHECK_INTERVAL:
+        return _state['index']
+    with _lock:
+        _state['checked'] = time.monotonic()
+        try:
+            stat = os.stat(INDEX_PATH)
+        except FileNotFoundError:
+            _state['index'] = _state['stamp'] = None
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != _state['stamp']:
+            _state['index'] = DurationIndex.load(INDEX_PATH)
+            _state['stamp'] = stamp
+        return _state['index']
+
+
+@functools.lru_cache(maxsize=MEMO_SIZE)
+def _estimate_memoized(version, description, make, model, engine):
+    index = get_index()
+    if index is None:
+        return None
+    return index.estimate_seconds(*vectorize(description, make, model, engine))
+
+
+def estimate_duration(description, make='', model='', engine=''):
+    """
+    Szacowany czas naprawy (`timedelta`) albo None, gdy indeks nie istnieje
+    lub nie ma podobnych napraw. Wynik jest zapamiętywany dla znormalizowanego
+    opisu i pojazdu (klucz zawiera wersję indeksu, więc przebudowa go unieważnia).
+    """
+    index = get_index()
+    if index is None:
+        return None
+    seconds = _estimate_memoized(
+        index.version, normalize_description(description),
+        normalize_description(make), normalize_description(model), normalize_description(engine or ''),
+    )
+    return timedelta(seconds=seconds) if seconds is not None else None
+
+
+def estimate_repair_items(items, vehicle):
+    """Szacuje czas wielu pozycji jednej wizyty - dla operacji zbiorczych, które pomijają sygnał pre_save."""
+    make, model, engine = vehicle.make or '', vehicle.model or '', vehicle.engine_type or ''
+    for item in items:
+        item.estimated_duration = estimate_duration(item.description, make, model, engine)
+
+
+def _labelled_items(queryset):
+    return queryset.filter(actual_duration__gt=timedelta(0)).values(
+        'id', 'description', 'actual_duration', 'updated_at',
+        'appointment__vehicle__make', 'appointment__vehicle__model', 'appointment__vehicle__engine_type',
+    )
+
+
+def _rows(items):
+    from scipy.sparse import csr_matrix
+
+    indptr, indices, data, ids, durations = [0], [], [], [], []
+    for item in items.iterator(chunk_size=2000):
+        item_indices, item_weights = vectorize(
+            item['description'],
+            item['appointment__vehicle__make'] or '',
+            item['appointment__vehicle__model'] or '',
+            item['appointment__vehicle__engine_type'] or '',
+        )
+        indices.append(item_indices)
+        data.append(item_weights)
+        indptr.append(indptr[-1] + len(item_indices))
+        ids.append(str(item['id']))
+        durations.append(item['actual_duration'].total_seconds())
+
+    matrix = csr_matrix(
+        (
+            np.concatenate(data) if data else np.empty(0, dtype=np.float32),
+            np.concatenate(indices) if indices else np.empty(0, dtype=np.int32),
+            np.asarray(indptr, dtype=np.int64),
+        ),
+        shape=(len(ids), N_FEATURES),
+    )
+    return matrix, ids, durations
+
+
+def build_index(full=False, path=INDEX_PATH):
+    """
+    Buduje lub dopisuje indeks z `RepairItem` z wpisanym `actual_duration`.
+
+    Bez `full` czytane są tylko pozycje zmienione od ostatniej budowy - ich
+    stare wiersze są usuwane, a aktualne dopisywane. Wiersze pozycji, których
+    już nie ma (usunięte razem z wizytą albo bez `actual_duration`), są
+    usuwane na podstawie listy id z bazy. Zwraca `(wierszy, dodanych)`.
+    """
+    from scipy.sparse import csr_matrix, vstack
+    from django.utils import timezone
+    from appointments.models import RepairItem
+
+    built_at = timezone.now()
+    previous = None
+    if not full and os.path.exists(path):
+        previous = DurationIndex.load(path)
+
+    if previous is None:
+        matrix, ids, durations = _rows(_labelled_items(RepairItem.objects.all()))
+        added = len(ids)
+    else:
+        since = previous.built_at
+        changed = RepairItem.objects.filter(updated_at__gte=since)
+        changed_ids = [str(pk) for pk in changed.values_list('pk', flat=True)]
+        existing_ids = [str(pk) for pk in _labelled_items(RepairItem.objects.all()).values_list('pk', flat=True)]
+        keep = np.flatnonzero(np.isin(previous.ids, existing_ids) & ~np.isin(previous.ids, changed_ids))
+        new_matrix, new_ids, new_durations = _rows(_labelled_items(changed))
+        matrix = vstack([csr_matrix(previous.matrix)[keep], new_matrix], format='csr')
+        ids = list(previous.ids[keep]) + new_ids
+        durations = list(previous.durations[keep]) + new_durations
+        added = len(new_ids)
+
+    matrix = matrix.tocsc()
+    matrix.sort_indices()
+    arrays = {
+        'indptr': matrix.indptr.astype(np.int64),
+        'indices': matrix.indices.astype(np.int32),
+        'data': matrix.data.astype(np.float32),
+        'ids': np.asarray(ids, dtype='U36'),
+        'durations': np.asarray(durations, dtype=np.float64),
+        'built_at': np.asarray(built_at.isoformat()),
+        'version': np.asarray(built_at.strftime('%Y%m%d%H%M%S%f')),
+    }
+    write_atomically(path, lambda f: np.savez(f, **arrays))
+    return len(ids), added
@@ -0,0 +1,191 @@
+import asyncio
+import uuid
+from concurrent.futures import as_completed
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from ai_module.llm import LLMError, get_llm_client
+from ai_module.models import EmailBatchJob, EmailBatchResult
+
+# Znacznik odbiorcy we wspólnym szablonie - podmieniany na imię i nazwisko klienta
+RECIPIENT_PLACEHOLDER = '[ODBIORCA]'
+TEMPLATE_RECIPIENT = f'{RECIPIENT_PLACEHOLDER} (pozostaw ten znacznik bez zmian, zostanie zastąpiony imieniem i nazwiskiem)'
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_CLIENTS = 1000
+# Jak długo (s) status i wyniki są dostępne w `generate-email/batch/<batch_id>/`
+STATUS_TTL = 24 * 3600
+MAX_TOKENS = 500
+TEMPERATURE = 0.7
+
+
+def email_messages(subject_hint, sender_name, sender_position, sender_company,
+                   recipient_type='all', selected_segment=None, selected_client=None):
+    """Prompt dla modelu - wspólny dla pojedynczego e-maila i wysyłki zbiorczej."""
+    return [
+        {"role": "system", "content": "Jesteś pomocnym asystentem w warsztacie samochodwym, który pisze profesjonalne wiadomości e-mail."},
+        {"role": "user", "content": f"""
+            Stwórz treść e-maila na temat: {subject_hint}.
+            Nadawca: {sender_name}, {sender_position}, {sender_company}.
+            Typ odbiorcy: {recipient_type}.
+            {f"Segment: {selected_segment}." if selected_segment else ""}
+            {f"Odbiorca: {selected_client}." if selected_client else ""}
+            Wiadomość powinna być uprzejma i profesjonalna.
+            """}
+    ]
+
+
+def _expired_before():
+    return timezone.now() - timedelta(seconds=STATUS_TTL)
+
+
+def get_batch(batch_id):
+    """Zadanie zbiorcze z ostatnich `STATUS_TTL` sekund albo None."""
+    return EmailBatchJob.objects.filter(pk=batch_id, created_at__gte=_expired_before()).first()
+
+
+def batch_status(job):
+    """Postęp i wyniki zadania - ten sam kształt, co podsumowanie strumienia."""
+    results = []
+    for result in job.results.order_by('pk').values('client_id', 'email', 'content', 'error'):
+        row = {'client_id': str(result['client_id']), 'email': result['email']}
+        if result['error'] is None:
+            row['content'] = result['content']
+        else:
+            row['error'] = result['error']
+        results.append(row)
+    return {
+        'batch_id': str(job.pk),
+        'status': job.status,
+        'total': job.total,
+        'unique_prompts': job.unique_prompts,
+        'completed': job.completed,
+        'failed': job.failed,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'results': results,
+    }
+
+
+def _client_name(client):
+    return ' '.join(filter(None, [client['first_name'], client['last_name']])) or 'Kliencie'
+
+
+class EmailBatch:
+    """
+    Zbiorcze generowanie e-maili dla listy klientów.
+
+    Klienci z identycznym promptem dostają jedno wywołanie modelu. Domyślnie
+    odbiorca w prompcie to `RECIPIENT_PLACEHOLDER`, więc cały segment dzieli
+    jeden szablon, a imię jest wstawiane lokalnie; `per_client=True` prosi
+    model o osobną treść dla każdego (deduplikowane są wtedy tylko powtórki).
+
+    Postęp trafia do bazy (`EmailBatchJob`), więc status może odczytać dowolny
+    proces; wyniki każdego ukończonego promptu są dopisywane jednym INSERT-em
+    (`EmailBatchResult`), a liczniki aktualizowane jednym UPDATE-em.
+    """
+
+    def __init__(self, workshop_id, clients, subject_hint, sender_name, sender_position, sender_company,
+                 per_client=False, concurrency=None, llm=None):
+        self.id = str(uuid.uuid4())
+        self.workshop_id = workshop_id
+        self.clients = clients
+        self.per_client = per_client
+        self.concurrency = concurrency or getattr(settings, 'AI_EMAIL_BATCH_CONCURRENCY', DEFAULT_CONCURRENCY)
+        self.llm = llm or get_llm_client()
+        self.sender = (subject_hint, sender_name, sender_position, sender_company)
+        self.groups = self._group_prompts()
+        self.status = {
+            'batch_id': self.id,
+            'status': 'running',
+            'total': len(clients),
+            'unique_prompts': len(self.groups),
+            'completed': 0,
+            'failed': 0,
+        }
+
+    def _group_prompts(self):
+        groups = {}
+        for client in self.clients:
+            recipient = _client_name(client) if self.per_client else TEMPLATE_RECIPIENT
+            messages = email_messages(
+                *self.sender,
+                recipient_type='segment' if client['segment'] else 'all',
+                selected_segment=client['segment'],
+                selected_client=recipient,
+            )
+            key = self.llm.cache_key(messages, MAX_TOKENS, TEMPERATURE)
+            groups.setdefault(key, (messages, []))[1].append(client)
+        return groups
+
+    def _start(self):
+        EmailBatchJob.objects.filter(created_at__lt=_expired_before()).delete()
+        EmailBatchJob.objects.create(
+            id=self.id, workshop_id=self.workshop_id,
+            total=self.status['total'], unique_prompts=self.status['unique_prompts'],
+        )
+
+    def _save_results(self, results):
+        EmailBatchResult.objects.bulk_create([
+            EmailBatchResult(
+                batch_id=self.id, client_id=result['client_id'], email=result['email'],
+                content=result.get('content'), error=result.get('error'),
+            )
+            for result in results
+        ])
+        EmailBatchJob.objects.filter(pk=self.id).update(
+            completed=self.status['completed'], failed=self.status['failed'],
+        )
+
+    def _finish(self):
+        EmailBatchJob.objects.filter(pk=self.id).update(
+            status=self.status['status'], finished_at=timezone.now(),
+        )
+
+    async def _generate(self, semaphore, messages, clients):
+        async with semaphore:
+            try:
+                content = await self.llm.complete(messages, max_tokens=MAX_TOKENS, temperature=TEMPERATURE)
+                return clients, content, None
+            except LLMError as e:
+                return clients, None, str(e)
+
+    def _results(self, clients, content, error):
+        for client in clients:
+            result = {'client_id': str(client['id']), 'email': client['email']}
+            if error is None:
+                result['content'] = content.replace(RECIPIENT_PLACEHOLDER, _client_name(client))
+            else:
+                result['error'] = error
+            yield result
+
+    def run(self):
+        """
+        Generator wyników - każdy klient zaraz po ukończeniu jego promptu.
+
+        Zapytania wykonuje pętla współdzielonego klienta LLM (wątek w tle),
+        a zapis do bazy i zwracanie wyników odbywa się w wątku wywołującym,
+        więc pod WSGI odpowiedź strumieniowa płynie bez pętli zdarzeń w żądaniu.
+        """
+        self._start()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        futures = [
+            self.llm.submit(self._generate(semaphore, messages, clients))
+            for messages, clients in self.groups.values()
+        ]
+        try:
+            for future in as_completed(futures):
+                clients, content, error = future.result()
+                results = list(self._results(clients, content, error))
+                self.status['failed' if error else 'completed'] += len(results)
+                self._save_results(results)
+                yield from results
+            self.status['status'] = 'completed'
+        except GeneratorExit:
+            # Klient przerwał połączenie - nie generujemy reszty na próżno
+            self.status['status'] = 'canceled'
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
+            self._finish()
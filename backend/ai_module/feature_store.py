@@ -0,0 +1,232 @@
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Min, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
+from clients.models import Client
+from ai_module.models import ClientFeatures
+
+CHUNK_SIZE = 2000
+
+STORED_FIELDS = (
+    'completed_count', 'completed_total', 'canceled_count',
+    'first_completed_at', 'last_completed_at',
+)
+
+COMPLETED = Q(appointments__status='completed')
+CANCELED = Q(appointments__status='canceled')
+
+
+def aggregate_features_queryset(clients=None):
+    """Pełna agregacja historii wizyt - źródło prawdy dla przebudowy i weryfikacji."""
+    if clients is None:
+        clients = Client.objects.all()
+    return (
+        clients
+        .order_by()
+        .annotate(
+            agg_completed_count=Count('appointments', filter=COMPLETED),
+            agg_completed_total=Coalesce(
+                Sum('appointments__total_cost', filter=COMPLETED),
+                Value(Decimal('0')),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+            agg_canceled_count=Count('appointments', filter=CANCELED),
+            agg_first_completed_at=Min('appointments__scheduled_time', filter=COMPLETED),
+            agg_last_completed_at=Max('appointments__scheduled_time', filter=COMPLETED),
+        )
+    )
+
+
+def _features_from_row(row):
+    return ClientFeatures(
+        client_id=row['id'],
+        **{field: row[f'agg_{field}'] for field in STORED_FIELDS}
+    )
+
+
+def rebuild_client_features(clients=None, chunk_size=CHUNK_SIZE, progress=None):
+    """Przebudowuje wiersze `ClientFeatures` z pełnej agregacji, porcjami."""
+    if clients is None:
+        clients = Client.objects.all()
+
+    rows = aggregate_features_queryset(clients).values('id', *[f'agg_{field}' for field in STORED_FIELDS])
+    rebuilt = 0
+    batch = []
+
+    def flush():
+        nonlocal rebuilt
+        with transaction.atomic():
+            ClientFeatures.objects.filter(client_id__in=[f.client_id for f in batch]).delete()
+            ClientFeatures.objects.bulk_create(batch)
+        rebuilt += len(batch)
+        batch.clear()
+        if progress is not None:
+            progress(rebuilt)
+
+    for row in rows.iterator(chunk_size=chunk_size):
+        batch.append(_features_from_row(row))
+        if len(batch) == chunk_size:
+            flush()
+    if batch:
+        flush()
+    return rebuilt
+
+
+def refresh_client_features(client_id):
+    """Przelicza od zera wiersz jednego klienta (np. gdy go jeszcze nie ma)."""
+    row = (
+        aggregate_features_queryset(Client.objects.filter(pk=client_id))
+        .values('id', *[f'agg_{field}' for field in STORED_FIELDS])
+        .first()
+    )
+    if row is None:
+        return None
+    features = _features_from_row(row)
+    ClientFeatures.objects.update_or_create(
+        client_id=client_id,
+        defaults={field: getattr(features, field) for field in STORED_FIELDS},
+    )
+    return features
+
+
+def _refresh_completed_dates(client_id):
+    dates = aggregate_features_queryset(Client.objects.filter(pk=client_id)).values(
+        'agg_first_completed_at', 'agg_last_completed_at'
+    ).first()
+    if dates is not None:
+        ClientFeatures.objects.filter(client_id=client_id).update(
+            first_completed_at=dates['agg_first_completed_at'],
+            last_completed_at=dates['agg_last_completed_at'],
+        )
+
+
+def appointment_snapshot(appointment):
+    """Wkład wizyty w cechy klienta - to, co trzeba odjąć/dodać przy zmianie."""
+    return {
+        'client_id': appointment.client_id,
+        'status': appointment.status,
+        'total_cost': appointment.total_cost,
+        'scheduled_time': appointment.scheduled_time,
+    }
+
+
+def _apply_delta(client_id, completed=0, total=Decimal('0'), canceled=0, completed_at=None):
+    changes = {'updated_at': timezone.now()}
+    if completed:
+        changes['completed_count'] = F('completed_count') + completed
+    if total:
+        changes['completed_total'] = F('completed_total') + total
+    if canceled:
+        changes['canceled_count'] = F('canceled_count') + canceled
+    if completed_at is not None:
+        # Least/Greatest pomijają NULL na PostgreSQL, Coalesce obsługuje SQLite
+        changes['first_completed_at'] = Coalesce(Least(F('first_completed_at'), Value(completed_at)), Value(completed_at))
+        changes['last_completed_at'] = Coalesce(Greatest(F('last_completed_at'), Value(completed_at)), Value(completed_at))
+
+    if len(changes) == 1:
+        return
+    if not ClientFeatures.objects.filter(client_id=client_id).update(**changes):
+        # Brak wiersza - budujemy go z pełnej historii (zawiera już bieżącą zmianę)
+        refresh_client_features(client_id)
+
+
+def apply_appointment_change(previous, current):
+    """
+    Aktualizuje cechy klienta różnicowo na podstawie dwóch migawek wizyty.
+
+    `previous` to stan przed zapisem (None dla nowej wizyty), `current` stan
+    po zapisie (None po usunięciu).
+    """
+    if previous == current:
+        return
+
+    if previous is not None:
+        removed_completed = previous['status'] == 'completed'
+        if removed_completed or previous['status'] == 'canceled':
+            still_same = (
+                current is not None
+                and current['client_id'] == previous['client_id']
+                and current['status'] == previous['status']
+            )
+            if still_same and removed_completed:
+                # Ta sama zakończona wizyta - zmienił się tylko koszt lub termin
+                delta = (current['total_cost'] or 0) - (previous['total_cost'] or 0)
+                _apply_delta(previous['client_id'], total=delta)
+                if current['scheduled_time'] != previous['scheduled_time']:
+                    _refresh_completed_dates(previous['client_id'])
+                return
+            if still_same:
+                return
+
+            _apply_delta(
+                previous['client_id'],
+                completed=-1 if removed_completed else 0,
+                total=-(previous['total_cost'] or 0) if removed_completed else 0,
+                canceled=-1 if previous['status'] == 'canceled' else 0,
+            )
+            if removed_completed:
+                _refresh_completed_dates(previous['client_id'])
+
+    if current is not None:
+        if current['status'] == 'completed':
+            _apply_delta(
+                current['client_id'],
+                completed=1,
+                total=current['total_cost'] or 0,
+                completed_at=current['scheduled_time'],
+            )
+        elif current['status'] == 'canceled':
+            _apply_delta(current['client_id'], canceled=1)
+
+
+def apply_completed_total_change(appointments, new_total):
+    """
+    Różnicowa korekta `completed_total` przed zmianą `total_cost` wizyt UPDATE-em
+    (bez `save()`, więc bez sygnałów wizyty). `new_total` to wyrażenie nowego
+    kosztu liczone na wierszu wizyty; liczą się tylko wizyty zakończone.
+    """
+    completed = appointments.filter(status='completed')
+    money = DecimalField(max_digits=14, decimal_places=2)
+    change = (
+        completed
+        .filter(client_id=OuterRef('client_id'))
+        .order_by()
+        .values('client_id')
+        .annotate(change=Sum(ExpressionWrapper(
+            new_total - Coalesce(F('total_cost'), Value(Decimal('0'))), output_field=money,
+        )))
+        .values('change')
+    )
+    ClientFeatures.objects.filter(client_id__in=completed.values('client_id')).update(
+        completed_total=F('completed_total') + Coalesce(Subquery(change), Value(Decimal('0')), output_field=money),
+        updated_at=timezone.now(),
+    )
+
+
+def check_client_features(clients=None, chunk_size=CHUNK_SIZE):
+    """
+    Porównuje zapisane cechy z pełną agregacją jednym zapytaniem.
+
+    Zwraca listę krotek `(client_id, pole, zapisane, oczekiwane)`; brak
+    wiersza raportowany jest jako pole `None`.
+    """
+    queryset = aggregate_features_queryset(clients).annotate(
+        **{f'stored_{field}': F(f'features__{field}') for field in STORED_FIELDS},
+        has_features=Count('features'),
+    ).values(
+        'id', 'has_features',
+        *[f'agg_{field}' for field in STORED_FIELDS],
+        *[f'stored_{field}' for field in STORED_FIELDS],
+    )
+
+    mismatches = []
+    for row in queryset.iterator(chunk_size=chunk_size):
+        if not row['has_features']:
+            mismatches.append((row['id'], None, None, None))
+            continue
+        for field in STORED_FIELDS:
+            stored, expected = row[f'stored_{field}'], row[f'agg_{field}']
+            if stored != expected:
+                mismatches.append((row['id'], field, stored, expected))
+    return mismatches
@@ -0,0 +1,169 @@
+from django.db.models import Avg, Case, Count, F, FloatField, Max, Min, OuterRef, Q, Subquery, Sum, Value, When
+from django.utils import timezone
+from clients.models import Client
+from vehicles.models import Vehicle
+from ai_module.feature_store import refresh_client_features
+
+FEATURE_NAMES = [
+    'recency',
+    'frequency',
+    'monetary_value',
+    'avg_cost',
+    'canceled_count',
+    'cancellation_rate',
+    'time_since_first_visit',
+    'vehicle_year',
+    'vehicle_mileage',
+]
+
+# Wartości domyślne dla klientów bez wizyt lub bez pojazdu
+DEFAULT_TIME_SINCE_FIRST_VISIT = 365
+DEFAULT_VEHICLE_AGE = 10
+DEFAULT_VEHICLE_MILEAGE = 100000
+
+CHUNK_SIZE = 2000
+
+COMPLETED = Q(appointments__status='completed')
+CANCELED = Q(appointments__status='canceled')
+
+
+ROW_FIELDS = (
+    'id', 'workshop_id', 'segment', 'created_at',
+    'frequency', 'monetary_value', 'avg_cost', 'last_visit', 'first_visit',
+    'canceled_count', 'vehicle_year', 'vehicle_mileage',
+)
+
+
+def _latest_vehicle_annotations():
+    latest_vehicle = Vehicle.objects.filter(client=OuterRef('pk')).order_by(
+        F('year').desc(nulls_last=True), 'pk'
+    )
+    return {
+        'vehicle_year': Subquery(latest_vehicle.values('year')[:1]),
+        'vehicle_mileage': Subquery(latest_vehicle.values('mileage')[:1]),
+    }
+
+
+def client_features_queryset(clients=None):
+    """
+    Zwraca queryset `values()` z surowymi agregatami RFM dla każdego klienta.
+
+    Wszystkie wizyty są agregowane w jednym zapytaniu z GROUP BY, a dane
+    najnowszego pojazdu dochodzą jako podzapytania skorelowane.
+    """
+    if clients is None:
+        clients = Client.objects.all()
+
+    return (
+        clients
+        .order_by()
+        .annotate(
+            frequency=Count('appointments', filter=COMPLETED),
+            monetary_value=Sum('appointments__total_cost', filter=COMPLETED),
+            avg_cost=Avg('appointments__total_cost', filter=COMPLETED),
+            last_visit=Max('appointments__scheduled_time', filter=COMPLETED),
+            first_visit=Min('appointments__scheduled_time', filter=COMPLETED),
+            canceled_count=Count('appointments', filter=CANCELED),
+            **_latest_vehicle_annotations(),
+        )
+        .values(*ROW_FIELDS)
+    )
+
+
+def stored_features_queryset(clients=None):
+    """
+    Jak `client_features_queryset`, ale czyta gotowe liczniki z `ClientFeatures`
+    zamiast agregować historię wizyt. `has_features` jest puste, gdy klient
+    nie ma jeszcze wiersza w magazynie cech.
+    """
+    if clients is None:
+        clients = Client.objects.all()
+
+    return (
+        clients
+        .order_by()
+        .annotate(
+            has_features=F('features__client'),
+            frequency=F('features__completed_count'),
+            monetary_value=F('features__completed_total'),
+            avg_cost=Case(
+                When(features__completed_count__gt=0, then=F('features__completed_total') / F('features__completed_count')),
+                default=Value(0),
+                output_field=FloatField(),
+            ),
+            last_visit=F('features__last_completed_at'),
+            first_visit=F('features__first_completed_at'),
+            canceled_count=F('features__canceled_count'),
+            **_latest_vehicle_annotations(),
+        )
+        .values(*ROW_FIELDS, 'has_features')
+    )
+
+
+def build_features(row, today=None):
+    """Zamienia wiersz z `client_features_queryset` na słownik cech modelu."""
+    if today is None:
+        today = timezone.now().date()
+
+    frequency = row['frequency'] or 0
+    canceled_count = row['canceled_count'] or 0
+    total_appointments = frequency + canceled_count
+
+    last_visit = row['last_visit']
+    first_visit = row['first_visit']
+    recency = (
+        (today - last_visit.date()).days
+        if last_visit
+        else (today - row['created_at'].date()).days
+    )
+    time_since_first_visit = (
+        (today - first_visit.date()).days
+        if first_visit
+        else DEFAULT_TIME_SINCE_FIRST_VISIT
+    )
+
+    vehicle_year = row['vehicle_year']
+    vehicle_mileage = row['vehicle_mileage']
+
+    return {
+        'recency': recency,
+        'frequency': frequency,
+        'monetary_value': float(row['monetary_value'] or 0),
+        'avg_cost': float(row['avg_cost'] or 0),
+        'canceled_count': canceled_count,
+        'cancellation_rate': canceled_count / total_appointments if total_appointments > 0 else 0,
+        'time_since_first_visit': time_since_first_visit,
+        'vehicle_year': vehicle_year if vehicle_year is not None else today.year - DEFAULT_VEHICLE_AGE,
+        'vehicle_mileage': vehicle_mileage if vehicle_mileage is not None else DEFAULT_VEHICLE_MILEAGE,
+    }
+
+
+def feature_vector(features, feature_order):
+    return [features.get(feature, 0) for feature in feature_order]
+
+
+def iter_client_features(clients=None, chunk_size=CHUNK_SIZE, today=None, stored=False):
+    """
+    Strumieniuje `(wiersz, cechy)` dla wszystkich klientów.
+
+    `iterator()` na PostgreSQL używa kursora po stronie serwera, więc pamięć
+    nie rośnie z liczbą klientów. Przy `stored=True` cechy czytane są
+    z `ClientFeatures`; brakujące wiersze są liczone z historii i zapisywane.
+    """
+    if today is None:
+        today = timezone.now().date()
+
+    queryset = stored_features_queryset(clients) if stored else client_features_queryset(clients)
+    for row in queryset.iterator(chunk_size=chunk_size):
+        if stored and row['has_features'] is None:
+            refresh_client_features(row['id'])
+            row = client_features_queryset(Client.objects.filter(pk=row['id'])).get()
+        yield row, build_features(row, today)
+
+
+def get_client_features(client, today=None):
+    """Cechy pojedynczego klienta - odczyt jednego wiersza z `ClientFeatures`."""
+    clients = Client.objects.filter(pk=client.pk)
+    for _, features in iter_client_features(clients, today=today, stored=True):
+        return features
+    raise Client.DoesNotExist(client.pk)
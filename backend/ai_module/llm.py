@@ -0,0 +1,233 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = 'ai_module.llm.OpenAIBackend'
+DEFAULT_BASE_URL = 'https://api.openai.com/v1'
+DEFAULT_MODEL = 'gpt-3.5-turbo'
+# Limity czasu (s): nawiązanie połączenia i cała odpowiedź
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_CACHE_TTL = 3600
+DEFAULT_CACHE_SIZE = 512
+
+
+class LLMError(Exception):
+    """Błąd po stronie dostawcy modelu językowego (zła odpowiedź, limit zapytań)."""
+
+
+class LLMTimeout(LLMError):
+    """Model nie odpowiedział w czasie `AI_LLM_TIMEOUT`."""
+
+
+class ResponseCache:
+    """
+    Cache odpowiedzi LLM z czasem życia (TTL) i wyrzucaniem najstarszych (LRU).
+
+    Chroniony blokadą, bo widoki async pod WSGI działają w osobnych wątkach.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class OpenAIBackend:
+    """
+    Chat Completions przez HTTP (httpx) - zgodne z API OpenAI i serwerami,
+    które je naśladują (lokalny stub, proxy), wskazywanymi przez `base_url`.
+    """
+
+    def __init__(self, base_url=None, api_key=None, model=None, timeout=None, connect_timeout=None):
+        self.base_url = (base_url or getattr(settings, 'AI_LLM_BASE_URL', DEFAULT_BASE_URL)).rstrip('/')
+        self.api_key = api_key if api_key is not None else settings.API_KEY
+        self.model = model or getattr(settings, 'AI_LLM_MODEL', DEFAULT_MODEL)
+        self.timeout = timeout or getattr(settings, 'AI_LLM_TIMEOUT', DEFAULT_TIMEOUT)
+        self.connect_timeout = connect_timeout or getattr(settings, 'AI_LLM_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT)
+
+    def create_client(self):
+        import httpx
+
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={'Authorization': f'Bearer {self.api_key}'} if self.api_key else {},
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+
+    async def complete(self, client, messages, max_tokens, temperature):
+        import httpx
+
+        try:
+            response = await client.post('/chat/completions', json={
+                'model': self.model,
+                'messages': messages,
+                'max_tokens': max_tokens,
+                'temperature': temperature,
+            })
+            response.raise_for_status()
+            return response.json()['choices'][0]['message']['content'].strip()
+        except httpx.TimeoutException as e:
+            raise LLMTimeout(f"Przekroczono limit czasu odpowiedzi modelu ({self.timeout} s)") from e
+        except httpx.HTTPStatusError as e:
+            raise LLMError(f"Model zwrócił błąd {e.response.status_code}: {e.response.text[:200]}") from e
+        except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+            raise LLMError(f"Błąd komunikacji z modelem: {e}") from e
+
+
+class StubBackend:
+    """Deterministyczna odpowiedź bez sieci - do testów i benchmarków."""
+
+    model = 'stub'
+
+    def __init__(self, delay=0.0, **kwargs):
+        self.delay = delay
+
+    def create_client(self):
+        return None
+
+    async def complete(self, client, messages, max_tokens, temperature):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        prompt = messages[-1]['content'] if messages else ''
+        return f"[stub] {' '.join(prompt.split())[:max_tokens]}"
+
+
+class LLMClient:
+    """
+    Klient LLM współdzielony przez proces.
+
+    Zapytania wykonuje jedna pętla zdarzeń w wątku w tle, więc pula połączeń
+    keep-alive i semafor ograniczający równoległość są wspólne dla całego
+    procesu - także pod WSGI, gdzie każde async_to_sync ma własną, krótko
+    żyjącą pętlę. Identyczne prompty są obsługiwane z cache.
+    """
+
+    def __init__(self, backend=None, cache=None, max_concurrency=None):
+        if backend is None:
+            backend = import_string(getattr(settings, 'AI_LLM_BACKEND', DEFAULT_BACKEND))()
+        self.backend = backend
+        self.cache = cache if cache is not None else ResponseCache(
+            max_size=getattr(settings, 'AI_LLM_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+            ttl=getattr(settings, 'AI_LLM_CACHE_TTL', DEFAULT_CACHE_TTL),
+        )
+        self.max_concurrency = max_concurrency or getattr(settings, 'AI_LLM_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._http = None
+        self._semaphore = None
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='llm-client', daemon=True)
+                thread.start()
+                self._loop = loop
+                self._http = self._semaphore = None
+            return self._loop
+
+    def submit(self, coroutine):
+        """Uruchamia korutynę w pętli klienta; zwraca `concurrent.futures.Future` (także dla kodu synchronicznego)."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop())
+
+    def cache_key(self, messages, max_tokens, temperature):
+        payload = json.dumps(
+            [getattr(self.backend, 'model', ''), messages, max_tokens, temperature],
+            sort_keys=True, ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    async def _request(self, messages, max_tokens, temperature):
+        # Wykonywane zawsze w pętli wątku klienta
+        if self._semaphore is None:
+            self._http = self.backend.create_client()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await self.backend.complete(self._http, messages, max_tokens, temperature)
+
+    async def complete(self, messages, max_tokens=500, temperature=0.7, use_cache=True):
+        key = self.cache_key(messages, max_tokens, temperature)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        content = await asyncio.wrap_future(self.submit(self._request(messages, max_tokens, temperature)))
+
+        self.cache.set(key, content)
+        return content
+
+    def close(self):
+        """Zamyka pulę połączeń i zatrzymuje pętlę klienta."""
+        with self._lock:
+            loop, http = self._loop, self._http
+            self._loop = self._http = self._semaphore = None
+        if loop is None:
+            return
+        if http is not None:
+            asyncio.run_coroutine_threadsafe(http.aclose(), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient()
+    return _client
+
+
+def reset_llm_client():
+    """Porzuca współdzielonego klienta (np. po zmianie ustawień w testach)."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
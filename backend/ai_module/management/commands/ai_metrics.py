@@ -0,0 +1,37 @@
+import json
+from django.core.management.base import BaseCommand
+from ai_module.metrics import collect, reset_all
+
+class Command(BaseCommand):
+    help = ('Podsumowanie metryk modułu AI (opóźnienia etapów w ms, liczniki predykcji i zmian segmentów). '
+            'Łączy migawki wszystkich procesów z katalogu AI_METRICS_DIR (przy kilku serwerach - wspólny wolumen).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Wypisz surowe podsumowanie jako JSON')
+        parser.add_argument('--reset', action='store_true', help='Wyzeruj metryki po wypisaniu')
+
+    def handle(self, *args, **options):
+        summary = collect()
+
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2, ensure_ascii=False))
+        elif not summary['counters'] and not summary['histograms']:
+            self.stdout.write(self.style.WARNING("Brak zebranych metryk."))
+        else:
+            self.stdout.write(f"Procesy: {summary['processes']}, dane od {summary['since']}")
+            if summary['histograms']:
+                self.stdout.write(self.style.MIGRATE_HEADING("\nHistogramy"))
+                self.stdout.write(f"{'nazwa':<34}{'liczba':>9}{'śr.':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>10}")
+                for name, stats in summary['histograms'].items():
+                    values = [stats[key] for key in ('avg', 'p50', 'p95', 'p99', 'max')]
+                    self.stdout.write(f"{name:<34}{stats['count']:>9}" + ''.join(
+                        f"{value:>{10 if i in (0, 4) else 9}.2f}" for i, value in enumerate(values)
+                    ))
+            if summary['counters']:
+                self.stdout.write(self.style.MIGRATE_HEADING("\nLiczniki"))
+                for name, value in summary['counters'].items():
+                    self.stdout.write(f"{name:<34}{value:>9}")
+
+        if options['reset']:
+            reset_all()
+            self.stdout.write(self.style.SUCCESS("Metryki wyzerowane."))
@@ -0,0 +1,17 @@
+import time
+from django.core.management.base import BaseCommand
+from ai_module.duration import INDEX_PATH, build_index
+
+class Command(BaseCommand):
+    help = 'Buduje (przyrostowo) indeks historycznych napraw do szacowania czasu naprawy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Przebuduj indeks od zera zamiast dopisywać zmiany')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rows, added = build_index(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Indeks czasu napraw zapisano w: {INDEX_PATH} "
+            f"({rows} napraw, dodano/zaktualizowano {added}, {time.perf_counter() - started:.2f} s)"
+        ))
@@ -0,0 +1,17 @@
+import time
+from django.core.management.base import BaseCommand
+from ai_module.recommendations import INDEX_PATH, build_index
+
+class Command(BaseCommand):
+    help = 'Buduje (przyrostowo) indeks współwystępowania prac do rekomendacji'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Przebuduj indeks od zera zamiast dopisywać nowe wizyty')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        sources, added = build_index(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Indeks rekomendacji zapisano w: {INDEX_PATH} "
+            f"({sources} wizyt i wpisów serwisowych, dodano {added}, {time.perf_counter() - started:.2f} s)"
+        ))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from clients.models import Client
+from ai_module.feature_store import check_client_features, rebuild_client_features
+
+class Command(BaseCommand):
+    help = 'Porównuje magazyn cech klientów (ClientFeatures) z pełną agregacją wizyt'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workshop', type=str, help='ID warsztatu (domyślnie wszyscy klienci)')
+        parser.add_argument('--fix', action='store_true', help='Przebudowuje wiersze, które się nie zgadzają')
+        parser.add_argument('--limit', type=int, default=20, help='Ile rozbieżności wypisać')
+
+    def handle(self, *args, **options):
+        clients = Client.objects.all()
+        if options['workshop']:
+            clients = clients.filter(workshop__id=options['workshop'])
+
+        mismatches = check_client_features(clients)
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("Magazyn cech jest spójny z historią wizyt."))
+            return
+
+        for client_id, field, stored, expected in mismatches[:options['limit']]:
+            if field is None:
+                self.stdout.write(self.style.WARNING(f"Klient {client_id}: brak wiersza w magazynie cech"))
+            else:
+                self.stdout.write(self.style.WARNING(f"Klient {client_id}: {field} = {stored}, oczekiwano {expected}"))
+
+        client_ids = {client_id for client_id, *_ in mismatches}
+        self.stdout.write(self.style.WARNING(f"Rozbieżności: {len(mismatches)} u {len(client_ids)} klientów."))
+
+        if options['fix']:
+            rebuilt = rebuild_client_features(Client.objects.filter(pk__in=client_ids))
+            self.stdout.write(self.style.SUCCESS(f"Przebudowano {rebuilt} wierszy."))
+        else:
+            raise CommandError("Magazyn cech jest niespójny - uruchom z --fix lub rebuild_client_features.")
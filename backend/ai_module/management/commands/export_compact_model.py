@@ -0,0 +1,38 @@
+import json
+import joblib
+from django.core.management.base import BaseCommand, CommandError
+from ai_module.compact import CompactForest, export_pipeline
+from ai_module.registry import COMPACT_MODEL_PATH, METADATA_PATH, MODEL_PATH, file_checksum, write_atomically
+
+class Command(BaseCommand):
+    help = 'Eksportuje model segmentacji (joblib) do kompaktowego formatu .npz'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', type=str, default=COMPACT_MODEL_PATH, help='Ścieżka pliku .npz')
+
+    def handle(self, *args, **options):
+        try:
+            with open(METADATA_PATH, 'r') as f:
+                metadata = json.load(f)
+            model = joblib.load(MODEL_PATH)
+        except FileNotFoundError as e:
+            raise CommandError(f"Model lub metadane nie zostały znalezione: {e}")
+
+        features = metadata['features']
+        version = str(metadata.get('version') or '')
+        export_pipeline(model, options['output'], features, version=version)
+
+        # Sprawdzenie: kompaktowy model musi zwracać te same klasy co oryginał
+        compact = CompactForest.load(options['output'])
+        if list(compact.classes_) != [str(c) for c in model.classes_]:
+            raise CommandError("Klasy modelu kompaktowego nie zgadzają się z oryginałem.")
+
+        if options['output'] == COMPACT_MODEL_PATH:
+            # Nowa suma kontrolna - inaczej rejestr uzna plik za niepasujący do metadanych
+            metadata.setdefault('checksums', {})['compact'] = file_checksum(COMPACT_MODEL_PATH)
+            write_atomically(METADATA_PATH, lambda f: f.write(json.dumps(metadata).encode('utf-8')))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Model kompaktowy zapisano w: {options['output']} "
+            f"({len(compact.roots)} drzew, {len(compact.feature)} węzłów, głębokość {compact.depth})"
+        ))
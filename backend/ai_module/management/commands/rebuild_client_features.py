@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from clients.models import Client
+from ai_module.feature_store import CHUNK_SIZE, rebuild_client_features
+
+class Command(BaseCommand):
+    help = 'Przebudowuje magazyn cech klientów (ClientFeatures) z pełnej historii wizyt'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workshop', type=str, help='ID warsztatu (domyślnie wszyscy klienci)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Liczba klientów zapisywanych w jednej transakcji')
+
+    def handle(self, *args, **options):
+        clients = Client.objects.all()
+        if options['workshop']:
+            clients = clients.filter(workshop__id=options['workshop'])
+
+        def progress(rebuilt):
+            self.stdout.write(f"Przebudowano {rebuilt} wierszy")
+
+        rebuilt = rebuild_client_features(clients, chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Magazyn cech przebudowany: {rebuilt} klientów."))
@@ -1,218 +1,176 @@
-# import os
-# import sys
-# import django
-
-# project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-# sys.path.append(project_root)
-# os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
-# django.setup()
-
-# import json
-# import numpy as np
-# import pandas as pd
-# from django.utils import timezone
-# from django.db.models import Sum, Avg, Max, Min
-# from django.core.management.base import BaseCommand
-# from sklearn.ensemble import RandomForestClassifier
-# from sklearn.model_selection import StratifiedKFold, GridSearchCV
-# from sklearn.metrics import classification_report, confusion_matrix
-# from imblearn.over_sampling import SMOTE
-# from sklearn.preprocessing import StandardScaler
-# from sklearn.pipeline import Pipeline
-# import matplotlib.pyplot as plt
-# import seaborn as sns
-# import joblib
-
-# class Command(BaseCommand):
-#     help = 'Trenuje model klasyfikacji klientów'
-
-#     def handle(self, *args, **kwargs):
-#         def prepare_dataset():
-#             from clients.models import Client
-#             self.stdout.write(self.style.NOTICE("Rozpoczęto przygotowanie danych..."))
-#             clients = Client.objects.exclude(segment__isnull=True)
-#             today = timezone.now().date()
-#             data = []
-
-#             for client in clients:
-#                 try:
-#                     appointments = client.appointments.all()
-#                     completed_appointments = appointments.filter(status='completed')
-#                     canceled_appointments = appointments.filter(status='canceled')
-
-#                     frequency = completed_appointments.count()
-#                     monetary_value = completed_appointments.aggregate(total_spent=Sum('total_cost'))['total_spent'] or 0
-#                     avg_cost = completed_appointments.aggregate(avg_spent=Avg('total_cost'))['avg_spent'] or 0
-#                     canceled_count = canceled_appointments.count()
-#                     total_appointments = frequency + canceled_count
-
-#                     cancellation_rate = canceled_count / total_appointments if total_appointments > 0 else 0
-
-#                     first_appointment_date = completed_appointments.aggregate(first_date=Min('scheduled_time'))['first_date']
-#                     last_appointment_date = completed_appointments.aggregate(last_date=Max('scheduled_time'))['last_date']
-
-#                     recency = (today - last_appointment_date.date()).days if last_appointment_date else (today - client.created_at.date()).days
-#                     time_since_first_visit = (today - first_appointment_date.date()).days if first_appointment_date else 0
-
-#                     vehicles = client.vehicles.all()
-#                     if vehicles.exists():
-#                         latest_vehicle = vehicles.order_by('-year').first()
-#                         vehicle_year = latest_vehicle.year
-#                         vehicle_mileage = latest_vehicle.mileage
-#                     else:
-#                         vehicle_year = None
-#                         vehicle_mileage = None
-
-#                     data.append({
-#                         'client_id': client.id,
-#                         'recency': recency,
-#                         'frequency': frequency,
-#                         'monetary_value': monetary_value,
-#                         'avg_cost': avg_cost,
-#                         'canceled_count': canceled_count,
-#                         'cancellation_rate': cancellation_rate,
-#                         'time_since_first_visit': time_since_first_visit,
-#                         'vehicle_year': vehicle_year,
-#                         'vehicle_mileage': vehicle_mileage,
-#                         'segment': client.segment
-#                     })
-#                 except Exception as e:
-#                     self.stdout.write(self.style.ERROR(f"Błąd podczas przetwarzania klienta {client.id}: {e}"))
-
-#             df = pd.DataFrame(data)
-#             df['vehicle_year'] = df['vehicle_year'].fillna(df['vehicle_year'].median())
-#             df['vehicle_mileage'] = df['vehicle_mileage'].fillna(df['vehicle_mileage'].median())
-
-#             df['recency'] = df['recency'].fillna(365)
-#             df['frequency'] = df['frequency'].fillna(0)
-#             df['monetary_value'] = df['monetary_value'].fillna(0)
-#             df['avg_cost'] = df['avg_cost'].fillna(0)
-#             df['canceled_count'] = df['canceled_count'].fillna(0)
-#             df['cancellation_rate'] = df['cancellation_rate'].fillna(0)
-#             df['time_since_first_visit'] = df['time_since_first_visit'].fillna(365)
-
-#             self.stdout.write(self.style.SUCCESS(f"Przygotowano dane dla {len(data)} klientów"))
-#             self.stdout.write(self.style.NOTICE(f"Rozkład klas:\n{df['segment'].value_counts()}"))
-#             return df
-
-#         def balance_data(X, y):
-#             self.stdout.write(self.style.NOTICE("Rozpoczynanie balansowania danych z SMOTE..."))
-#             smote = SMOTE(random_state=42)
-#             try:
-#                 X_resampled, y_resampled = smote.fit_resample(X, y)
-#                 self.stdout.write(self.style.SUCCESS("Balansowanie zakończone. SMOTE zastosowano."))
-#             except Exception as e:
-#                 self.stdout.write(self.style.ERROR(f"Błąd podczas balansowania danych: {e}"))
-#                 raise e
-
-#             return X_resampled, y_resampled
-
-#         def plot_confusion_matrix(y_true, y_pred, labels, title):
-#             cm = confusion_matrix(y_true, y_pred, labels=labels)
-#             plt.figure(figsize=(8,6))
-#             sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', xticklabels=labels, yticklabels=labels)
-#             plt.xlabel('Predicted Label')
-#             plt.ylabel('True Label')
-#             plt.title(title)
-#             plt.show()
-
-#         def train_advanced_model():
-#             self.stdout.write(self.style.NOTICE("Rozpoczęto trening modelu..."))
-#             df = prepare_dataset()
-
-#             features = ['recency', 'frequency', 'monetary_value', 'avg_cost', 'canceled_count',
-#                         'cancellation_rate', 'time_since_first_visit', 'vehicle_year', 'vehicle_mileage']
-#             X = df[features]
-#             y = df['segment']
-#             X = X.fillna(X.median())
-#             X_balanced, y_balanced = balance_data(X, y)
-
-#             pipeline = Pipeline([
-#                 ('scaler', StandardScaler()),
-#                 ('classifier', RandomForestClassifier(random_state=42))
-#             ])
-
-#             param_grid = {
-#                 'classifier__n_estimators': [50, 100, 200],
-#                 'classifier__max_depth': [10, 20, 30],
-#                 'classifier__min_samples_split': [2, 5, 10],
-#                 'classifier__min_samples_leaf': [1, 2, 4]
-#             }
-
-#             grid_search = GridSearchCV(
-#                 pipeline,
-#                 param_grid,
-#                 scoring='accuracy',
-#                 cv=StratifiedKFold(n_splits=5, shuffle=True, random_state=42),
-#                 n_jobs=-1,
-#                 verbose=1
-#             )
-
-#             try:
-#                 grid_search.fit(X_balanced, y_balanced)
-#                 best_model = grid_search.best_estimator_
-#                 self.stdout.write(self.style.SUCCESS(f"Grid Search zakończony. Najlepsze parametry: {grid_search.best_params_}"))
-#                 self.stdout.write(self.style.SUCCESS(f"Najlepsza dokładność w walidacji: {grid_search.best_score_:.2f}"))
-#             except Exception as e:
-#                 self.stdout.write(self.style.ERROR(f"Błąd podczas Grid Search: {e}"))
-#                 raise e
-
-#             y_pred = best_model.predict(X_balanced)
-#             self.stdout.write(self.style.NOTICE("Raport klasyfikacji:"))
-#             self.stdout.write(classification_report(y_balanced, y_pred))
-
-#             plot_confusion_matrix(y_balanced, y_pred, labels=np.unique(y_balanced), title="Macierz konfuzji")
-
-#             model_path = os.path.join(os.path.dirname(__file__), 'advanced_client_segment_classifier.joblib')
-#             joblib.dump(best_model, model_path)
-
-#             metadata = {
-#                 'best_params': grid_search.best_params_,
-#                 'features': features,
-#                 'accuracy': grid_search.best_score_
-#             }
-#             metadata_path = os.path.join(os.path.dirname(__file__), 'model_metadata.json')
-#             with open(metadata_path, 'w') as f:
-#                 json.dump(metadata, f)
-
-#             self.stdout.write(self.style.SUCCESS(f"Model zapisano w: {model_path}"))
-#             self.stdout.write(self.style.SUCCESS(f"Metadane modelu zapisano jako: {metadata_path}"))
-
-#         train_advanced_model()
-
-
-# # Importowanie bibliotek
-# # Django ORM do pobierania danych klientów.
-# # Pandas, NumPy do analizy i przetwarzania danych.
-# # Scikit-learn, Imbalanced-learn do uczenia maszynowego i balansowania danych.
-# # Matplotlib, Seaborn do wizualizacji.
-# # Joblib do zapisu modelu.
-# # 3. Pobieranie i przygotowanie danych klientów
-# # Funkcja prepare_dataset():
-
-# # Pobiera klientów, którzy mają przypisany segment.
-# # Liczy liczbę wizyt, wydane pieniądze, średni koszt usługi, wskaźnik anulowanych wizyt.
-# # Wylicza recency (czas od ostatniej wizyty) i czas od pierwszej wizyty.
-# # Pobiera dane o pojeździe klienta (rok, przebieg).
-# # Tworzy tabelę Pandas i uzupełnia brakujące wartości medianą.
-# # 4. Balansowanie danych z SMOTE
-# # Funkcja balance_data() stosuje SMOTE (Synthetic Minority Over-sampling Technique) do zbalansowania klas klientów, zapobiegając problemowi niezrównoważonego zbioru danych.
-
-# # 5. Trening modelu Random Forest
-# # Funkcja train_advanced_model():
-
-# # Przygotowuje zbiór danych (prepare_dataset()).
-# # Balansuje dane (balance_data()).
-# # Tworzy Pipeline:
-# # Skalowanie cech (StandardScaler).
-# # Klasyfikator RandomForestClassifier.
-# # Grid Search CV – testuje różne parametry modelu.
-# # Trenuje model na 5-krotnej walidacji krzyżowej (StratifiedKFold).
-# # Wyświetla najlepsze parametry i dokładność.
-# # Generuje raport klasyfikacji oraz macierz konfuzji.
-# # Zapisuje model i jego metadane w plikach .joblib i .json.
-# # 6. Kluczowe funkcjonalności
-# # Optymalizacja hiperparametrów poprzez Grid Search.
-# # Balansowanie danych klientów.
-# # Zapisanie modelu do ponownego wykorzystania.
-# # Wizualizacja wyników (macierz konfuzji).
\ No newline at end of file
+import json
+import os
+import numpy as np
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from clients.models import Client
+from ai_module.features import FEATURE_NAMES, feature_vector, iter_client_features
+from ai_module.compact import export_pipeline
+from ai_module.registry import COMPACT_MODEL_PATH, METADATA_PATH, MODEL_PATH, file_checksum, write_atomically
+
+# Górny limit wierszy trzymanych w pamięci (reszta jest próbkowana równomiernie)
+MAX_ROWS = 1_000_000
+CHUNK_SIZE = 5000
+
+PARAM_GRID = {
+    'classifier__n_estimators': [50, 100, 200],
+    'classifier__max_depth': [10, 20, 30],
+    'classifier__min_samples_split': [2, 5, 10],
+    'classifier__min_samples_leaf': [1, 2, 4],
+}
+
+
+def default_n_jobs():
+    # Domyślnie połowa rdzeni - trening z beat nie zagłodzi workerów i bazy na tej samej maszynie
+    return getattr(settings, 'AI_TRAIN_N_JOBS', None) or max(1, (os.cpu_count() or 2) // 2)
+
+
+class Command(BaseCommand):
+    help = 'Trenuje model klasyfikacji klientów'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-rows', type=int, default=MAX_ROWS, help='Maksymalna liczba klientów w zbiorze treningowym (próbka równomierna)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rozmiar porcji przy strumieniowaniu danych z bazy')
+        parser.add_argument('--n-jobs', type=int, default=None,
+                            help='Liczba procesów dla GridSearchCV (-1 = wszystkie rdzenie; domyślnie AI_TRAIN_N_JOBS lub połowa rdzeni)')
+        parser.add_argument('--cv', type=int, default=5, help='Liczba podziałów walidacji krzyżowej')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        options['n_jobs'] = options.get('n_jobs') or default_n_jobs()
+        X, y = self.prepare_dataset(options['max_rows'], options['chunk_size'], options['seed'])
+        if len(y) == 0:
+            raise CommandError("Brak klientów z przypisanym segmentem - nie ma na czym trenować.")
+        if len(set(y)) < 2:
+            raise CommandError("Do treningu potrzebne są co najmniej dwa segmenty.")
+
+        X_balanced, y_balanced = self.balance_data(X, y, options['seed'])
+        best_model, grid_search = self.train(X_balanced, y_balanced, options)
+        self.save_model(best_model, grid_search, n_samples=len(y), classes=Counter(y))
+
+    def prepare_dataset(self, max_rows, chunk_size, seed):
+        """
+        Strumieniuje cechy klientów z segmentem jednym zapytaniem do bazy.
+
+        Wiersze trafiają do prealokowanej macierzy o rozmiarze liczby klientów
+        (najwyżej `max_rows`); gdy klientów jest więcej, próbkowanie rezerwuarowe
+        (algorytm R) utrzymuje równomierną próbkę przy stałym zużyciu pamięci.
+        """
+        self.stdout.write(self.style.NOTICE("Rozpoczęto przygotowanie danych..."))
+        rng = np.random.default_rng(seed)
+        clients = Client.objects.exclude(segment__isnull=True)
+        # Klienci dopisani po zliczeniu trafiają do próbki rezerwuarowej
+        max_rows = min(max_rows, clients.count())
+        X = np.empty((max_rows, len(FEATURE_NAMES)), dtype=np.float64)
+        y = np.empty(max_rows, dtype=object)
+
+        seen = 0
+        for row, features in iter_client_features(clients, chunk_size=chunk_size):
+            if seen < max_rows:
+                slot = seen
+            else:
+                slot = rng.integers(0, seen + 1)
+                if slot >= max_rows:
+                    seen += 1
+                    continue
+            X[slot] = feature_vector(features, FEATURE_NAMES)
+            y[slot] = row['segment']
+            seen += 1
+            if seen % (chunk_size * 20) == 0:
+                self.stdout.write(f"Wczytano {seen} klientów")
+
+        size = min(seen, max_rows)
+        X, y = X[:size], y[:size].astype(str)
+
+        self.stdout.write(self.style.SUCCESS(f"Przygotowano dane dla {size} klientów (z {seen})"))
+        self.stdout.write(self.style.NOTICE(f"Rozkład klas: {dict(sorted(Counter(y).items()))}"))
+        return X, y
+
+    def balance_data(self, X, y, seed):
+        from imblearn.over_sampling import SMOTE
+
+        self.stdout.write(self.style.NOTICE("Rozpoczynanie balansowania danych z SMOTE..."))
+        smallest_class = min(Counter(y).values())
+        if smallest_class < 2:
+            self.stdout.write(self.style.WARNING("Za mało próbek w najmniejszej klasie - pomijam SMOTE."))
+            return X, y
+
+        smote = SMOTE(random_state=seed, k_neighbors=min(5, smallest_class - 1))
+        try:
+            X_resampled, y_resampled = smote.fit_resample(X, y)
+            self.stdout.write(self.style.SUCCESS("Balansowanie zakończone. SMOTE zastosowano."))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"Błąd podczas balansowania danych: {e}"))
+            raise e
+
+        return X_resampled, y_resampled
+
+    def train(self, X, y, options):
+        import pandas as pd
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.metrics import classification_report, confusion_matrix
+        from sklearn.model_selection import GridSearchCV, StratifiedKFold
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+
+        self.stdout.write(self.style.NOTICE("Rozpoczęto trening modelu..."))
+        X = pd.DataFrame(X, columns=FEATURE_NAMES)
+
+        pipeline = Pipeline([
+            ('scaler', StandardScaler()),
+            ('classifier', RandomForestClassifier(random_state=options['seed']))
+        ])
+
+        n_splits = max(2, min(options['cv'], min(Counter(y).values())))
+        grid_search = GridSearchCV(
+            pipeline,
+            PARAM_GRID,
+            scoring='accuracy',
+            cv=StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=options['seed']),
+            n_jobs=options['n_jobs'],
+            verbose=1
+        )
+
+        try:
+            grid_search.fit(X, y)
+            best_model = grid_search.best_estimator_
+            self.stdout.write(self.style.SUCCESS(f"Grid Search zakończony. Najlepsze parametry: {grid_search.best_params_}"))
+            self.stdout.write(self.style.SUCCESS(f"Najlepsza dokładność w walidacji: {grid_search.best_score_:.2f}"))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"Błąd podczas Grid Search: {e}"))
+            raise e
+
+        y_pred = best_model.predict(X)
+        labels = np.unique(y)
+        self.stdout.write(self.style.NOTICE("Raport klasyfikacji:"))
+        self.stdout.write(classification_report(y, y_pred))
+        self.stdout.write(self.style.NOTICE(f"Macierz konfuzji ({', '.join(labels)}):"))
+        self.stdout.write(str(confusion_matrix(y, y_pred, labels=labels)))
+
+        return best_model, grid_search
+
+    def save_model(self, best_model, grid_search, n_samples, classes):
+        import joblib
+
+        version = timezone.now().strftime('%Y%m%d%H%M%S')
+        metadata = {
+            'version': version,
+            'trained_at': timezone.now().isoformat(),
+            'best_params': grid_search.best_params_,
+            'features': FEATURE_NAMES,
+            'accuracy': grid_search.best_score_,
+            'n_samples': n_samples,
+            'classes': {str(label): count for label, count in sorted(classes.items())},
+        }
+
+        # Metadane na końcu, z sumami kontrolnymi - rejestr nie załaduje modelu z niepełnego zestawu plików
+        write_atomically(MODEL_PATH, lambda f: joblib.dump(best_model, f))
+        export_pipeline(best_model, COMPACT_MODEL_PATH, FEATURE_NAMES, version=version)
+        metadata['checksums'] = {'model': file_checksum(MODEL_PATH), 'compact': file_checksum(COMPACT_MODEL_PATH)}
+        write_atomically(METADATA_PATH, lambda f: f.write(json.dumps(metadata).encode('utf-8')))
+
+        self.stdout.write(self.style.SUCCESS(f"Model zapisano w: {MODEL_PATH} (wersja {version})"))
+        self.stdout.write(self.style.SUCCESS(f"Model kompaktowy zapisano w: {COMPACT_MODEL_PATH}"))
+        self.stdout.write(self.style.SUCCESS(f"Metadane modelu zapisano jako: {METADATA_PATH}"))
@@ -0,0 +1,347 @@
+import bisect
+import contextvars
+import glob
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Górne granice kubełków histogramów opóźnień (ms); ostatni kubełek to "powyżej"
+LATENCY_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+# Kubełki dla liczności (np. wywołań predykcji na jedno żądanie)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+# Katalog migawek procesów (poza kodem); przy kilku serwerach musi być współdzielony (AI_METRICS_DIR)
+DEFAULT_METRICS_DIR = os.path.join(tempfile.gettempdir(), 'workshop_ai_metrics')
+DEFAULT_FLUSH_INTERVAL = 10.0
+# Migawki procesów z innych hostów (których PID-u nie da się sprawdzić) wygasają po tym czasie
+DEFAULT_SNAPSHOT_TTL = 7 * 24 * 3600
+# Plik w katalogu migawek, którego mtime to chwila ostatniego `reset_all()`
+RESET_MARKER = '.reset'
+
+
+class Histogram:
+    """Histogram o stałych kubełkach - tani zapis, łączenie przez sumowanie."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def to_dict(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts),
+                'count': self.count, 'sum': self.sum, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data['buckets'])
+        histogram.counts = list(data['counts'])
+        histogram.count = data['count']
+        histogram.sum = data['sum']
+        histogram.max = data['max']
+        return histogram
+
+    def merge(self, other):
+        if other.buckets != self.buckets:
+            raise ValueError("Nie można łączyć histogramów o różnych kubełkach")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Górna granica kubełka, w którym leży kwantyl `q` (dla ostatniego - maksimum)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'avg': round(self.sum / self.count, 3) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': round(self.max, 3) if self.count else None,
+        }
+
+
+class Metrics:
+    """
+    Liczniki i histogramy modułu AI w pamięci procesu.
+
+    Zapis jest tylko operacją na słowniku pod blokadą. Co `AI_METRICS_FLUSH_INTERVAL`
+    sekund migawka procesu trafia do pliku JSON w `AI_METRICS_DIR` (osobny plik
+    na proces, bez fsync - to tylko statystyki), a `collect()` łączy migawki
+    żyjących procesów - także workerów, w których komenda `ai_metrics` nie działa.
+    Konstruktor nie czyta ustawień, więc moduł można importować przed
+    konfiguracją Django.
+    """
+
+    def __init__(self, flush_interval=None):
+        self.flush_interval = flush_interval
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+        self.process_name = f'{self.host}-{self.pid}'
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._started_at = time.time()
+        self._last_flush = time.monotonic()
+
+    def _interval(self):
+        if self.flush_interval is not None:
+            return self.flush_interval
+        return getattr(settings, 'AI_METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        self._maybe_flush()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+        self._maybe_flush()
+
+    @contextmanager
+    def timer(self, name):
+        """Mierzy blok w ms do histogramu `name`; wyjątek zwiększa licznik `<name>.errors`."""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.incr(f'{name}.errors')
+            raise
+        finally:
+            self.observe(name, (time.perf_counter() - started) * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'host': self.host,
+                'pid': self.pid,
+                'started_at': _isoformat(self._started_at),
+                'updated_at': _isoformat(time.time()),
+                'counters': dict(self._counters),
+                'histograms': {name: histogram.to_dict() for name, histogram in self._histograms.items()},
+            }
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self._interval():
+            self.flush()
+
+    def flush(self):
+        """Zapisuje migawkę procesu na dysk; błąd zapisu nie może zatrzymać predykcji."""
+        self._last_flush = time.monotonic()
+        directory = metrics_dir()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            if _reset_time(directory) > self._started_at:
+                # reset_all() wywołany w innym procesie - zaczynamy od zera
+                self.reset()
+            path = os.path.join(directory, f'{self.process_name}.json')
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except Exception:
+            logger.exception("Nie udało się zapisać metryk modułu AI w %s", directory)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._started_at = time.time()
+
+    def _after_fork(self):
+        # Proces potomny (prefork) nie może raportować liczników rodzica pod własnym PID-em
+        self._lock = threading.Lock()
+        self.pid = os.getpid()
+        self.process_name = f'{self.host}-{self.pid}'
+        self.reset()
+        self._last_flush = time.monotonic()
+
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc).isoformat()
+
+
+def metrics_dir():
+    return getattr(settings, 'AI_METRICS_DIR', DEFAULT_METRICS_DIR)
+
+
+def _snapshot_files():
+    return glob.glob(os.path.join(glob.escape(metrics_dir()), '*.json'))
+
+
+def _reset_time(directory):
+    try:
+        return os.stat(os.path.join(directory, RESET_MARKER)).st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+def _process_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Proces istnieje, tylko należy do innego użytkownika
+        pass
+    return True
+
+
+def load_snapshots():
+    """
+    Migawki żyjących procesów.
+
+    Pliki zakończonych procesów z tego hosta są usuwane od razu (po restarcie
+    liczniki nie rosną o poprzednie życie procesu), z innych hostów - po
+    `AI_METRICS_SNAPSHOT_TTL`. Migawki sprzed `reset_all()` są pomijane.
+    """
+    ttl = getattr(settings, 'AI_METRICS_SNAPSHOT_TTL', DEFAULT_SNAPSHOT_TTL)
+    now = time.time()
+    host = socket.gethostname()
+    reset_at = _isoformat(_reset_time(metrics_dir()))
+    snapshots = []
+    for path in _snapshot_files():
+        try:
+            if now - os.path.getmtime(path) >= ttl:
+                os.remove(path)
+                continue
+            with open(path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if snapshot.get('host') == host and not _process_alive(snapshot.get('pid')):
+                os.remove(path)
+                continue
+            if snapshot['updated_at'] >= reset_at:
+                snapshots.append(snapshot)
+        except (OSError, ValueError, KeyError):
+            # Plik usunięty przez inny proces albo uszkodzony - pomijamy
+            logger.warning("Pominięto migawkę metryk %s", path)
+    return snapshots
+
+
+metrics = Metrics()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=metrics._after_fork)
+
+
+def collect():
+    """Łączy migawki wszystkich procesów w podsumowanie (liczniki + kwantyle histogramów)."""
+    metrics.flush()
+    snapshots = load_snapshots()
+
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, value in snapshot['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+        for name, data in snapshot['histograms'].items():
+            histogram = Histogram.from_dict(data)
+            if name in histograms:
+                histograms[name].merge(histogram)
+            else:
+                histograms[name] = histogram
+
+    return {
+        'processes': len(snapshots),
+        'since': min((snapshot['started_at'] for snapshot in snapshots), default=None),
+        'counters': dict(sorted(counters.items())),
+        'histograms': {name: histograms[name].summary() for name in sorted(histograms)},
+    }
+
+
+def reset_all():
+    """
+    Zeruje metryki wszystkich procesów.
+
+    Ten proces zeruje się od razu, migawki są usuwane, a pozostałe procesy
+    widzą nowszy `RESET_MARKER` przy najbliższym zapisie i same zaczynają od zera
+    (zdarzenia z okresu między resetem a tym zapisem też przepadają).
+    """
+    directory = metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, RESET_MARKER), 'w', encoding='utf-8') as f:
+        f.write(_isoformat(time.time()))
+    metrics.reset()
+    for path in _snapshot_files():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Liczba predykcji segmentu w bieżącym żądaniu HTTP (None poza żądaniem)
+_predictions_in_request = contextvars.ContextVar('ai_predictions_in_request', default=None)
+
+
+def count_prediction():
+    calls = _predictions_in_request.get()
+    if calls is not None:
+        _predictions_in_request.set(calls + 1)
+
+
+class RequestMetricsMiddleware:
+    """Zapisuje, ile razy w jednym żądaniu wywołano `predict_segment` (gdy choć raz)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _finish(self, token):
+        calls = _predictions_in_request.get()
+        _predictions_in_request.reset(token)
+        if calls:
+            metrics.observe('predict.calls_per_request', calls, buckets=COUNT_BUCKETS)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _predictions_in_request.set(0)
+        try:
+            return self.get_response(request)
+        finally:
+            self._finish(token)
+
+    async def __acall__(self, request):
+        token = _predictions_in_request.set(0)
+        try:
+            return await self.get_response(request)
+        finally:
+            self._finish(token)
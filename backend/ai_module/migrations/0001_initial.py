@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('clients', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientFeatures',
+            fields=[
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='features', serialize=False, to='clients.client')),
+                ('completed_count', models.IntegerField(default=0)),
+                ('completed_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('canceled_count', models.IntegerField(default=0)),
+                ('first_completed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_completed_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
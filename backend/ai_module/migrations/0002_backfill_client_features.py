@@ -0,0 +1,48 @@
+from decimal import Decimal
+from django.db import migrations
+from django.db.models import Count, DecimalField, Max, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 2000
+
+
+def backfill_client_features(apps, schema_editor):
+    # Wiersze dla istniejących klientów z pełnej historii wizyt (jak rebuild_client_features) -
+    # inaczej pierwsze przeliczenie segmentów budowałoby je po jednym kliencie
+    Client = apps.get_model('clients', 'Client')
+    ClientFeatures = apps.get_model('ai_module', 'ClientFeatures')
+    completed = Q(appointments__status='completed')
+    rows = (
+        Client.objects.filter(features__isnull=True)
+        .order_by()
+        .annotate(
+            completed_count=Count('appointments', filter=completed),
+            completed_total=Coalesce(
+                Sum('appointments__total_cost', filter=completed), Value(Decimal('0')),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+            canceled_count=Count('appointments', filter=Q(appointments__status='canceled')),
+            first_completed_at=Min('appointments__scheduled_time', filter=completed),
+            last_completed_at=Max('appointments__scheduled_time', filter=completed),
+        )
+        .values('id', 'completed_count', 'completed_total', 'canceled_count', 'first_completed_at', 'last_completed_at')
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(ClientFeatures(client_id=row.pop('id'), **row))
+        if len(batch) == BATCH_SIZE:
+            ClientFeatures.objects.bulk_create(batch)
+            batch.clear()
+    ClientFeatures.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_module', '0001_initial'),
+        ('appointments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_client_features, migrations.RunPython.noop),
+    ]
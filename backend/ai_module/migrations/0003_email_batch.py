@@ -0,0 +1,42 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:11
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_module', '0002_backfill_client_features'),
+        ('clients', '0001_initial'),
+        ('workshops', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailBatchJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('running', 'W trakcie'), ('completed', 'Zakończone'), ('canceled', 'Anulowane')], default='running', max_length=15)),
+                ('total', models.IntegerField(default=0)),
+                ('unique_prompts', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('workshop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='email_batches', to='workshops.workshop')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EmailBatchResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(blank=True, max_length=254, null=True)),
+                ('content', models.TextField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='ai_module.emailbatchjob')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='email_batch_results', to='clients.client')),
+            ],
+        ),
+    ]
@@ -1 +1,78 @@
+import uuid
 from django.db import models
+from clients.models import Client
+from workshops.models import Workshop
+
+
+class ClientFeatures(models.Model):
+    """
+    Zagregowana historia wizyt klienta, utrzymywana przyrostowo.
+
+    Liczniki i sumy są aktualizowane różnicowo (F-expressions) przy każdej
+    zmianie statusu lub kosztu wizyty, więc predykcja segmentu czyta jeden
+    wiersz zamiast agregować całą historię.
+    """
+    client = models.OneToOneField(
+        Client,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='features'
+    )
+    completed_count = models.IntegerField(default=0)
+    completed_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    canceled_count = models.IntegerField(default=0)
+    first_completed_at = models.DateTimeField(null=True, blank=True)
+    last_completed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Features for {self.client_id}"
+
+
+class EmailBatchJob(models.Model):
+    """
+    Zbiorcze generowanie e-maili (ai_module.email_batch) - postęp widoczny
+    z każdego procesu, nie tylko z tego, który strumieniuje wyniki.
+    """
+    STATUS_CHOICES = [
+        ('running', 'W trakcie'),
+        ('completed', 'Zakończone'),
+        ('canceled', 'Anulowane'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    workshop = models.ForeignKey(
+        Workshop,
+        on_delete=models.CASCADE,
+        related_name='email_batches'
+    )
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='running')
+    total = models.IntegerField(default=0)
+    unique_prompts = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Email batch {self.id} ({self.status})"
+
+
+class EmailBatchResult(models.Model):
+    """Wygenerowana treść (albo błąd) dla jednego klienta - dopisywana, nigdy nadpisywana."""
+    batch = models.ForeignKey(
+        EmailBatchJob,
+        on_delete=models.CASCADE,
+        related_name='results'
+    )
+    client = models.ForeignKey(
+        Client,
+        on_delete=models.CASCADE,
+        related_name='email_batch_results'
+    )
+    email = models.EmailField(null=True, blank=True)
+    content = models.TextField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Email for {self.client_id} in batch {self.batch_id}"
@@ -0,0 +1,319 @@
+import os
+import threading
+import time
+from collections import Counter
+import numpy as np
+from ai_module.duration import normalize_description
+from ai_module.registry import CHECK_INTERVAL, RECOMMENDATION_INDEX_PATH as INDEX_PATH, write_atomically
+
+# Przedziały przebiegu (km) - kontekst rekomendacji to marka / model / przedział
+MILEAGE_BAND = 50000
+MAX_BAND = 6
+ANY = '*'
+
+# Para prac musi wystąpić co najmniej tyle razy, żeby była rekomendowana
+MIN_PAIR_SUPPORT = 2
+# Kontekst z mniejszą liczbą wizyt jest pomijany na rzecz ogólniejszego
+MIN_CONTEXT_TRANSACTIONS = 20
+TOP_N = 5
+
+# Klucze par pakowane w int64: kontekst | praca A | praca B (po 21 bitów)
+SHIFT = 21
+MASK = (1 << SHIFT) - 1
+
+def mileage_band(mileage):
+    return min(int(mileage or 0) // MILEAGE_BAND, MAX_BAND)
+
+
+def context_keys(make, model, mileage):
+    """Konteksty od najbardziej szczegółowego do globalnego."""
+    make = normalize_description(make) or ANY
+    model = normalize_description(model) or ANY
+    band = str(mileage_band(mileage))
+    return [
+        f'{make}|{model}|{band}',
+        f'{make}|{model}|{ANY}',
+        f'{make}|{ANY}|{ANY}',
+        f'{ANY}|{ANY}|{ANY}',
+    ]
+
+
+def split_items(text):
+    """Wpis historii serwisowej to zwykle lista prac, po jednej w linii."""
+    return [line.strip() for line in (text or '').splitlines() if normalize_description(line)]
+
+
+def _pair_key(ctx, a, b=0):
+    return (int(ctx) << (2 * SHIFT)) | (int(a) << SHIFT) | int(b)
+
+
+class RecommendationIndex:
+    """
+    Liczniki współwystępowania prac w zakończonych wizytach, w kontekstach
+    marka / model / przedział przebiegu (z uogólnieniami do marki i całości).
+
+    Wszystko trzymane jest w posortowanych tablicach NumPy (klucze int64
+    i liczniki int32), więc zapytanie to kilka `searchsorted`, a dopisanie
+    nowych wizyt to scalenie tablic - liczniki są addytywne.
+    """
+
+    def __init__(self, arrays=None):
+        arrays = {name: np.asarray(array) for name, array in (arrays or {}).items()}
+        self.vocab = [str(item) for item in arrays.get('vocab', [])]
+        # Czytelna nazwa pracy (pierwszy napotkany opis) dla znormalizowanego klucza
+        self.labels = [str(label) for label in arrays.get('labels', self.vocab)]
+        self.contexts = [str(ctx) for ctx in arrays.get('contexts', [])]
+        self.context_transactions = arrays.get('context_transactions', np.empty(0, dtype=np.int32))
+        self.item_keys = arrays.get('item_keys', np.empty(0, dtype=np.int64))
+        self.item_counts = arrays.get('item_counts', np.empty(0, dtype=np.int32))
+        self.pair_keys = arrays.get('pair_keys', np.empty(0, dtype=np.int64))
+        self.pair_counts = arrays.get('pair_counts', np.empty(0, dtype=np.int32))
+        self.sources = arrays.get('sources', np.empty(0, dtype='U36'))
+        self.built_at = str(arrays['built_at']) if 'built_at' in arrays else ''
+        self.item_ids = {item: i for i, item in enumerate(self.vocab)}
+        self.context_ids = {ctx: i for i, ctx in enumerate(self.contexts)}
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        from ai_module.compact import _load_npz
+
+        return cls(_load_npz(path))
+
+    def save(self, path=INDEX_PATH, built_at=''):
+        arrays = {
+            'vocab': np.asarray(self.vocab, dtype=str),
+            'labels': np.asarray(self.labels, dtype=str),
+            'contexts': np.asarray(self.contexts, dtype=str),
+            'context_transactions': self.context_transactions.astype(np.int32),
+            'item_keys': self.item_keys.astype(np.int64),
+            'item_counts': self.item_counts.astype(np.int32),
+            'pair_keys': self.pair_keys.astype(np.int64),
+            'pair_counts': self.pair_counts.astype(np.int32),
+            'sources': np.sort(self.sources.astype('U36')),
+            'built_at': np.asarray(built_at),
+        }
+        write_atomically(path, lambda f: np.savez(f, **arrays))
+
+    def is_indexed(self, source_ids):
+        """Maska: które wizyty są już policzone."""
+        return np.isin(np.asarray(source_ids, dtype='U36'), self.sources)
+
+    def _id(self, mapping, values, key):
+        if key not in mapping:
+            mapping[key] = len(values)
+            values.append(key)
+        return mapping[key]
+
+    def _item_id(self, description):
+        key = normalize_description(description)
+        if not key:
+            return None
+        if key not in self.item_ids:
+            self.labels.append(' '.join(description.split()).lower())
+        return self._id(self.item_ids, self.vocab, key)
+
+    def add_transactions(self, transactions):
+        """Dopisuje `(źródło, marka, model, przebieg, [opisy prac])` do liczników."""
+        context_delta, item_delta, pair_delta = Counter(), Counter(), Counter()
+        sources = []
+        for source_id, make, model, mileage, items in transactions:
+            sources.append(str(source_id))
+            item_ids = sorted({self._item_id(item) for item in items} - {None})
+            if not item_ids:
+                continue
+            for key in context_keys(make, model, mileage):
+                ctx = self._id(self.context_ids, self.contexts, key)
+                context_delta[ctx] += 1
+                for a in item_ids:
+                    item_delta[_pair_key(0, ctx, a)] += 1
+                    for b in item_ids:
+                        if a != b:
+                            pair_delta[_pair_key(ctx, a, b)] += 1
+
+        transactions_per_context = np.zeros(len(self.contexts), dtype=np.int32)
+        transactions_per_context[:len(self.context_transactions)] = self.context_transactions
+        for ctx, count in context_delta.items():
+            transactions_per_context[ctx] += count
+        self.context_transactions = transactions_per_context
+        self.item_keys, self.item_counts = _merge(self.item_keys, self.item_counts, item_delta)
+        self.pair_keys, self.pair_counts = _merge(self.pair_keys, self.pair_counts, pair_delta)
+        self.sources = np.union1d(self.sources.astype('U36'), np.asarray(sources, dtype='U36'))
+        return len(sources)
+
+    def _item_counts(self, ctx, item_ids):
+        keys = np.asarray([_pair_key(0, ctx, item) for item in item_ids], dtype=np.int64)
+        if not len(self.item_keys):
+            return np.zeros(len(keys), dtype=np.int32)
+        positions = np.searchsorted(self.item_keys, keys)
+        positions = np.minimum(positions, len(self.item_keys) - 1)
+        found = self.item_keys[positions] == keys
+        return np.where(found, self.item_counts[positions], 0)
+
+    def _popular(self, ctx, exclude, top_n):
+        lo, hi = np.searchsorted(self.item_keys, [_pair_key(0, ctx, 0), _pair_key(0, ctx + 1, 0)])
+        items = self.item_keys[lo:hi] & MASK
+        counts = self.item_counts[lo:hi]
+        transactions = max(int(self.context_transactions[ctx]), 1)
+        order = np.argsort(-counts, kind='stable')
+        return [
+            {'item': self.labels[items[i]], 'confidence': float(counts[i]) / transactions, 'lift': 1.0,
+             'support': int(counts[i]), 'because': None}
+            for i in order if items[i] not in exclude
+        ][:top_n]
+
+    def recommend(self, items, make='', model='', mileage=0, top_n=TOP_N):
+        """
+        Co jeszcze sprawdzić przy wizycie z pracami `items`.
+
+        Dla najbardziej szczegółowego kontekstu z wystarczającą liczbą wizyt
+        liczymy regułę A -> B: pewność = wspólne(A, B) / A, lift = pewność /
+        częstość(B). Bez pasujących reguł zwracane są najczęstsze prace.
+        """
+        present = {self.item_ids[item] for item in (normalize_description(i) for i in items) if item in self.item_ids}
+        keys = context_keys(make, model, mileage)
+        for level, key in enumerate(keys):
+            ctx = self.context_ids.get(key)
+            if ctx is None:
+                continue
+            transactions = int(self.context_transactions[ctx])
+            if transactions < MIN_CONTEXT_TRANSACTIONS and level < len(keys) - 1:
+                continue
+
+            best = {}
+            for a in present:
+                lo, hi = np.searchsorted(self.pair_keys, [_pair_key(ctx, a, 0), _pair_key(ctx, a + 1, 0)])
+                candidates = self.pair_keys[lo:hi] & MASK
+                together = self.pair_counts[lo:hi]
+                keep = (together >= MIN_PAIR_SUPPORT) & ~np.isin(candidates, list(present))
+                if not keep.any():
+                    continue
+                candidates, together = candidates[keep], together[keep]
+                count_a = self._item_counts(ctx, [a])[0]
+                count_b = self._item_counts(ctx, candidates)
+                confidence = together / max(count_a, 1)
+                lift = confidence / np.maximum(count_b / transactions, 1e-9)
+                for b, conf, lft, support in zip(candidates, confidence, lift, together):
+                    if b not in best or conf > best[b]['confidence']:
+                        best[b] = {'item': self.labels[b], 'confidence': float(conf), 'lift': float(lft),
+                                   'support': int(support), 'because': self.labels[a]}
+            if best:
+                ranked = sorted(best.values(), key=lambda r: (-r['confidence'], -r['lift'], r['item']))
+                return {'context': key, 'recommendations': ranked[:top_n]}
+            return {'context': key, 'recommendations': self._popular(ctx, present, top_n)}
+        return {'context': None, 'recommendations': []}
+
+
+def _merge(keys, counts, delta):
+    if not delta:
+        return keys, counts
+    all_keys = np.concatenate([keys, np.fromiter(delta.keys(), dtype=np.int64, count=len(delta))])
+    all_counts = np.concatenate([counts, np.fromiter(delta.values(), dtype=np.int32, count=len(delta))])
+    unique, inverse = np.unique(all_keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=all_counts).astype(np.int32)
+
+
+_lock = threading.Lock()
+_state = {'index': None, 'stamp': None, 'checked': 0.0}
+
+
+def get_index():
+    """Indeks z dysku, przeładowywany po zmianie pliku."""
+    if time.monotonic() - _state['checked'] < CHECK_INTERVAL:
+        return _state['index']
+    with _lock:
+        _state['checked'] = time.monotonic()
+        try:
+            stat = os.stat(INDEX_PATH)
+        except FileNotFoundError:
+            _state['index'] = _state['stamp'] = None
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != _state['stamp']:
+            _state['index'] = RecommendationIndex.load(INDEX_PATH)
+            _state['stamp'] = stamp
+        return _state['index']
+
+
+def recommend_for_appointment(appointment, repair_items=None, top_n=TOP_N):
+    index = get_index()
+    if index is None:
+        return None
+    vehicle = appointment.vehicle
+    if repair_items is None:
+        repair_items = appointment.repair_items.all()
+    items = [item.description for item in repair_items]
+    return index.recommend(
+        items, vehicle.make, vehicle.model, appointment.mileage or vehicle.mileage, top_n=top_n,
+    )
+
+
+def _transactions(appointments, service_records):
+    """
+    Zakończone wizyty z listą ich prac (`RepairItem`) oraz samodzielne wpisy
+    historii serwisowej (bez wizyty), każdy jako jedna wizyta z pracami z kolejnych
+    linii opisu. Wpisy utworzone z wizyt są pomijane - ich prace są już policzone,
+    a opis zawiera też notatki wizyty.
+    """
+    from appointments.models import RepairItem
+
+    rows = list(appointments.values(
+        'id', 'mileage', 'vehicle__make', 'vehicle__model', 'vehicle__mileage',
+    ))
+    items = {}
+    ids = [row['id'] for row in rows]
+    for start in range(0, len(ids), 2000):
+        chunk = ids[start:start + 2000]
+        for item in RepairItem.objects.filter(appointment_id__in=chunk).values('appointment_id', 'description'):
+            items.setdefault(item['appointment_id'], []).append(item['description'])
+
+    for row in rows:
+        yield (
+            row['id'], row['vehicle__make'], row['vehicle__model'],
+            row['mileage'] or row['vehicle__mileage'], items.get(row['id'], []),
+        )
+
+    records = service_records.values('id', 'description', 'mileage', 'vehicle__make', 'vehicle__model')
+    for record in records.iterator(chunk_size=2000):
+        yield (
+            record['id'], record['vehicle__make'], record['vehicle__model'],
+            record['mileage'], split_items(record['description']),
+        )
+
+
+def build_index(full=False, path=INDEX_PATH):
+    """
+    Buduje indeks lub dopisuje do niego wizyty zakończone (i wpisy historii
+    serwisowej) od ostatniej budowy.
+
+    Przyrostowo pomijane są źródła już policzone (lista `sources`), więc
+    ponowne uruchomienie nie dubluje liczników, a bez nowych wizyt plik nie
+    jest przepisywany - zadanie z beat może działać co kilka minut. Blokada
+    pliku chroni przed równoległymi budowami. Zwraca `(liczba źródeł, dodanych)`.
+    """
+    import fcntl
+    from django.utils import timezone
+    from appointments.models import Appointment
+    from service_records.models import ServiceRecord
+
+    with open(f'{path}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        built_at = timezone.now()
+        index = RecommendationIndex()
+        appointments = Appointment.objects.filter(status='completed')
+        records = ServiceRecord.objects.filter(appointment__isnull=True)
+        exists = os.path.exists(path)
+        if not full and exists:
+            index = RecommendationIndex.load(path)
+            if index.built_at:
+                appointments = appointments.filter(updated_at__gte=index.built_at)
+                records = records.filter(updated_at__gte=index.built_at)
+
+        pending = list(_transactions(appointments, records))
+        if pending:
+            indexed = index.is_indexed([t[0] for t in pending])
+            pending = [t for t, done in zip(pending, indexed) if not done]
+        if not pending and exists and not full:
+            return len(index.sources), 0
+        added = index.add_transactions(pending)
+        index.save(path, built_at=built_at.isoformat())
+    return len(index.sources), added
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from ai_module.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), 'management', 'commands')
+MODEL_PATH = os.path.join(MODEL_DIR, 'advanced_client_segment_classifier.joblib')
+METADATA_PATH = os.path.join(MODEL_DIR, 'model_metadata.json')
+# Spłaszczony las w tablicach NumPy (patrz ai_module.compact) - nie wymaga sklearn
+COMPACT_MODEL_PATH = os.path.join(MODEL_DIR, 'advanced_client_segment_classifier.npz')
+# Indeks historycznych napraw do szacowania czasu (patrz ai_module.duration)
+DURATION_INDEX_PATH = os.path.join(MODEL_DIR, 'repair_duration_index.npz')
+# Współwystępowanie prac w wizytach (patrz ai_module.recommendations)
+RECOMMENDATION_INDEX_PATH = os.path.join(MODEL_DIR, 'recommendation_index.npz')
+
+# Jak często (w sekundach) sprawdzamy, czy plik modelu zmienił się na dysku
+CHECK_INTERVAL = 5.0
+
+LoadedModel = namedtuple('LoadedModel', ['model', 'features', 'version', 'digest', 'metadata'])
+
+
+class ModelMismatchError(Exception):
+    """Plik modelu ma inną sumę kontrolną niż zapisana w metadanych (np. w trakcie zapisu nowej wersji)."""
+
+
+def file_checksum(path):
+    """SHA-256 pliku - zapisywany w metadanych przy treningu i sprawdzany przy ładowaniu."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def write_atomically(path, write):
+    """Zapisuje plik do pliku tymczasowego obok i podmienia go przez os.replace."""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=os.path.splitext(path)[1])
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp tworzy plik 0600 - artefakty modeli muszą być czytelne dla innych procesów/użytkowników
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ModelRegistry:
+    """
+    Trzyma jeden załadowany model segmentacji na proces.
+
+    Model i metadane są ładowane przy pierwszym użyciu, a potem podmieniane
+    tylko wtedy, gdy zmieni się mtime/rozmiar pliku i jego skrót SHA-256.
+    Nowy model jest w całości ładowany przed podmianą referencji, więc
+    równoległe wywołania widzą albo stary, albo nowy model - nigdy pół na pół.
+
+    Jeśli obok leży model kompaktowy (`.npz`) w tej samej wersji co metadane,
+    ładowany jest on zamiast pickla - bez importu sklearn i z tablicami
+    mapowanymi w pamięci współdzielonej między procesami.
+
+    Model, model kompaktowy i metadane są podmieniane osobno; metadane (zapisywane
+    jako ostatnie) niosą sumy kontrolne obu plików modelu. Zestaw, w którym sumy
+    się nie zgadzają, jest odrzucany, a proces zostaje przy poprzedniej wersji
+    do następnego sprawdzenia.
+    """
+
+    def __init__(self, model_path=MODEL_PATH, metadata_path=METADATA_PATH, check_interval=CHECK_INTERVAL,
+                 compact_path=COMPACT_MODEL_PATH):
+        self.model_path = model_path
+        self.metadata_path = metadata_path
+        self.compact_path = compact_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._loaded = None
+        self._stamp = None
+        self._last_check = 0.0
+
+    def _paths(self):
+        paths = [self.model_path, self.metadata_path]
+        if self.compact_path and os.path.exists(self.compact_path):
+            paths.append(self.compact_path)
+        return paths
+
+    def _file_stamp(self):
+        stamp = []
+        for path in self._paths():
+            stat = os.stat(path)
+            stamp.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(stamp)
+
+    def _checksums(self):
+        return {path: file_checksum(path) for path in self._paths()}
+
+    def _digest(self, checksums):
+        return hashlib.sha256(''.join(checksums[path] for path in self._paths()).encode('ascii')).hexdigest()
+
+    def _load_compact(self, metadata, checksums):
+        if not self.compact_path or not os.path.exists(self.compact_path):
+            return None
+        from ai_module.compact import CompactForest
+
+        expected = metadata.get('checksums', {}).get('compact')
+        if expected and checksums.get(self.compact_path) != expected:
+            logger.warning("Model kompaktowy nie pasuje do sumy kontrolnej w metadanych - używam pliku joblib")
+            return None
+
+        model = CompactForest.load(self.compact_path)
+        if model.version != str(metadata.get('version') or '') or model.features != list(metadata['features']):
+            logger.warning("Model kompaktowy %s nie pasuje do metadanych - używam pliku joblib", model.version)
+            return None
+        return model
+
+    def _load(self, digest, checksums):
+        with open(self.metadata_path, 'r') as f:
+            metadata = json.load(f)
+
+        expected = metadata.get('checksums', {}).get('model')
+        if expected and checksums[self.model_path] != expected:
+            raise ModelMismatchError("Plik modelu nie pasuje do sumy kontrolnej w metadanych")
+
+        model = self._load_compact(metadata, checksums)
+        if model is None:
+            import joblib
+            model = joblib.load(self.model_path)
+
+        return LoadedModel(
+            model=model,
+            features=list(metadata['features']),
+            version=str(metadata.get('version') or digest[:12]),
+            digest=digest,
+            metadata=metadata,
+        )
+
+    def get(self):
+        """Zwraca aktualny `LoadedModel`, przeładowując go, jeśli plik się zmienił."""
+        loaded = self._loaded
+        if loaded is not None and time.monotonic() - self._last_check < self.check_interval:
+            return loaded
+
+        with self._lock:
+            if self._loaded is not None and time.monotonic() - self._last_check < self.check_interval:
+                return self._loaded
+            self._refresh()
+            return self._loaded
+
+    def _refresh(self):
+        if not os.path.exists(self.model_path) or not os.path.exists(self.metadata_path):
+            if self._loaded is None:
+                raise FileNotFoundError("Model lub metadane nie zostały znalezione")
+            logger.warning("Plik modelu zniknął, używam wersji %s", self._loaded.version)
+            self._last_check = time.monotonic()
+            return
+
+        stamp = self._file_stamp()
+        if stamp == self._stamp and self._loaded is not None:
+            self._last_check = time.monotonic()
+            return
+
+        checksums = self._checksums()
+        digest = self._digest(checksums)
+        if self._loaded is not None and digest == self._loaded.digest:
+            # Plik został tylko "dotknięty" - treść bez zmian
+            self._stamp = stamp
+            self._last_check = time.monotonic()
+            return
+
+        try:
+            with metrics.timer('model.load'):
+                loaded = self._load(digest, checksums)
+        except Exception:
+            if self._loaded is None:
+                raise
+            logger.exception("Nie udało się przeładować modelu, używam wersji %s", self._loaded.version)
+            self._last_check = time.monotonic()
+            return
+
+        metrics.incr('model.loads')
+        previous = self._loaded
+        self._loaded = loaded
+        self._stamp = stamp
+        self._last_check = time.monotonic()
+        if previous is not None:
+            logger.info("Przeładowano model segmentacji: %s -> %s", previous.version, loaded.version)
+
+    def reload(self):
+        """Wymusza sprawdzenie pliku modelu przy następnym `get()`."""
+        with self._lock:
+            self._last_check = 0.0
+            self._stamp = None
+
+    @property
+    def version(self):
+        loaded = self._loaded
+        return loaded.version if loaded is not None else None
+
+
+registry = ModelRegistry()
+
+
+def get_model():
+    return registry.get()
@@ -0,0 +1,75 @@
+import logging
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Ile sekund czekamy na kolejne zapisy, zanim worker przeliczy segmenty
+DEFAULT_WINDOW = 2.0
+DEFAULT_MAX_BATCH = 1000
+LOCK_KEY = 'ai_module:segment_queue:{}'
+
+
+class SegmentUpdateQueue:
+    """
+    Kolejka klientów do ponownej predykcji segmentu, przetwarzana przez workera Celery.
+
+    Klienci zapisani w jednej transakcji trafiają po commicie do jednego
+    zadania `update_queued_segments_task`, uruchamianego z opóźnieniem `window`
+    sekund (jedno wywołanie `model.predict` na porcję). Klient, który ma już
+    zaplanowane przeliczenie (klucz w cache żyjący `window` sekund), nie jest
+    wysyłany ponownie - przy wspólnym cache (Redis, Memcached) także między
+    procesami. Zadania czekają w brokerze, więc restart procesu WWW ich nie
+    gubi; gdy broker jest niedostępny, segment wyrówna nocne pełne
+    przeliczenie (`update_client_segments_task`).
+    """
+
+    def __init__(self, window=None, max_batch=None, eager=None):
+        self.window = window if window is not None else getattr(settings, 'AI_SEGMENT_QUEUE_WINDOW', DEFAULT_WINDOW)
+        self.max_batch = max_batch or getattr(settings, 'AI_SEGMENT_QUEUE_MAX_BATCH', DEFAULT_MAX_BATCH)
+        self.eager = eager if eager is not None else getattr(settings, 'AI_SEGMENT_QUEUE_EAGER', False)
+        # Klienci bieżącej transakcji (osobno w każdym wątku) - wysyłani razem po commicie
+        self._local = threading.local()
+
+    def _pending(self):
+        if not hasattr(self._local, 'client_ids'):
+            self._local.client_ids = set()
+        return self._local.client_ids
+
+    def enqueue(self, client_ids):
+        """Planuje przeliczenie klientów; pomija tych, którzy już czekają. Zwraca liczbę wysłanych."""
+        from ai_module.tasks import update_queued_segments_task
+
+        client_ids = [str(client_id) for client_id in dict.fromkeys(client_ids)]
+        if self.eager:
+            update_queued_segments_task(client_ids)
+            return len(client_ids)
+
+        timeout = max(self.window, 1)
+        client_ids = [client_id for client_id in client_ids if cache.add(LOCK_KEY.format(client_id), True, timeout)]
+        for start in range(0, len(client_ids), self.max_batch):
+            batch = client_ids[start:start + self.max_batch]
+            try:
+                update_queued_segments_task.apply_async((batch,), countdown=self.window)
+            except Exception:
+                # Commit już się odbył - błąd brokera nie może zepsuć żądania
+                cache.delete_many([LOCK_KEY.format(client_id) for client_id in batch])
+                logger.exception("Nie udało się zlecić przeliczenia segmentów %d klientów", len(batch))
+        return len(client_ids)
+
+    def enqueue_on_commit(self, client_id):
+        self._pending().add(client_id)
+        transaction.on_commit(self._send_pending)
+
+    def _send_pending(self):
+        # Pierwszy callback po commicie wysyła wszystkich klientów transakcji, kolejne nic
+        client_ids = self._pending()
+        if client_ids:
+            batch = list(client_ids)
+            client_ids.clear()
+            self.enqueue(batch)
+
+
+segment_queue = SegmentUpdateQueue()
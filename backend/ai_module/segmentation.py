@@ -0,0 +1,180 @@
+import logging
+import time
+from collections import Counter, namedtuple
+import numpy as np
+from django.db.models import Count
+from django.utils import timezone
+from clients.models import Client
+from ai_module.compact import CompactForest
+from ai_module.features import iter_client_features
+from ai_module.metrics import metrics
+from ai_module.registry import get_model
+from ai_module.utils import SEGMENT_DISCOUNTS, run_rfm_segmentation
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50000
+WRITE_BATCH_SIZE = 1000
+# Maksymalna liczba klientów w jednej porcji zadania Celery
+CHUNK_SIZE = 20000
+# "Wersja" raportowana, gdy segmenty policzono regułami RFM zamiast modelem
+RFM_VERSION = 'rfm'
+
+SegmentationStats = namedtuple('SegmentationStats', ['processed', 'changed', 'seconds', 'version'])
+
+
+def predict_matrix(model, feature_order, X):
+    """Jedno wywołanie `model.predict` dla całej macierzy cech."""
+    if len(X) == 0:
+        return np.empty(0, dtype=object)
+    if isinstance(model, CompactForest):
+        return model.predict(X)
+    # Pipeline sklearn był trenowany na DataFrame - zachowujemy nazwy kolumn
+    import pandas as pd
+    return model.predict(pd.DataFrame(X, columns=feature_order))
+
+
+def apply_segments(client_ids, previous_segments, predicted_segments):
+    """Zapisuje segment i rabat tylko tym klientom, którym segment się zmienił."""
+    updated_at = timezone.now()
+    changed = [
+        Client(
+            pk=client_id,
+            segment=segment,
+            discount=SEGMENT_DISCOUNTS.get(segment, 0.00),
+            updated_at=updated_at,
+        )
+        for client_id, previous, segment in zip(client_ids, previous_segments, predicted_segments)
+        if segment != previous
+    ]
+    if changed:
+        with metrics.timer('segmentation.write_back'):
+            Client.objects.bulk_update(changed, ['segment', 'discount', 'updated_at'], batch_size=WRITE_BATCH_SIZE)
+        for segment, count in Counter(client.segment for client in changed).items():
+            metrics.incr(f'segmentation.changed.{segment}', count)
+    return len(changed)
+
+
+def update_segments(clients=None, batch_size=BATCH_SIZE, progress=None, stored=False, rfm_only_clients=False):
+    """
+    Przelicza segmenty klientów porcjami po `batch_size` wierszy.
+
+    Cechy trafiają do prealokowanej macierzy NumPy, model jest wołany raz na
+    porcję, a zmiany zapisywane przez `bulk_update`. `progress` (opcjonalny)
+    dostaje `(przetworzeni, zmienieni)` po każdej porcji. `stored=True` czyta
+    cechy z `ClientFeatures` zamiast agregować historię wizyt.
+
+    Gdy pliku modelu brak, segmenty liczone są regułami RFM (`update_segments_rfm`);
+    `rfm_only_clients=True` zapisuje wtedy tylko podanych klientów, a nie całe warsztaty.
+    """
+    try:
+        loaded = get_model()
+    except FileNotFoundError:
+        metrics.incr('model.missing')
+        logger.warning("Brak modelu segmentacji - segmenty zostaną wyliczone regułami RFM")
+        return update_segments_rfm(clients, progress=progress, only_clients=rfm_only_clients)
+    feature_order = loaded.features
+
+    started = time.perf_counter()
+    processed = changed = 0
+
+    X = np.empty((batch_size, len(feature_order)), dtype=np.float64)
+    client_ids = []
+    previous_segments = []
+
+    batch_started = time.perf_counter()
+
+    def flush():
+        nonlocal processed, changed, batch_started
+        size = len(client_ids)
+        # Czas od początku porcji to odczyt cech (iterator przeplata się z predykcją)
+        metrics.observe('segmentation.features', (time.perf_counter() - batch_started) * 1000)
+        with metrics.timer('segmentation.inference'):
+            predicted = predict_matrix(loaded.model, feature_order, X[:size])
+        batch_changed = apply_segments(client_ids, previous_segments, predicted)
+        changed += batch_changed
+        processed += size
+        metrics.incr('segmentation.processed', size)
+        metrics.incr('segmentation.changed', batch_changed)
+        client_ids.clear()
+        previous_segments.clear()
+        if progress is not None:
+            progress(processed, changed)
+        batch_started = time.perf_counter()
+
+    for row, features in iter_client_features(clients, stored=stored):
+        X[len(client_ids)] = [features.get(feature, 0) for feature in feature_order]
+        client_ids.append(row['id'])
+        previous_segments.append(row['segment'])
+        if len(client_ids) == batch_size:
+            flush()
+
+    if client_ids:
+        flush()
+
+    return SegmentationStats(processed, changed, time.perf_counter() - started, loaded.version)
+
+
+def update_segments_rfm(clients=None, progress=None, only_clients=False):
+    """
+    Segmentacja regułowa RFM (kwartyle per warsztat) po stronie bazy.
+
+    Kwartyle zależą od wszystkich klientów warsztatu, więc liczone są dla
+    całych warsztatów, do których należą podani klienci. Zapisywane są też
+    całe warsztaty, chyba że `only_clients=True` (np. kilku klientów z kolejki).
+    """
+    started = time.perf_counter()
+    workshop_ids = client_ids = None
+    if clients is not None:
+        if only_clients:
+            rows = list(clients.order_by().values_list('pk', 'workshop_id'))
+            client_ids = [pk for pk, _ in rows]
+            workshop_ids = {workshop_id for _, workshop_id in rows}
+        else:
+            workshop_ids = list(clients.order_by().values_list('workshop_id', flat=True).distinct())
+    with metrics.timer('segmentation.rfm'):
+        processed, changed = run_rfm_segmentation(workshop_ids, client_ids)
+    metrics.incr('segmentation.processed', processed)
+    metrics.incr('segmentation.changed', changed)
+    if progress is not None:
+        progress(processed, changed)
+    return SegmentationStats(processed, changed, time.perf_counter() - started, RFM_VERSION)
+
+
+def plan_chunks(chunk_size=CHUNK_SIZE):
+    """
+    Dzieli klientów na porcje do równoległego przeliczenia.
+
+    Każdy warsztat to osobna porcja; duże warsztaty są cięte na zakresy
+    kluczy głównych (`start` <= pk < `end`) po około `chunk_size` klientów.
+    Porcje są zwykłymi słownikami z napisami, więc da się je serializować
+    do JSON i ponawiać niezależnie.
+    """
+    chunks = []
+    workshops = (
+        Client.objects.order_by('workshop_id').values('workshop_id').annotate(clients=Count('pk'))
+    )
+    for row in workshops:
+        workshop_id = str(row['workshop_id'])
+        if row['clients'] <= chunk_size:
+            chunks.append({'workshop_id': workshop_id, 'start': None, 'end': None})
+            continue
+
+        pks = Client.objects.filter(workshop_id=workshop_id).order_by('pk').values_list('pk', flat=True)
+        boundaries = [str(pks[offset]) for offset in range(chunk_size, row['clients'], chunk_size)]
+        edges = [None] + boundaries + [None]
+        chunks.extend(
+            {'workshop_id': workshop_id, 'start': start, 'end': end}
+            for start, end in zip(edges, edges[1:])
+        )
+    return chunks
+
+
+def chunk_clients(chunk):
+    """Queryset klientów jednej porcji z `plan_chunks`."""
+    clients = Client.objects.filter(workshop_id=chunk['workshop_id'])
+    if chunk.get('start'):
+        clients = clients.filter(pk__gte=chunk['start'])
+    if chunk.get('end'):
+        clients = clients.filter(pk__lt=chunk['end'])
+    return clients
@@ -1,109 +1,63 @@
 import os
 from datetime import timedelta
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from appointments.models import RepairItem
+from appointments.models import Appointment, RepairItem
 from django.conf import settings
-import openai
+from vehicles.models import Vehicle
+from ai_module.feature_store import appointment_snapshot, apply_appointment_change
+from ai_module.registry import DURATION_INDEX_PATH
+
+
+# Magazyn cech klientów (ClientFeatures) aktualizowany różnicowo przy zmianach wizyt
+@receiver(pre_save, sender=Appointment)
+def track_appointment_features(sender, instance, **kwargs):
+    instance._features_previous = None
+    if not instance._state.adding:
+        instance._features_previous = (
+            sender.objects.filter(pk=instance.pk)
+            .values('client_id', 'status', 'total_cost', 'scheduled_time')
+            .first()
+        )
+
+
+@receiver(post_save, sender=Appointment)
+def update_client_features(sender, instance, **kwargs):
+    previous = getattr(instance, '_features_previous', None)
+    apply_appointment_change(previous, appointment_snapshot(instance))
+
+
+@receiver(post_delete, sender=Appointment)
+def remove_client_features(sender, instance, **kwargs):
+    apply_appointment_change(appointment_snapshot(instance), None)
+
+
+# Szacowanie czasu naprawy lokalnym indeksem (ai_module.duration) - bez API i bez
+# ponownego save() w post_save: wartość jest ustawiana przed zapisem
+@receiver(pre_save, sender=RepairItem)
+def estimate_repair_duration(sender, instance, **kwargs):
+    if not os.path.exists(DURATION_INDEX_PATH):
+        return
+    from ai_module.duration import estimate_duration
+
+    description_changed = instance._state.adding or not sender.objects.filter(
+        pk=instance.pk, description=instance.description
+    ).exists()
+    if instance.estimated_duration and not description_changed:
+        return
+
+    vehicle = (
+        Vehicle.objects.filter(appointments=instance.appointment_id)
+        .values('make', 'model', 'engine_type')
+        .first()
+    ) or {}
+    instance.estimated_duration = estimate_duration(
+        instance.description,
+        vehicle.get('make') or '',
+        vehicle.get('model') or '',
+        vehicle.get('engine_type') or '',
+    )
 
-# def get_estimated_duration(vehicle_info, repair_description):
-#     openai.api_key = settings.API_KEY
-
-#     messages = [
-#         {
-#             "role": "system",
-#             "content": (
-#                 "Jesteś doświadczonym mechanikiem samochodowym. "
-#                 "Na podstawie informacji o pojeździe i opisu naprawy, "
-#                 "oszacuj czas trwania naprawy w formacie HH:MM.\n"
-#                 "Jeśli czas to jedna godzina i 30 minut, odpowiedz: 01:30.\n"
-#                 "Nie dodawaj żadnych dodatkowych informacji, tylko sam czas w formacie HH:MM."
-#             )
-#         },
-#         {
-#             "role": "user",
-#             "content": (
-#                 f"Informacje o pojeździe:\n{vehicle_info}\n\n"
-#                 f"Opis naprawy:\n{repair_description}\n\n"
-#                 "Proszę podać tylko szacowany czas trwania w formacie HH:MM."
-#             )
-#         }
-#     ]
-
-#     try:
-#         response = openai.ChatCompletion.create(
-#             model="gpt-3.5-turbo",
-#             messages=messages,
-#             max_tokens=10,
-#             temperature=0
-#         )
-
-#         estimated_duration = response.choices[0].message['content'].strip()
-#         print(f"Odpowiedź z API: {estimated_duration}")
-#         return estimated_duration
-#     except Exception as e:
-#         # Obsłuż błędy API
-#         print(f"Błąd podczas komunikacji z API OpenAI: {e}")
-#         return None
-
-# Function to track if the repair description has changed before saving.
-# @receiver(pre_save, sender=RepairItem)
-# def track_description_change(sender, instance, **kwargs):
-#     """
-#     """
-#     if instance.pk:  # Check only for existing records
-#         try:
-#             previous_instance = sender.objects.get(pk=instance.pk)
-#             instance._previous_description = previous_instance.description
-#         except sender.DoesNotExist:
-#             instance._previous_description = None
-
-
-# @receiver(post_save, sender=RepairItem)
-# def estimate_repair_duration(sender, instance, created, **kwargs):
-#     """
-#     Function triggered after saving a RepairItem record.
-#     It estimates the repair duration if the description has changed
-#     or if the estimated duration is not already set.
-#     """
-#     print("Signal estimate_repair_duration triggered")
-
-#     # Check if the description has changed or if estimated_duration is not set
-#     description_changed = hasattr(instance, '_previous_description') and (
-#         instance.description != instance._previous_description
-#     )
-
-#     if not instance.estimated_duration or description_changed:
-#         print("Description changed or estimated duration is not set. Estimating duration.")
-#         vehicle = instance.appointment.vehicle
-#         engine_info = f"Engine Type: {vehicle.engine_type}, " if vehicle.engine_type else ""
-#         vehicle_info = (
-#             f"Make: {vehicle.make}, Model: {vehicle.model}, Year: {vehicle.year}, "
-#             f"{engine_info}Mileage: {vehicle.mileage} km"
-#         )
-#         repair_description = instance.description
-
-#         print(f"Vehicle Info: {vehicle_info}")
-#         print(f"Repair Description: {repair_description}")
-
-#         # Call the function to get the estimated duration
-#         estimated_duration_str = get_estimated_duration(vehicle_info, repair_description)
-
-#         print(f"Received estimated duration: {estimated_duration_str}")
-
-#         if estimated_duration_str:
-#             # Parse time in the format HH:MM
-#             try:
-#                 hours, minutes = map(int, estimated_duration_str.strip().split(':'))
-#                 estimated_duration = timedelta(hours=hours, minutes=minutes)
-#                 instance.estimated_duration = estimated_duration
-#                 instance.save()
-#             except ValueError:
-#                 # Handle parsing error
-#                 print(f"Error parsing duration: {estimated_duration_str}")
-#         else:
-#             print("Failed to get an estimated duration.")
-            
 # def get_appointment_recommendations(appointment_description, repair_items):
 #     openai.api_key = settings.API_KEY
 
@@ -0,0 +1,150 @@
+import json
+import logging
+from celery import chord, group, shared_task
+from django.core.management import call_command
+from django.db import InterfaceError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+# Błędy przejściowe (zerwane połączenie, blokada) - zadanie jest ponawiane
+RETRY_EXCEPTIONS = (OperationalError, InterfaceError)
+RETRY_OPTIONS = {
+    'autoretry_for': RETRY_EXCEPTIONS,
+    'retry_backoff': True,
+    'retry_backoff_max': 600,
+    'retry_jitter': True,
+    'retry_kwargs': {'max_retries': 5},
+}
+
+
+def _report_progress(task, **meta):
+    # W trybie eager i przy wywołaniu bezpośrednim nie ma backendu stanu zadania
+    if task.request.id and not task.request.is_eager and not task.request.called_directly:
+        task.update_state(state='PROGRESS', meta=meta)
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, **RETRY_OPTIONS)
+def update_segments_chunk_task(self, chunk):
+    """
+    Przelicza segmenty jednej porcji klientów (patrz `segmentation.plan_chunks`).
+
+    Zadanie jest idempotentne: segment wynika wyłącznie z cech i modelu,
+    a zapisywane są tylko zmienione wiersze, więc ponowienie po błędzie
+    lub utracie workera daje ten sam wynik.
+    """
+    from ai_module.segmentation import chunk_clients, update_segments
+
+    def progress(processed, changed):
+        _report_progress(self, chunk=chunk, processed=processed, changed=changed)
+
+    stats = update_segments(chunk_clients(chunk), progress=progress, stored=True)
+    return {
+        'chunk': chunk,
+        'processed': stats.processed,
+        'changed': stats.changed,
+        'seconds': stats.seconds,
+        'version': stats.version,
+    }
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, **RETRY_OPTIONS)
+def update_queued_segments_task(self, client_ids):
+    """
+    Przelicza segmenty klientów z kolejki (`ai_module.segment_queue`) jednym
+    wywołaniem modelu. Bez modelu reguły RFM zapisują tylko tych klientów.
+    """
+    from django.core.cache import cache
+    from clients.models import Client
+    from ai_module.segment_queue import LOCK_KEY
+    from ai_module.segmentation import update_segments
+
+    # Zapisy od tej chwili planują kolejne przeliczenie - to czyta już stan z bazy
+    cache.delete_many([LOCK_KEY.format(client_id) for client_id in client_ids])
+    stats = update_segments(
+        Client.objects.filter(pk__in=client_ids),
+        batch_size=max(len(client_ids), 1),
+        stored=True,
+        rfm_only_clients=True,
+    )
+    logger.info(
+        "Przeliczono segmenty %d klientów z kolejki (zmiany: %d) w %.3f s",
+        stats.processed, stats.changed, stats.seconds,
+    )
+    return {'processed': stats.processed, 'changed': stats.changed, 'version': stats.version}
+
+
+@shared_task
+def aggregate_segment_results(results):
+    """Zbiera wyniki porcji (ciało chorda) w jedno podsumowanie."""
+    summary = {
+        'chunks': len(results),
+        'processed': sum(result['processed'] for result in results),
+        'changed': sum(result['changed'] for result in results),
+        'seconds': sum(result['seconds'] for result in results),
+        'versions': sorted({result['version'] for result in results}),
+    }
+    if len(summary['versions']) > 1:
+        # Model został podmieniony w trakcie - kolejny przebieg wyrówna segmenty
+        logger.warning("Porcje przeliczono różnymi wersjami modelu: %s", summary['versions'])
+    logger.info(
+        "Zaktualizowano segmenty: %d klientów w %d porcjach, %d zmian",
+        summary['processed'], summary['chunks'], summary['changed'],
+    )
+    return summary
+
+
+@shared_task(bind=True, **RETRY_OPTIONS)
+def update_client_segments_task(self, chunk_size=None):
+    """
+    Dzieli klientów na porcje (per warsztat / zakres id) i rozsyła je
+    równolegle do workerów; `aggregate_segment_results` sumuje wyniki.
+    Klienci bez wiersza `ClientFeatures` (np. dodani przez bulk_create)
+    dostają go wcześniej jedną przebudową - porcje czytają już gotowe cechy.
+    """
+    from clients.models import Client
+    from ai_module.feature_store import rebuild_client_features
+    from ai_module.segmentation import CHUNK_SIZE, plan_chunks
+
+    missing = rebuild_client_features(Client.objects.filter(features__isnull=True))
+    if missing:
+        logger.info("Uzupełniono cechy %d klientów bez wiersza ClientFeatures", missing)
+    chunks = plan_chunks(chunk_size or CHUNK_SIZE)
+    if not chunks:
+        logger.info("Brak klientów do aktualizacji segmentów.")
+        return {'chunks': 0, 'processed': 0, 'changed': 0, 'seconds': 0.0, 'versions': []}
+
+    _report_progress(self, chunks=len(chunks))
+    result = chord(group(update_segments_chunk_task.s(chunk) for chunk in chunks))(
+        aggregate_segment_results.s()
+    )
+    if self.request.is_eager:
+        # Tryb eager wykonał już porcje i ciało chorda synchronicznie
+        return result.result
+    return {'chunks': len(chunks), 'aggregate_id': result.id}
+
+
+@shared_task(bind=True, **RETRY_OPTIONS)
+def train_model_task(self, **options):
+    """Trenuje model (`manage.py train_model`) i zwraca metadane nowej wersji."""
+    from ai_module.registry import METADATA_PATH, registry
+
+    _report_progress(self, step='training')
+    call_command('train_model', **options)
+    registry.reload()
+
+    with open(METADATA_PATH, 'r') as f:
+        metadata = json.load(f)
+    return {
+        'version': metadata.get('version'),
+        'accuracy': metadata.get('accuracy'),
+        'n_samples': metadata.get('n_samples'),
+    }
+
+
+@shared_task(bind=True, **RETRY_OPTIONS)
+def update_recommendation_index_task(self, full=False):
+    """Dopisuje do indeksu rekomendacji wizyty zakończone od ostatniej budowy."""
+    from ai_module.recommendations import build_index
+
+    sources, added = build_index(full=full)
+    return {'sources': sources, 'added': added}
@@ -0,0 +1,863 @@
+import asyncio
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+import joblib
+import numpy as np
+from django.apps import apps
+from django.core.cache import cache
+from django.core.checks import run_checks
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.test import APIClient
+from accounts.models import Role, User
+from backend.celery import app as celery_app
+from appointments.models import Appointment, RepairItem
+from clients.models import Client
+from employees.models import Employee
+from service_records.models import ServiceRecord
+from vehicles.models import Vehicle
+from workshops.models import Workshop
+from ai_module.feature_store import check_client_features, rebuild_client_features
+from ai_module.features import (
+    DEFAULT_TIME_SINCE_FIRST_VISIT, DEFAULT_VEHICLE_AGE, FEATURE_NAMES, build_features, client_features_queryset,
+)
+from ai_module import duration, recommendations
+from ai_module.email_batch import RECIPIENT_PLACEHOLDER, EmailBatch
+from ai_module import metrics as ai_metrics
+from ai_module.llm import LLMClient, ResponseCache, StubBackend, reset_llm_client
+from ai_module.models import ClientFeatures, EmailBatchJob, EmailBatchResult
+from ai_module.compact import PREDICT_CHUNK, CompactForest, export_pipeline
+from ai_module.management.commands.train_model import Command as TrainModelCommand
+from ai_module.registry import LoadedModel, ModelMismatchError, ModelRegistry, file_checksum
+from ai_module.segment_queue import SegmentUpdateQueue
+from ai_module.segmentation import chunk_clients, plan_chunks, update_segments
+from ai_module.tasks import update_client_segments_task, update_queued_segments_task
+from ai_module.utils import SEGMENT_DISCOUNTS, run_rfm_segmentation
+
+
+class ClientHistoryMixin:
+    """Warsztat i klienci z historią wizyt `(status, koszt, ile dni temu)`."""
+
+    @classmethod
+    def create_workshop(cls, name='Warsztat'):
+        owner = User.objects.create_user(email=f'{name.lower()}@example.com', password='test', first_name='Jan', last_name='Kowalski')
+        return Workshop.objects.create(name=name, owner=owner)
+
+    @classmethod
+    def create_client(cls, workshop, visits=(), vehicle_year=None, name='Klient'):
+        client = Client.objects.create(workshop=workshop, first_name=name, last_name='Testowy', phone='1')
+        vehicle = Vehicle.objects.create(client=client, make='Skoda', model='Octavia', year=vehicle_year,
+                                         license_plate=f'WX{Vehicle.objects.count():05d}')
+        for status, cost, days_ago in visits:
+            Appointment.objects.create(
+                workshop=workshop, client=client, vehicle=vehicle, status=status,
+                total_cost=Decimal(cost) if cost is not None else None,
+                scheduled_time=timezone.now() - timedelta(days=days_ago),
+            )
+        return client
+
+
+def run_tasks_eagerly(testcase):
+    """
+    Zadania Celery wykonywane synchronicznie. Aplikacja czyta konfigurację
+    z przestrzenią nazw CELERY, więc liczy się klucz `CELERY_TASK_ALWAYS_EAGER`.
+    """
+    override = override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    override.enable()
+    testcase.addCleanup(override.disable)
+    testcase.addCleanup(celery_app.conf.update, CELERY_TASK_ALWAYS_EAGER=celery_app.conf.task_always_eager)
+    celery_app.conf.update(CELERY_TASK_ALWAYS_EAGER=True)
+
+
+class ModelRegistryTests(SimpleTestCase):
+    """Model jest ładowany raz na proces i podmieniany dopiero po zmianie treści pliku."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.model_path = os.path.join(self.directory, 'model.joblib')
+        self.metadata_path = os.path.join(self.directory, 'model_metadata.json')
+        self.write_model({'name': 'v1'}, version='1')
+        self.registry = ModelRegistry(self.model_path, self.metadata_path, check_interval=0, compact_path=None)
+
+    def write_model(self, model, version):
+        joblib.dump(model, self.model_path)
+        with open(self.metadata_path, 'w') as f:
+            json.dump({'version': version, 'features': ['recency', 'frequency']}, f)
+
+    def test_model_is_loaded_once(self):
+        first = self.registry.get()
+        self.assertEqual(first.model, {'name': 'v1'})
+        self.assertEqual(first.version, '1')
+        self.assertEqual(first.features, ['recency', 'frequency'])
+        self.assertIs(self.registry.get(), first)
+
+    def test_touched_file_keeps_loaded_model(self):
+        first = self.registry.get()
+        stat = os.stat(self.model_path)
+        os.utime(self.model_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertIs(self.registry.get(), first)
+
+    def test_changed_file_is_reloaded(self):
+        self.registry.get()
+        self.write_model({'name': 'v2'}, version='2')
+        loaded = self.registry.get()
+        self.assertEqual(loaded.model, {'name': 'v2'})
+        self.assertEqual(self.registry.version, '2')
+
+    def test_broken_file_keeps_previous_model(self):
+        first = self.registry.get()
+        with open(self.model_path, 'wb') as f:
+            f.write(b'to nie jest pickle')
+        with self.assertLogs('ai_module.registry', 'ERROR'):
+            self.assertIs(self.registry.get(), first)
+
+    def test_missing_model_raises(self):
+        os.remove(self.model_path)
+        with self.assertRaises(FileNotFoundError):
+            self.registry.get()
+
+
+class ClientFeatureQueryTests(ClientHistoryMixin, TestCase):
+    """Cechy RFM wszystkich klientów z jednego zapytania z GROUP BY."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workshop = cls.create_workshop()
+        cls.regular = cls.create_client(cls.workshop, [
+            ('completed', '100.00', 40), ('completed', '300.00', 10), ('canceled', None, 5), ('pending', '50.00', 1),
+        ], vehicle_year=2015)
+        cls.fresh = cls.create_client(cls.workshop)
+
+    def test_all_clients_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = {row['id']: row for row in client_features_queryset()}
+        self.assertEqual(set(rows), {self.regular.pk, self.fresh.pk})
+
+        row = rows[self.regular.pk]
+        self.assertEqual(row['frequency'], 2)
+        self.assertEqual(row['monetary_value'], Decimal('400.00'))
+        self.assertEqual(row['canceled_count'], 1)
+        self.assertEqual(row['vehicle_year'], 2015)
+
+    def test_build_features(self):
+        today = timezone.now().date()
+        rows = {row['id']: row for row in client_features_queryset()}
+
+        features = build_features(rows[self.regular.pk], today)
+        self.assertEqual(features['recency'], 10)
+        self.assertEqual(features['time_since_first_visit'], 40)
+        self.assertEqual(features['avg_cost'], 200.0)
+        self.assertAlmostEqual(features['cancellation_rate'], 1 / 3)
+
+        features = build_features(rows[self.fresh.pk], today)
+        self.assertEqual(features['frequency'], 0)
+        self.assertEqual(features['recency'], 0)
+        self.assertEqual(features['time_since_first_visit'], DEFAULT_TIME_SINCE_FIRST_VISIT)
+        self.assertEqual(features['vehicle_year'], today.year - DEFAULT_VEHICLE_AGE)
+
+
+class FrequencyModel:
+    """Model zastępczy: segment A od dwóch wizyt, zapamiętuje rozmiary porcji."""
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, X):
+        self.batches.append(len(X))
+        return np.where(X['frequency'] >= 2, 'A', 'D')
+
+
+class UpdateSegmentsTests(ClientHistoryMixin, TestCase):
+    """Predykcja porcjami jednym wywołaniem modelu i zapis tylko zmienionych segmentów."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workshop = cls.create_workshop()
+        cls.loyal = cls.create_client(cls.workshop, [('completed', '100.00', 30), ('completed', '200.00', 3)])
+        cls.occasional = cls.create_client(cls.workshop, [('completed', '80.00', 90)])
+        cls.fresh = cls.create_client(cls.workshop)
+
+    def setUp(self):
+        self.model = FrequencyModel()
+        loaded = LoadedModel(self.model, FEATURE_NAMES, 'test', 'digest', {})
+        patcher = mock.patch('ai_module.segmentation.get_model', return_value=loaded)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_segments_are_predicted_in_batches(self):
+        stats = update_segments(batch_size=2)
+        self.assertEqual((stats.processed, stats.changed, stats.version), (3, 3, 'test'))
+        self.assertEqual(self.model.batches, [2, 1])
+
+        self.loyal.refresh_from_db()
+        self.assertEqual(self.loyal.segment, 'A')
+        self.assertEqual(self.loyal.discount, Decimal(str(SEGMENT_DISCOUNTS['A'])))
+        self.assertEqual(Client.objects.get(pk=self.fresh.pk).segment, 'D')
+
+    def test_unchanged_segments_are_not_written(self):
+        update_segments()
+        Client.objects.filter(pk=self.occasional.pk).update(segment='B')
+        stats = update_segments(stored=True)
+        self.assertEqual((stats.processed, stats.changed), (3, 1))
+        self.assertEqual(Client.objects.get(pk=self.occasional.pk).segment, 'D')
+
+
+class RfmSegmentationTests(ClientHistoryMixin, TestCase):
+    """Segmentacja RFM w bazie - remisy dostają ten sam kwartyl."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workshop = cls.create_workshop()
+        cls.twins = [
+            cls.create_client(cls.workshop, [('completed', '100.00', 5), ('completed', '100.00', 5)])
+            for _ in range(4)
+        ]
+        # Identyczna historia co do mikrosekundy - inaczej recency nie remisuje
+        Appointment.objects.filter(client__in=cls.twins).update(scheduled_time=timezone.now() - timedelta(days=5))
+        cls.occasional = cls.create_client(cls.workshop, [('completed', '50.00', 60), ('scheduled', '500.00', 1)])
+        cls.fresh = [cls.create_client(cls.workshop) for _ in range(3)]
+
+    def segments(self, clients):
+        return [Client.objects.get(pk=client.pk).segment for client in clients]
+
+    def test_ties_share_a_segment(self):
+        self.assertEqual(run_rfm_segmentation([self.workshop.pk])[0], 8)
+        self.assertEqual(self.segments(self.twins), ['B'] * 4)
+        self.assertEqual(self.segments([self.occasional]), ['C'])
+        self.assertEqual(self.segments(self.fresh), ['D'] * 3)
+        self.assertEqual(Client.objects.get(pk=self.occasional.pk).discount, Decimal(str(SEGMENT_DISCOUNTS['C'])))
+
+    def test_clients_without_completed_visits_fall_back(self):
+        other = self.create_workshop('Drugi')
+        clients = [self.create_client(other, [('scheduled', '300.00', 1)]) for _ in range(4)]
+        run_rfm_segmentation([other.pk])
+        self.assertEqual(self.segments(clients), ['D'] * 4)
+
+    def test_only_changed_segments_are_written(self):
+        run_rfm_segmentation()
+        Client.objects.filter(pk=self.occasional.pk).update(segment='A')
+        self.assertEqual(run_rfm_segmentation(), (8, 1))
+
+
+class SegmentQueueTests(ClientHistoryMixin, TestCase):
+    """Kolejka wysyła klientów transakcji jednym zadaniem Celery i nie dubluje czekających."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workshop = cls.create_workshop()
+        cls.loyal = cls.create_client(cls.workshop, [('completed', '100.00', 30), ('completed', '200.00', 3)])
+        cls.fresh = cls.create_client(cls.workshop)
+
+    def setUp(self):
+        cache.clear()
+        Client.objects.update(segment=None)
+        loaded = LoadedModel(FrequencyModel(), FEATURE_NAMES, 'test', 'digest', {})
+        patcher = mock.patch('ai_module.segmentation.get_model', return_value=loaded)
+        self.get_model = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_transaction_is_sent_once_and_deduplicated(self):
+        queue = SegmentUpdateQueue(window=5)
+        with mock.patch.object(update_queued_segments_task, 'apply_async') as send:
+            with self.captureOnCommitCallbacks(execute=True):
+                for client in (self.loyal, self.fresh, self.loyal):
+                    queue.enqueue_on_commit(client.pk)
+            send.assert_called_once()
+            self.assertEqual(set(send.call_args.args[0][0]), {str(self.loyal.pk), str(self.fresh.pk)})
+            self.assertEqual(send.call_args.kwargs['countdown'], 5)
+
+            # Klient czeka już na przeliczenie - kolejny zapis nie planuje drugiego zadania
+            with self.captureOnCommitCallbacks(execute=True):
+                queue.enqueue_on_commit(self.loyal.pk)
+            send.assert_called_once()
+
+    def test_worker_updates_queued_clients(self):
+        run_tasks_eagerly(self)
+        self.assertEqual(SegmentUpdateQueue(window=0).enqueue([self.loyal.pk, self.fresh.pk]), 2)
+        self.assertEqual(Client.objects.get(pk=self.loyal.pk).segment, 'A')
+        self.assertEqual(Client.objects.get(pk=self.fresh.pk).segment, 'D')
+
+    def test_rfm_fallback_writes_only_queued_clients(self):
+        self.get_model.side_effect = FileNotFoundError
+        summary = update_queued_segments_task.apply(([str(self.fresh.pk)],)).get()
+        self.assertEqual(summary['processed'], 1)
+        self.assertEqual(Client.objects.get(pk=self.fresh.pk).segment, 'D')
+        self.assertIsNone(Client.objects.get(pk=self.loyal.pk).segment)
+
+    def test_nightly_run_recovers_unsent_clients(self):
+        schedule = {entry['task']: entry['schedule'] for entry in celery_app.conf.beat_schedule.values()}
+        self.assertEqual(schedule['ai_module.tasks.update_client_segments_task'].day_of_week, set(range(7)))
+
+        run_tasks_eagerly(self)
+        summary = update_client_segments_task.apply().get()
+        self.assertEqual(summary['processed'], 2)
+        self.assertEqual(Client.objects.get(pk=self.loyal.pk).segment, 'A')
+
+
+class ClientFeatureStoreTests(ClientHistoryMixin, TestCase):
+    """Różnicowe aktualizacje `ClientFeatures` dają to samo co pełna przebudowa."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workshop = cls.create_workshop()
+        cls.first = cls.create_client(cls.workshop, [('completed', '100.00', 20), ('pending', None, 2)])
+        cls.second = cls.create_client(cls.workshop, [('canceled', None, 8)])
+
+    def stored(self):
+        return {
+            row['client_id']: row
+            for row in ClientFeatures.objects.values('client_id', 'completed_count', 'completed_total', 'canceled_count',
+                                                     'first_completed_at', 'last_completed_at')
+        }
+
+    def assertConsistent(self):
+        self.assertEqual(check_client_features(), [])
+        incremental = self.stored()
+        rebuild_client_features()
+        self.assertEqual(self.stored(), incremental)
+
+    def test_status_cost_and_date_changes(self):
+        pending = Appointment.objects.get(client=self.first, status='pending')
+        pending.status = 'completed'
+        pending.total_cost = Decimal('250.00')
+        pending.save()
+        self.assertConsistent()
+
+        pending.total_cost = Decimal('199.99')
+        pending.scheduled_time -= timedelta(days=60)
+        pending.save()
+        self.assertConsistent()
+        self.assertEqual(ClientFeatures.objects.get(client=self.first).completed_total, Decimal('299.99'))
+
+        pending.status = 'canceled'
+        pending.save()
+        self.assertConsistent()
+
+    def test_moved_and_deleted_appointments(self):
+        completed = Appointment.objects.get(client=self.first, status='completed')
+        completed.client = self.second
+        completed.save()
+        self.assertConsistent()
+        self.assertEqual(ClientFeatures.objects.get(client=self.second).completed_count, 1)
+
+        completed.delete()
+        Appointment.objects.get(client=self.second, status='canceled').delete()
+        self.assertConsistent()
+        self.assertEqual(ClientFeatures.objects.get(client=self.second).canceled_count, 0)
+
+    def test_missing_row_is_reported_and_rebuilt(self):
+        ClientFeatures.objects.filter(client=self.second).delete()
+        self.assertEqual(check_client_features(), [(self.second.pk, None, None, None)])
+        self.assertEqual(rebuild_client_features(), 2)
+        self.assertEqual(check_client_features(), [])
+
+
+class TrainModelTests(ClientHistoryMixin, TestCase):
+    """Trening zapisuje model, model kompaktowy i metadane jako spójny zestaw."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workshop = cls.create_workshop()
+        for i in range(8):
+            loyal = cls.create_client(cls.workshop, [('completed', f'{100 + i}.00', 5 + i)] * 3, name=f'Stały{i}')
+            fresh = cls.create_client(cls.workshop, [('canceled', None, 200 + i)], name=f'Nowy{i}')
+            Client.objects.filter(pk=loyal.pk).update(segment='A')
+            Client.objects.filter(pk=fresh.pk).update(segment='D')
+        cls.create_client(cls.workshop, name='Bez segmentu')
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.paths = {
+            'MODEL_PATH': os.path.join(directory, 'model.joblib'),
+            'COMPACT_MODEL_PATH': os.path.join(directory, 'model.npz'),
+            'METADATA_PATH': os.path.join(directory, 'model_metadata.json'),
+        }
+        module = 'ai_module.management.commands.train_model'
+        patchers = [mock.patch(f'{module}.{name}', path) for name, path in self.paths.items()]
+        patchers.append(mock.patch(f'{module}.PARAM_GRID', {'classifier__n_estimators': [5], 'classifier__max_depth': [3]}))
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def registry(self):
+        return ModelRegistry(self.paths['MODEL_PATH'], self.paths['METADATA_PATH'], check_interval=0,
+                             compact_path=self.paths['COMPACT_MODEL_PATH'])
+
+    def test_buffer_is_sized_to_the_dataset(self):
+        with mock.patch('ai_module.management.commands.train_model.np.empty', wraps=np.empty) as empty:
+            X, y = TrainModelCommand(stdout=StringIO()).prepare_dataset(max_rows=1_000_000, chunk_size=100, seed=1)
+        self.assertEqual(empty.call_args_list[0].args[0], (16, len(FEATURE_NAMES)))
+        self.assertEqual(len(X), 16)
+        self.assertEqual(sorted(set(y)), ['A', 'D'])
+
+    def test_files_are_written_with_checksums(self):
+        with self.settings(AI_TRAIN_N_JOBS=1), mock.patch.object(TrainModelCommand, 'train', autospec=True, side_effect=TrainModelCommand.train) as train:
+            call_command('train_model', cv=2, stdout=StringIO())
+        self.assertEqual(train.call_args.args[3]['n_jobs'], 1)
+
+        with open(self.paths['METADATA_PATH']) as f:
+            metadata = json.load(f)
+        self.assertEqual(metadata['checksums'], {
+            'model': file_checksum(self.paths['MODEL_PATH']),
+            'compact': file_checksum(self.paths['COMPACT_MODEL_PATH']),
+        })
+        loaded = self.registry().get()
+        self.assertIsInstance(loaded.model, CompactForest)
+        self.assertEqual(loaded.version, metadata['version'])
+
+    def test_model_not_matching_metadata_is_rejected(self):
+        with self.settings(AI_TRAIN_N_JOBS=1):
+            call_command('train_model', cv=2, stdout=StringIO())
+        registry = self.registry()
+        previous = registry.get()
+
+        # Nowy plik modelu zapisany, metadane jeszcze nie - zestaw jest niespójny
+        joblib.dump({'name': 'w trakcie zapisu'}, self.paths['MODEL_PATH'])
+        with self.assertLogs('ai_module.registry', 'ERROR'):
+            self.assertIs(registry.get(), previous)
+        with self.assertRaises(ModelMismatchError):
+            self.registry().get()
+
+
+class CompactForestTests(SimpleTestCase):
+    """Model kompaktowy daje te same klasy i prawdopodobieństwa co pipeline sklearn."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+
+        rng = np.random.default_rng(5)
+        X = rng.normal(size=(400, len(FEATURE_NAMES))) * rng.uniform(1, 1000, len(FEATURE_NAMES))
+        y = np.where(X[:, 0] + X[:, 1] / 100 > 0, 'A', np.where(X[:, 2] > 0, 'B', 'D'))
+        cls.pipeline = Pipeline([
+            ('scaler', StandardScaler()),
+            ('classifier', RandomForestClassifier(n_estimators=15, max_depth=8, random_state=1)),
+        ]).fit(X, y)
+        cls.X = rng.normal(size=(PREDICT_CHUNK + 100, len(FEATURE_NAMES))) * rng.uniform(1, 1000, len(FEATURE_NAMES))
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'model.npz')
+        export_pipeline(self.pipeline, self.path, FEATURE_NAMES, version='7')
+
+    def test_predictions_match_sklearn(self):
+        compact = CompactForest.load(self.path)
+        self.assertEqual(compact.version, '7')
+        self.assertEqual(compact.features, FEATURE_NAMES)
+        self.assertEqual(list(compact.classes_), list(self.pipeline.classes_))
+        np.testing.assert_array_equal(compact.predict(self.X), self.pipeline.predict(self.X))
+        np.testing.assert_allclose(compact.predict_proba(self.X), self.pipeline.predict_proba(self.X), atol=1e-9)
+
+    def test_loads_without_memory_mapping(self):
+        compact = CompactForest.load(self.path, mmap=False)
+        np.testing.assert_array_equal(compact.predict(self.X[:10]), self.pipeline.predict(self.X[:10]))
+
+
+class SegmentTasksTests(ClientHistoryMixin, TestCase):
+    """Podział klientów na porcje, uzupełnianie brakujących cech i ustawienia Celery."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workshop = cls.create_workshop()
+        cls.small_workshop = cls.create_workshop('Filia')
+        cls.clients = [cls.create_client(cls.workshop, [('completed', '90.00', i)] * (i % 3), name=f'K{i}') for i in range(7)]
+        cls.create_client(cls.small_workshop)
+
+    def setUp(self):
+        loaded = LoadedModel(FrequencyModel(), FEATURE_NAMES, 'test', 'digest', {})
+        patcher = mock.patch('ai_module.segmentation.get_model', return_value=loaded)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        run_tasks_eagerly(self)
+
+    def test_chunks_cover_every_client_once(self):
+        chunks = plan_chunks(chunk_size=3)
+        self.assertEqual(len(chunks), 4)
+        ids = [pk for chunk in chunks for pk in chunk_clients(chunk).values_list('pk', flat=True)]
+        self.assertEqual(len(ids), Client.objects.count())
+        self.assertEqual(set(ids), set(Client.objects.values_list('pk', flat=True)))
+
+    def test_missing_features_are_rebuilt_before_the_chord(self):
+        ClientFeatures.objects.filter(client__in=self.clients[:4]).delete()
+        with mock.patch('ai_module.features.refresh_client_features') as refresh:
+            summary = update_client_segments_task.apply(kwargs={'chunk_size': 3}).get()
+        refresh.assert_not_called()
+        self.assertEqual((summary['chunks'], summary['processed']), (4, 8))
+        self.assertEqual(check_client_features(), [])
+
+    def test_migration_backfills_client_features(self):
+        ClientFeatures.objects.all().delete()
+        migration = importlib.import_module('ai_module.migrations.0002_backfill_client_features')
+        migration.backfill_client_features(apps, None)
+        self.assertEqual(ClientFeatures.objects.count(), 8)
+        self.assertEqual(check_client_features(), [])
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=False, CELERY_BROKER_URL='memory://', CELERY_RESULT_BACKEND='redis://localhost:6379/0')
+    def test_in_memory_broker_is_reported(self):
+        ids = {message.id for message in run_checks()}
+        self.assertIn('ai_module.E001', ids)
+        self.assertNotIn('ai_module.W002', ids)
+
+
+class MetricsTests(SimpleTestCase):
+    """Migawki metryk w plikach - `collect()` widzi wszystkie procesy."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        override = override_settings(AI_METRICS_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        ai_metrics.reset_all()
+
+    def other_process(self, name='worker-1'):
+        process = ai_metrics.Metrics()
+        process.process_name = name
+        return process
+
+    def test_collect_merges_snapshots_of_all_processes(self):
+        worker = self.other_process()
+        worker.incr('predict.calls', 3)
+        worker.observe('predict.total', 4)
+        worker.flush()
+        ai_metrics.metrics.incr('predict.calls')
+        ai_metrics.metrics.observe('predict.total', 40)
+
+        summary = ai_metrics.collect()
+        self.assertEqual(summary['processes'], 2)
+        self.assertEqual(summary['counters'], {'predict.calls': 4})
+        self.assertEqual(summary['histograms']['predict.total']['count'], 2)
+        self.assertEqual(summary['histograms']['predict.total']['max'], 40)
+
+    def test_expired_and_reset_snapshots_are_dropped(self):
+        worker = self.other_process()
+        worker.incr('predict.calls')
+        worker.flush()
+        path = os.path.join(self.directory, 'worker-1.json')
+        old = time.time() - ai_metrics.DEFAULT_SNAPSHOT_TTL - 60
+        os.utime(path, (old, old))
+
+        self.assertEqual(ai_metrics.collect()['counters'], {})
+        self.assertFalse(os.path.exists(path))
+
+        worker.flush()
+        ai_metrics.reset_all()
+        self.assertEqual(os.listdir(self.directory), [ai_metrics.RESET_MARKER])
+
+    def test_snapshots_of_finished_processes_are_dropped(self):
+        finished = subprocess.Popen([sys.executable, '-c', 'pass'])
+        finished.wait()
+        worker = self.other_process('restarted-worker')
+        worker.pid = finished.pid
+        worker.incr('predict.calls', 5)
+        worker.flush()
+        other_host = self.other_process('other-host-1')
+        other_host.host, other_host.pid = 'other-host', finished.pid
+        other_host.incr('predict.calls', 2)
+        other_host.flush()
+
+        self.assertEqual(ai_metrics.collect()['counters'], {'predict.calls': 2})
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'restarted-worker.json')))
+
+    def test_reset_reaches_other_processes(self):
+        worker = self.other_process()
+        worker.incr('predict.calls', 3)
+        worker.flush()
+        time.sleep(0.01)
+        ai_metrics.reset_all()
+        self.assertEqual(ai_metrics.collect()['counters'], {})
+
+        worker.flush()
+        self.assertEqual(worker.snapshot()['counters'], {})
+        worker.incr('predict.calls')
+        worker.flush()
+        self.assertEqual(ai_metrics.collect()['counters'], {'predict.calls': 1})
+
+    def test_default_directory_is_outside_the_source_tree(self):
+        source = os.path.dirname(os.path.dirname(os.path.abspath(ai_metrics.__file__)))
+        self.assertFalse(os.path.abspath(ai_metrics.DEFAULT_METRICS_DIR).startswith(source + os.sep))
+
+    def test_import_does_not_need_settings(self):
+        env = {key: value for key, value in os.environ.items() if key != 'DJANGO_SETTINGS_MODULE'}
+        code = "from ai_module.metrics import metrics; print(metrics.snapshot()['started_at'])"
+        result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(__file__)),
+                                env=env, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+class ResponseCacheTests(SimpleTestCase):
+    """Cache odpowiedzi LLM: wygasanie po TTL i wyrzucanie najdawniej używanych."""
+
+    def test_entries_expire_after_ttl(self):
+        cache = ResponseCache(max_size=10, ttl=60)
+        with mock.patch('ai_module.llm.time.monotonic', return_value=1000.0):
+            cache.set('a', 'treść')
+        with mock.patch('ai_module.llm.time.monotonic', return_value=1059.0):
+            self.assertEqual(cache.get('a'), 'treść')
+        with mock.patch('ai_module.llm.time.monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResponseCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_disabled_cache_stores_nothing(self):
+        cache = ResponseCache(max_size=0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+
+class LLMClientTests(SimpleTestCase):
+    """Klient współdzielony przez proces: identyczne prompty obsługuje z cache."""
+
+    def setUp(self):
+        self.backend = StubBackend()
+        self.client = LLMClient(backend=self.backend, cache=ResponseCache(max_size=10, ttl=60))
+        self.addCleanup(self.client.close)
+
+    def test_identical_prompts_hit_the_backend_once(self):
+        messages = [{'role': 'user', 'content': 'Przypomnienie o przeglądzie'}]
+        with mock.patch.object(self.backend, 'complete', wraps=self.backend.complete) as complete:
+            first = asyncio.run(self.client.complete(messages))
+            second = asyncio.run(self.client.complete(messages))
+            asyncio.run(self.client.complete(messages, temperature=0.2))
+        self.assertEqual(first, second)
+        self.assertEqual(complete.call_count, 2)
+
+    def test_concurrent_requests_share_the_client_loop(self):
+        async def generate():
+            return await asyncio.gather(*[
+                self.client.complete([{'role': 'user', 'content': f'Wiadomość {i}'}]) for i in range(5)
+            ])
+
+        results = asyncio.run(generate())
+        self.assertEqual(len(set(results)), 5)
+        self.assertEqual(len(self.client.cache), 5)
+
+
+class TemplateBackend(StubBackend):
+    """Odpowiedź ze znacznikiem odbiorcy - jak model, który zostawił go zgodnie z promptem."""
+
+    async def complete(self, client, messages, max_tokens, temperature):
+        return f"Dzień dobry {RECIPIENT_PLACEHOLDER}, zapraszamy na przegląd."
+
+
+@override_settings(AI_LLM_BACKEND='ai_module.tests.TemplateBackend')
+class EmailBatchTests(ClientHistoryMixin, TestCase):
+    """Zbiorcze e-maile: jeden prompt na segment, postęp i wyniki w bazie, dostęp tylko dla warsztatu."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workshop = cls.create_workshop()
+        cls.owner = cls.workshop.owner
+        cls.owner.roles.add(Role.objects.get_or_create(name='workshop_owner')[0])
+        for name in ('Anna', 'Piotr', 'Ewa'):
+            client = cls.create_client(cls.workshop, name=name)
+            Client.objects.filter(pk=client.pk).update(segment='A', email=f'{name.lower()}@example.com')
+        cls.other = cls.create_workshop('Konkurencja')
+        cls.other.owner.roles.add(Role.objects.get_or_create(name='workshop_owner')[0])
+        cls.mechanic = User.objects.create_user(email='mechanik@example.com', password='test', first_name='Marek', last_name='Mechanik')
+        cls.mechanic.roles.add(Role.objects.get_or_create(name='mechanic')[0])
+        Employee.objects.create(user=cls.mechanic, workshop=cls.workshop, position='Mechanik',
+                                hire_date=timezone.now().date(), status='APPROVED')
+
+    def setUp(self):
+        reset_llm_client()
+        self.addCleanup(reset_llm_client)
+        self.clients = list(Client.objects.filter(workshop=self.workshop).order_by('first_name')
+                            .values('id', 'first_name', 'last_name', 'email', 'segment'))
+        self.api = APIClient()
+
+    def test_segment_shares_one_prompt(self):
+        batch = EmailBatch(self.workshop.pk, self.clients, 'Przegląd', 'Jan', 'Kierownik', 'Warsztat')
+        self.assertEqual(batch.status['unique_prompts'], 1)
+        with mock.patch.object(TemplateBackend, 'complete', autospec=True, side_effect=TemplateBackend.complete) as complete:
+            results = list(batch.run())
+        self.assertEqual(complete.call_count, 1)
+        self.assertEqual(sorted(result['content'] for result in results), [
+            'Dzień dobry Anna Testowy, zapraszamy na przegląd.',
+            'Dzień dobry Ewa Testowy, zapraszamy na przegląd.',
+            'Dzień dobry Piotr Testowy, zapraszamy na przegląd.',
+        ])
+
+        job = EmailBatchJob.objects.get(pk=batch.id)
+        self.assertEqual((job.status, job.total, job.completed, job.failed), ('completed', 3, 3, 0))
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(EmailBatchResult.objects.filter(batch=job).count(), 3)
+
+    def test_per_client_prompts_are_deduplicated_by_content(self):
+        clients = self.clients
+        batch = EmailBatch(self.workshop.pk, clients + clients[:1], 'Przegląd', 'Jan', 'Kierownik', 'Warsztat', per_client=True)
+        self.assertEqual(batch.status['unique_prompts'], 3)
+        self.assertEqual(len(list(batch.run())), 4)
+
+    def test_closed_stream_cancels_the_batch(self):
+        batch = EmailBatch(self.workshop.pk, self.clients, 'Przegląd', 'Jan', 'Kierownik', 'Warsztat', per_client=True)
+        results = batch.run()
+        next(results)
+        results.close()
+        job = EmailBatchJob.objects.get(pk=batch.id)
+        self.assertEqual((job.status, job.completed), ('canceled', 1))
+
+    def test_status_is_read_from_the_database(self):
+        self.api.force_authenticate(self.mechanic)
+        payload = {'workshop_id': str(self.workshop.pk), 'segment': 'A', 'subject_hint': 'Przegląd'}
+        response = self.api.post(reverse('generate_email_batch'), payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        # Synchroniczny iterator - strumień działa także pod WSGI
+        self.assertFalse(response.is_async)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line['type'] for line in lines], ['batch', 'email', 'email', 'email', 'done'])
+
+        status_url = reverse('email_batch_status', kwargs={'batch_id': lines[0]['batch_id']})
+        self.api.force_authenticate(self.owner)
+        status = self.api.get(status_url).json()
+        self.assertEqual((status['status'], status['completed']), ('completed', 3))
+        self.assertEqual(len(status['results']), 3)
+
+        self.api.force_authenticate(self.other.owner)
+        self.assertEqual(self.api.get(status_url).status_code, 403)
+
+    def test_other_workshop_is_forbidden(self):
+        payload = {'workshop_id': str(self.workshop.pk), 'segment': 'A'}
+        self.assertEqual(self.api.post(reverse('generate_email_batch'), payload, format='json').status_code, 401)
+        self.api.force_authenticate(self.other.owner)
+        self.assertEqual(self.api.post(reverse('generate_email_batch'), payload, format='json').status_code, 403)
+        self.assertFalse(EmailBatchJob.objects.exists())
+
+
+class DurationIndexTests(ClientHistoryMixin, TestCase):
+    """Przyrostowa budowa indeksu czasu napraw daje to samo co pełna przebudowa."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workshop = cls.create_workshop()
+        client = cls.create_client(cls.workshop, [('completed', '100.00', 10), ('completed', '100.00', 5)])
+        cls.first, cls.second = Appointment.objects.filter(client=client).order_by('scheduled_time')
+        for appointment, minutes in ((cls.first, 60), (cls.second, 90)):
+            RepairItem.objects.bulk_create([
+                RepairItem(appointment=appointment, description='Wymiana oleju silnikowego', actual_duration=timedelta(minutes=minutes)),
+                RepairItem(appointment=appointment, description='Wymiana klocków hamulcowych', actual_duration=timedelta(minutes=120)),
+            ])
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'index.npz')
+        self.full_path = os.path.join(directory, 'full.npz')
+
+    def assertMatchesFullRebuild(self):
+        duration.build_index(full=True, path=self.full_path)
+        incremental = duration.DurationIndex.load(self.path)
+        full = duration.DurationIndex.load(self.full_path)
+        self.assertEqual(sorted(incremental.ids), sorted(full.ids))
+        self.assertEqual(incremental.matrix.nnz, full.matrix.nnz)
+        return incremental
+
+    def test_changed_items_replace_their_rows(self):
+        self.assertEqual(duration.build_index(path=self.path), (4, 4))
+        item = RepairItem.objects.filter(appointment=self.first).first()
+        item.actual_duration = timedelta(minutes=45)
+        item.save()
+        self.assertEqual(duration.build_index(path=self.path), (4, 1))
+        index = self.assertMatchesFullRebuild()
+        self.assertEqual(index.durations[list(index.ids).index(str(item.pk))], 45 * 60)
+
+    def test_deleted_items_and_appointments_are_removed(self):
+        duration.build_index(path=self.path)
+        RepairItem.objects.filter(appointment=self.second, description__startswith='Wymiana oleju').delete()
+        self.assertEqual(duration.build_index(path=self.path)[0], 3)
+        self.first.delete()
+        self.assertEqual(duration.build_index(path=self.path), (1, 0))
+        self.assertMatchesFullRebuild()
+
+
+class RecommendationIndexTests(ClientHistoryMixin, TestCase):
+    """Indeks rekomendacji liczy prace wizyt i samodzielną historię serwisową, dopisywany okresowo."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.workshop = cls.create_workshop()
+        cls.customer = cls.create_client(cls.workshop, [('pending', None, 3)] * 3)
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'index.npz')
+
+    def complete(self, appointment, items):
+        RepairItem.objects.bulk_create([RepairItem(appointment=appointment, description=item) for item in items])
+        appointment.status = 'completed'
+        appointment.notes = 'Klient prosi o telefon przed odbiorem'
+        appointment.save()
+
+    def test_only_repair_items_are_counted(self):
+        first, second, _ = Appointment.objects.filter(client=self.customer)
+        self.complete(first, ['Wymiana oleju', 'Wymiana filtra powietrza'])
+        self.complete(second, ['Wymiana oleju', 'Wymiana filtra powietrza'])
+
+        self.assertEqual(recommendations.build_index(path=self.path), (2, 2))
+        index = recommendations.RecommendationIndex.load(self.path)
+        self.assertEqual(sorted(index.labels), ['wymiana filtra powietrza', 'wymiana oleju'])
+        result = index.recommend(['Wymiana oleju'], 'Skoda', 'Octavia', 0)
+        self.assertEqual([r['item'] for r in result['recommendations']], ['wymiana filtra powietrza'])
+
+    def test_standalone_service_history_is_counted(self):
+        first = Appointment.objects.filter(client=self.customer).first()
+        self.complete(first, ['Wymiana oleju', 'Wymiana filtra powietrza'])
+        vehicle = first.vehicle
+        ServiceRecord.objects.create(vehicle=vehicle, date=timezone.now().date(), mileage=120000,
+                                     description='Wymiana oleju\nWymiana filtra powietrza\n')
+        self.assertEqual(recommendations.build_index(path=self.path), (2, 2))
+
+        index = recommendations.RecommendationIndex.load(self.path)
+        # Wpis utworzony z wizyty (z notatkami) nie jest liczony drugi raz
+        self.assertEqual(sorted(index.labels), ['wymiana filtra powietrza', 'wymiana oleju'])
+        result = index.recommend(['Wymiana oleju'], 'Skoda', 'Octavia', 0)
+        self.assertEqual([(r['item'], r['support']) for r in result['recommendations']], [('wymiana filtra powietrza', 2)])
+
+        ServiceRecord.objects.create(vehicle=vehicle, date=timezone.now().date(), mileage=125000, description='Wymiana opon')
+        self.assertEqual(recommendations.build_index(path=self.path), (3, 1))
+
+    def test_completion_is_picked_up_by_the_periodic_build(self):
+        first, second, _ = Appointment.objects.filter(client=self.customer)
+        self.complete(first, ['Wymiana oleju'])
+        recommendations.build_index(path=self.path)
+        stamp = os.stat(self.path).st_mtime_ns
+
+        self.assertEqual(recommendations.build_index(path=self.path), (1, 0))
+        self.assertEqual(os.stat(self.path).st_mtime_ns, stamp)
+
+        with mock.patch('ai_module.tasks.update_recommendation_index_task.delay') as delay:
+            self.complete(second, ['Wymiana opon'])
+        delay.assert_not_called()
+        self.assertEqual(recommendations.build_index(path=self.path), (2, 1))
+
+        schedule = {entry['task']: entry for entry in celery_app.conf.beat_schedule.values() if not entry.get('kwargs')}
+        self.assertEqual(schedule['ai_module.tasks.update_recommendation_index_task']['schedule'].minute, set(range(0, 60, 15)))
@@ -1,6 +1,9 @@
 from django.urls import path
-from .views import generate_email_content
+from .views import EmailBatchStatusView, EmailBatchView, MetricsView, generate_email_content
 
 urlpatterns = [
     path('generate-email/', generate_email_content, name='generate_email_content'),
+    path('generate-email/batch/', EmailBatchView.as_view(), name='generate_email_batch'),
+    path('generate-email/batch/<uuid:batch_id>/', EmailBatchStatusView.as_view(), name='email_batch_status'),
+    path('ai-metrics/', MetricsView.as_view(), name='ai_metrics'),
 ]
@@ -1,6 +1,5 @@
-import pandas as pd
+from django.db import NotSupportedError, connection, transaction
 from django.utils import timezone
-from django.db.models import Sum, Count, Max
 from clients.models import Client
 
 SEGMENT_DISCOUNTS = {
@@ -10,72 +9,127 @@ SEGMENT_DISCOUNTS = {
     'D': 0.00,   # Brak rabatu
 }
 
-# def calculate_rfm():
-#     clients = Client.objects.all()
-#     data = []
-#     today = timezone.now().date()
-
-#     for client in clients:
-#         appointments = client.appointments.filter(status='completed')
-
-#         if appointments.exists():
-#             frequency = appointments.count()
-#             monetary_value = appointments.aggregate(total_spent=Sum('total_cost'))['total_spent'] or 0
-#             last_appointment_date = appointments.aggregate(last_date=Max('scheduled_time'))['last_date'].date()
-#             recency = (today - last_appointment_date).days
-#         else:
-#             frequency = 0
-#             monetary_value = 0
-#             recency = None  # Możemy przypisać wysoką wartość później
-
-#         data.append({
-#             'client_id': client.id,
-#             'recency': recency,
-#             'frequency': frequency,
-#             'monetary_value': monetary_value,
-#         })
-
-#     df = pd.DataFrame(data)
-#     return df
-
-# def assign_rfm_scores(df):
-#     # Zastąp wartości None w recency wysoką liczbą
-#     max_recency = df['recency'].max() or 0
-#     df['recency'].fillna(max_recency + 10, inplace=True)
-
-#     # Przypisz punkty RFM
-#     df['R_score'] = pd.qcut(df['recency'], 4, labels=[4, 3, 2, 1]).astype(int)
-#     df['F_score'] = pd.qcut(df['frequency'].rank(method='first'), 4, labels=[1, 2, 3, 4]).astype(int)
-#     df['M_score'] = pd.qcut(df['monetary_value'], 4, labels=[1, 2, 3, 4]).astype(int)
-
-#     # Oblicz łączny wynik RFM
-#     df['RFM_score'] = df['R_score'] + df['F_score'] + df['M_score']
-
-#     return df
-
-# def assign_segments(df):
-#     def segment_rfm(row):
-#         if row['RFM_score'] >= 10:
-#             return 'A'
-#         elif row['RFM_score'] >= 7:
-#             return 'B'
-#         elif row['RFM_score'] >= 4:
-#             return 'C'
-#         else:
-#             return 'D'
-
-#     df['segment'] = df.apply(segment_rfm, axis=1)
-#     return df
-
-# def update_client_segments(df):
-#     for index, row in df.iterrows():
-#         client = Client.objects.get(id=row['client_id'])
-#         client.segment = row['segment']
-#         client.discount = SEGMENT_DISCOUNTS.get(row['segment'], 0.00)
-#         client.save()
-
-# def run_rfm_segmentation():
-#     df = calculate_rfm()
-#     df = assign_rfm_scores(df)
-#     df = assign_segments(df)
-#     update_client_segments(df)
+# Progi łącznego wyniku RFM (3-12) dla segmentów - jak w dawnym assign_segments
+RFM_THRESHOLDS = (('A', 10), ('B', 7), ('C', 4))
+RFM_FALLBACK_SEGMENT = 'D'
+RFM_QUANTILES = 4
+
+# Pozycja percentylowa (PERCENT_RANK, 0-1) w obrębie warsztatu - klienci o równych
+# wartościach dostają tę samą pozycję, więc i ten sam kwartyl (NTILE dzieliłby remisy
+# między kwartyle według id). Okna wymagają PostgreSQL, SQLite 3.25+ lub MySQL 8+.
+RFM_SQL = """
+    SELECT id, CASE WHEN frequency IS NULL THEN %s {segment_cases} ELSE %s END AS segment
+    FROM (
+        SELECT id, frequency, {r_score} + {f_score} + {m_score} AS rfm_score
+        FROM (
+            SELECT
+                c.id,
+                agg.frequency,
+                -- R: najdawniejsza (lub brak) wizyta -> 0, najświeższa -> 1
+                PERCENT_RANK() OVER (
+                    PARTITION BY c.workshop_id ORDER BY (agg.last_visit IS NULL) DESC, agg.last_visit ASC
+                ) AS r_rank,
+                PERCENT_RANK() OVER (PARTITION BY c.workshop_id ORDER BY COALESCE(agg.frequency, 0) ASC) AS f_rank,
+                PERCENT_RANK() OVER (PARTITION BY c.workshop_id ORDER BY COALESCE(agg.monetary_value, 0) ASC) AS m_rank
+            FROM {client_table} c
+            LEFT JOIN (
+                SELECT client_id,
+                       COUNT(*) AS frequency,
+                       SUM(total_cost) AS monetary_value,
+                       MAX(scheduled_time) AS last_visit
+                FROM {appointment_table}
+                WHERE status = 'completed'
+                GROUP BY client_id
+            ) agg ON agg.client_id = c.id
+            {where}
+        ) ranked
+    ) scored
+"""
+
+
+def _quantile_score(column, quantiles=RFM_QUANTILES):
+    """Pozycja percentylowa -> punkty 1..quantiles (progi to stałe, nie parametry)."""
+    cases = ' '.join(f'WHEN {column} < {i / quantiles!r} THEN {i}' for i in range(1, quantiles))
+    return f'(CASE {cases} ELSE {quantiles} END)'
+
+
+def _rfm_scores_sql(workshop_ids=None):
+    """
+    Zapytanie (id, segment) z kwartylami R/F/M liczonymi w obrębie warsztatu.
+    Klienci bez zakończonych wizyt zawsze trafiają do `RFM_FALLBACK_SEGMENT`.
+    """
+    from appointments.models import Appointment
+
+    params = [RFM_FALLBACK_SEGMENT]
+    segment_cases = []
+    for segment, threshold in RFM_THRESHOLDS:
+        segment_cases.append('WHEN rfm_score >= %s THEN %s')
+        params += [threshold, segment]
+    params.append(RFM_FALLBACK_SEGMENT)
+
+    where = ''
+    if workshop_ids is not None:
+        where = f"WHERE c.workshop_id IN ({', '.join(['%s'] * len(workshop_ids))})"
+        params += [Client._meta.get_field('workshop').target_field.get_db_prep_value(pk, connection)
+                   for pk in workshop_ids]
+
+    sql = RFM_SQL.format(
+        segment_cases=' '.join(segment_cases),
+        r_score=_quantile_score('r_rank'),
+        f_score=_quantile_score('f_rank'),
+        m_score=_quantile_score('m_rank'),
+        client_table=connection.ops.quote_name(Client._meta.db_table),
+        appointment_table=connection.ops.quote_name(Appointment._meta.db_table),
+        where=where,
+    )
+    return sql, params
+
+
+def run_rfm_segmentation(workshop_ids=None, client_ids=None):
+    """
+    Segmentacja regułowa RFM w całości po stronie bazy.
+
+    Kwartyle R/F/M liczone są funkcją okna PERCENT_RANK osobno dla każdego
+    warsztatu, a segment i rabat zapisywane jednym UPDATE ... FROM - tylko
+    klientom, którym segment się zmienił (a przy `client_ids` - tylko tym
+    klientom; kwartyle nadal wynikają z całych warsztatów). Zwraca `(ocenieni
+    klienci, zmienione segmenty)`. Działa bez modelu ML, więc służy jako tryb awaryjny.
+    """
+    if not connection.features.supports_over_clause:
+        raise NotSupportedError("Segmentacja RFM wymaga funkcji okna (PostgreSQL, SQLite 3.25+, MySQL 8+).")
+    if workshop_ids is not None:
+        workshop_ids = list(workshop_ids)
+        if not workshop_ids:
+            return 0, 0
+    if client_ids is not None and not client_ids:
+        return 0, 0
+
+    scores_sql, params = _rfm_scores_sql(workshop_ids)
+    discount_cases = ' '.join('WHEN %s THEN %s' for _ in SEGMENT_DISCOUNTS)
+    discount_params = [value for item in SEGMENT_DISCOUNTS.items() for value in item]
+    table = connection.ops.quote_name(Client._meta.db_table)
+    updated_at = Client._meta.get_field('updated_at').get_db_prep_value(timezone.now(), connection)
+
+    assignments = f"segment = s.segment, discount = CASE s.segment {discount_cases} ELSE 0 END, updated_at = %s"
+    changed = "(t.segment IS NULL OR t.segment <> s.segment)"
+    client_params = []
+    if client_ids is not None:
+        client_ids = list(client_ids)
+        changed += f" AND t.id IN ({', '.join(['%s'] * len(client_ids))})"
+        client_params = [Client._meta.pk.get_db_prep_value(pk, connection) for pk in client_ids]
+    if connection.vendor == 'mysql':
+        sql = f"UPDATE {table} t JOIN ({scores_sql}) s ON s.id = t.id SET {assignments.replace('segment =', 't.segment =', 1)} WHERE {changed}"
+        sql_params = params + discount_params + [updated_at] + client_params
+    else:
+        sql = f"UPDATE {table} AS t SET {assignments} FROM ({scores_sql}) s WHERE s.id = t.id AND {changed}"
+        sql_params = discount_params + [updated_at] + params + client_params
+
+    clients = Client.objects.all()
+    if workshop_ids is not None:
+        clients = clients.filter(workshop_id__in=workshop_ids)
+    if client_ids is not None:
+        clients = clients.filter(pk__in=client_ids)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, sql_params)
+        return clients.count(), cursor.rowcount
@@ -1,11 +1,21 @@
-import openai
 from django.conf import settings
-from django.http import JsonResponse
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 import json
+from clients.models import Client
+from workshops.models import Workshop
+from ai_module.email_batch import DEFAULT_MAX_CLIENTS, EmailBatch, batch_status, email_messages, get_batch
+from ai_module.llm import LLMError, LLMTimeout, get_llm_client
+from ai_module.metrics import collect
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from accounts.permissions import IsAdmin, IsMechanic, IsWorkshopMember, IsWorkshopOwner
 
 @csrf_exempt
-def generate_email_content(request):
+async def generate_email_content(request):
     if request.method != "POST":
         return JsonResponse({"error": "Invalid request method. Use POST."}, status=405)
 
@@ -19,32 +29,111 @@ def generate_email_content(request):
         sender_position = data.get("sender_position", "Twoje Stanowisko")
         sender_company = data.get("sender_company", "Twoja Firma")
 
-        # Skonfiguruj klucz API
-        openai.api_key = settings.API_KEY
-
         # Przygotuj prompt z uwzględnieniem nadawcy
-        messages = [
-            {"role": "system", "content": "Jesteś pomocnym asystentem w warsztacie samochodwym, który pisze profesjonalne wiadomości e-mail."},
-            {"role": "user", "content": f"""
-            Stwórz treść e-maila na temat: {subject_hint}.
-            Nadawca: {sender_name}, {sender_position}, {sender_company}.
-            Typ odbiorcy: {recipient_type}.
-            {f"Segment: {selected_segment}." if selected_segment else ""}
-            {f"Odbiorca: {selected_client}." if selected_client else ""}
-            Wiadomość powinna być uprzejma i profesjonalna.
-            """}
-        ]
-
-        # Wywołaj API OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=500,
-            temperature=0.7,
+        messages = email_messages(
+            subject_hint, sender_name, sender_position, sender_company,
+            recipient_type=recipient_type,
+            selected_segment=selected_segment,
+            selected_client=selected_client,
         )
 
-        generated_email = response['choices'][0]['message']['content'].strip()
+        # Wywołaj model (współdzielona pula połączeń, limity czasu i cache promptów)
+        generated_email = await get_llm_client().complete(messages, max_tokens=500, temperature=0.7)
 
         return JsonResponse({"email_content": generated_email}, status=200)
+    except LLMTimeout as e:
+        return JsonResponse({"error": str(e)}, status=504)
+    except LLMError as e:
+        return JsonResponse({"error": str(e)}, status=502)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
+
+
+def _batch_clients(workshop_id, segment=None, client_ids=None):
+    clients = Client.objects.filter(workshop_id=workshop_id)
+    if client_ids:
+        clients = clients.filter(pk__in=client_ids)
+    if segment:
+        clients = clients.filter(segment=segment)
+    return list(clients.order_by('last_name', 'first_name').values('id', 'first_name', 'last_name', 'email', 'segment'))
+
+
+class WorkshopMemberMixin:
+    permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin | IsMechanic, IsWorkshopMember]
+
+    def get_workshop(self, workshop_id):
+        try:
+            workshop = Workshop.objects.get(pk=workshop_id)
+        except (Workshop.DoesNotExist, ValidationError):
+            raise NotFound("Nie znaleziono warsztatu.")
+        self.check_object_permissions(self.request, workshop)
+        return workshop
+
+
+class EmailBatchView(WorkshopMemberMixin, APIView):
+    """
+    Generuje spersonalizowane e-maile dla segmentu lub listy klientów.
+
+    Wyniki są strumieniowane jako NDJSON (jedna linia JSON na klienta)
+    w kolejności ukończenia; pierwsza linia zawiera `batch_id`, pod którym
+    status i wyniki są dostępne w `generate-email/batch/<batch_id>/`.
+    """
+
+    def post(self, request):
+        data = request.data
+        segment = data.get("segment")
+        client_ids = data.get("client_ids")
+        if not data.get("workshop_id") or not (segment or client_ids):
+            return Response({"error": "Podaj workshop_id oraz segment lub client_ids."}, status=400)
+        workshop = self.get_workshop(data.get("workshop_id"))
+
+        try:
+            clients = _batch_clients(workshop.pk, segment, client_ids)
+            max_clients = getattr(settings, 'AI_EMAIL_BATCH_MAX_CLIENTS', DEFAULT_MAX_CLIENTS)
+            if len(clients) > max_clients:
+                return Response({"error": f"Zbyt wielu odbiorców ({len(clients)}), limit to {max_clients}."}, status=400)
+
+            batch = EmailBatch(
+                workshop.pk,
+                clients,
+                subject_hint=data.get("subject_hint", "Brak tematu"),
+                sender_name=data.get("sender_name", "Twoje Imię i Nazwisko"),
+                sender_position=data.get("sender_position", "Twoje Stanowisko"),
+                sender_company=data.get("sender_company", "Twoja Firma"),
+                per_client=bool(data.get("per_client", False)),
+            )
+        except Exception as e:
+            return Response({"error": str(e)}, status=400)
+
+        # Zwykły (synchroniczny) iterator - serwer WSGI wysyła każdą linię od razu
+        response = StreamingHttpResponse(self.stream(batch), content_type="application/x-ndjson")
+        response["X-Batch-Id"] = batch.id
+        response["Cache-Control"] = "no-cache"
+        return response
+
+    def stream(self, batch):
+        header = {key: batch.status[key] for key in ('batch_id', 'total', 'unique_prompts')}
+        yield json.dumps({"type": "batch", **header}, ensure_ascii=False) + "\n"
+        for result in batch.run():
+            yield json.dumps({"type": "email", **result}, ensure_ascii=False) + "\n"
+        summary = {key: batch.status[key] for key in ('batch_id', 'status', 'completed', 'failed')}
+        yield json.dumps({"type": "done", **summary}, ensure_ascii=False) + "\n"
+
+
+class EmailBatchStatusView(WorkshopMemberMixin, APIView):
+    """Postęp i wyniki zbiorczego generowania (przechowywane w bazie przez dobę)."""
+
+    def get(self, request, batch_id):
+        job = get_batch(batch_id)
+        if job is None:
+            raise NotFound("Nie znaleziono zadania.")
+        self.get_workshop(job.workshop_id)
+        return Response(batch_status(job))
+
+
+class MetricsView(APIView):
+    """Liczniki i histogramy opóźnień modułu AI (ms), zsumowane ze wszystkich procesów."""
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        return Response(collect())
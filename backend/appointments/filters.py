@@ -0,0 +1,170 @@
+import datetime
+import uuid
+import zoneinfo
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from appointments.models import Appointment
+
+STATUSES = {value for value, _ in Appointment.STATUS_CHOICES}
+CALENDAR_SPANS = ('day', 'week', 'month')
+# Najdłuższe okno kalendarza (dni) - miesiąc z zapasem na widok "od poniedziałku"
+MAX_CALENDAR_DAYS = 42
+# Wyszukiwanie wolnych terminów: domyślne okno (dni) i długość terminu (minuty)
+AVAILABILITY_DAYS = 14
+AVAILABILITY_DURATION = 60
+MAX_AVAILABILITY_LIMIT = 100
+
+
+def _parse_moment(name, value, end_of_day=False):
+    """Data lub data z godziną (ISO 8601); sama data oznacza początek dnia (albo następny dzień dla `_to`)."""
+    # Najpierw sama data - parse_datetime od Pythona 3.11 przyjmuje też "RRRR-MM-DD"
+    day = parse_date(value)
+    if day is not None:
+        if end_of_day:
+            day += datetime.timedelta(days=1)
+        moment = datetime.datetime.combine(day, datetime.time.min)
+    else:
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValidationError({name: "Niepoprawna data, oczekiwano formatu RRRR-MM-DD lub ISO 8601."})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _parse_uuid(name, value):
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise ValidationError({name: "Niepoprawny identyfikator."})
+
+
+def filter_appointments(queryset, params):
+    """
+    Filtry listy wizyt z parametrów zapytania.
+
+    - `status` - jeden lub kilka statusów po przecinku,
+    - `scheduled_from` / `scheduled_to` - zakres `scheduled_time` (sama data
+      w `scheduled_to` obejmuje cały dzień),
+    - `client`, `vehicle`, `mechanic` - identyfikatory klienta, pojazdu
+      i przypisanego mechanika.
+
+    Kombinacje warsztat + status + zakres dat i klient + status trafiają
+    w indeksy złożone z `Appointment.Meta.indexes`.
+    """
+    if params.get('status'):
+        statuses = [status.strip() for status in params['status'].split(',') if status.strip()]
+        unknown = set(statuses) - STATUSES
+        if unknown:
+            raise ValidationError({'status': f"Nieznany status: {', '.join(sorted(unknown))}."})
+        queryset = queryset.filter(status=statuses[0]) if len(statuses) == 1 else queryset.filter(status__in=statuses)
+
+    if params.get('scheduled_from'):
+        queryset = queryset.filter(scheduled_time__gte=_parse_moment('scheduled_from', params['scheduled_from']))
+    if params.get('scheduled_to'):
+        value = params['scheduled_to']
+        if parse_date(value) is not None:
+            # Sama data - cały dzień włącznie
+            queryset = queryset.filter(scheduled_time__lt=_parse_moment('scheduled_to', value, end_of_day=True))
+        else:
+            queryset = queryset.filter(scheduled_time__lte=_parse_moment('scheduled_to', value))
+
+    if params.get('client'):
+        queryset = queryset.filter(client_id=_parse_uuid('client', params['client']))
+    if params.get('vehicle'):
+        queryset = queryset.filter(vehicle_id=_parse_uuid('vehicle', params['vehicle']))
+    if params.get('mechanic'):
+        # EXISTS zamiast JOIN - bez duplikatów i bez DISTINCT na całej liście
+        assignments = Appointment.assigned_mechanics.through.objects.filter(
+            appointment_id=OuterRef('pk'), employee_id=_parse_uuid('mechanic', params['mechanic']),
+        )
+        queryset = queryset.filter(Exists(assignments))
+
+    return queryset
+
+
+def _parse_tz(params):
+    try:
+        return zoneinfo.ZoneInfo(params['tz']) if params.get('tz') else timezone.get_current_timezone()
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise ValidationError({'tz': "Nieznana strefa czasowa."})
+
+
+def _parse_int(params, name, default, minimum, maximum):
+    if not params.get(name):
+        return default
+    try:
+        value = int(params[name])
+    except ValueError:
+        raise ValidationError({name: "Oczekiwano liczby całkowitej."})
+    if not minimum <= value <= maximum:
+        raise ValidationError({name: f"Dozwolony zakres: {minimum}-{maximum}."})
+    return value
+
+
+def calendar_window(params):
+    """
+    Okno kalendarza `(pierwszy dzień, ostatni dzień, strefa czasowa)` z parametrów zapytania.
+
+    Albo jawne `start` i `end` (daty włącznie, najwyżej `MAX_CALENDAR_DAYS`
+    dni), albo `span` (`day`, `week` od poniedziałku, `month`) wokół `date`
+    (domyślnie dziś). `tz` (np. `Europe/Warsaw`) wyznacza granice dni;
+    domyślnie strefa z ustawień.
+    """
+    tz = _parse_tz(params)
+
+    def day(name, default=None):
+        if not params.get(name):
+            return default
+        value = parse_date(params[name])
+        if value is None:
+            raise ValidationError({name: "Niepoprawna data, oczekiwano formatu RRRR-MM-DD."})
+        return value
+
+    if params.get('start') or params.get('end'):
+        start, end = day('start'), day('end')
+        if start is None or end is None:
+            raise ValidationError({'start': "Podaj oba parametry: start i end."})
+        if end < start:
+            raise ValidationError({'end': "Koniec okna nie może być przed początkiem."})
+        if (end - start).days + 1 > MAX_CALENDAR_DAYS:
+            raise ValidationError({'end': f"Okno kalendarza może mieć najwyżej {MAX_CALENDAR_DAYS} dni."})
+        return start, end, tz
+
+    anchor = day('date', timezone.localtime(timezone=tz).date())
+    span = params.get('span', 'week')
+    if span not in CALENDAR_SPANS:
+        raise ValidationError({'span': f"Dozwolone wartości: {', '.join(CALENDAR_SPANS)}."})
+    if span == 'day':
+        return anchor, anchor, tz
+    if span == 'week':
+        start = anchor - datetime.timedelta(days=anchor.weekday())
+        return start, start + datetime.timedelta(days=6), tz
+    start = anchor.replace(day=1)
+    next_month = (start + datetime.timedelta(days=32)).replace(day=1)
+    return start, next_month - datetime.timedelta(days=1), tz
+
+
+def availability_query(params):
+    """
+    Parametry wyszukiwania wolnych terminów z parametrów zapytania.
+
+    - `duration` - długość terminu w minutach (domyślnie 60, najwyżej 12 h),
+    - `start` - początek szukania (data lub ISO 8601, domyślnie teraz; nigdy wcześniej niż teraz),
+    - `days` - długość okna w dniach (domyślnie 14, najwyżej `MAX_CALENDAR_DAYS`),
+    - `mechanic` - tylko ten mechanik, `limit` - ile terminów zwrócić,
+    - `tz` - strefa godzin w odpowiedzi (domyślnie z ustawień).
+    """
+    now = timezone.now()
+    start = max(_parse_moment('start', params['start']), now) if params.get('start') else now
+    days = _parse_int(params, 'days', AVAILABILITY_DAYS, 1, MAX_CALENDAR_DAYS)
+    return {
+        'start': start,
+        'end': start + datetime.timedelta(days=days),
+        'duration': datetime.timedelta(minutes=_parse_int(params, 'duration', AVAILABILITY_DURATION, 1, 12 * 60)),
+        'mechanic': _parse_uuid('mechanic', params['mechanic']) if params.get('mechanic') else None,
+        'limit': _parse_int(params, 'limit', 10, 1, MAX_AVAILABILITY_LIMIT),
+        'tz': _parse_tz(params),
+    }
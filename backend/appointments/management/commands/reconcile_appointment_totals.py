@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from appointments.models import Appointment
+from appointments.rollups import reconcile_appointment_totals
+
+class Command(BaseCommand):
+    help = 'Porównuje koszty wizyt (parts_total, total_cost) z pełnym przeliczeniem z części'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workshop', type=str, help='ID warsztatu (domyślnie wszystkie wizyty)')
+        parser.add_argument('--fix', action='store_true', help='Nadpisuje koszty wizyt, które się nie zgadzają (poza zakończonymi)')
+        parser.add_argument('--include-completed', action='store_true',
+                            help='Z --fix nadpisuje także koszty wizyt zakończonych (już rozliczonych)')
+        parser.add_argument('--limit', type=int, default=20, help='Ile rozbieżności wypisać')
+
+    def handle(self, *args, **options):
+        appointments = Appointment.objects.all()
+        if options['workshop']:
+            appointments = appointments.filter(workshop__id=options['workshop'])
+
+        drift = reconcile_appointment_totals(appointments, fix=options['fix'], include_completed=options['include_completed'])
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Koszty wizyt są zgodne z częściami."))
+            return
+
+        for row in drift[:options['limit']]:
+            self.stdout.write(self.style.WARNING(
+                f"Wizyta {row['pk']} ({row['status']}): parts_total = {row['parts_total']}, oczekiwano {row['expected_parts_total']}; "
+                f"total_cost = {row['total_cost']}, oczekiwano {row['expected_total_cost']}"
+            ))
+        self.stdout.write(self.style.WARNING(f"Rozbieżności: {len(drift)} wizyt."))
+
+        if options['fix']:
+            fixed = sum(row['fixed'] for row in drift)
+            self.stdout.write(self.style.SUCCESS(f"Przeliczono {fixed} wizyt."))
+            if fixed < len(drift):
+                self.stdout.write(self.style.WARNING(
+                    f"Pominięto {len(drift) - fixed} wizyt zakończonych - przelicz je z --include-completed."
+                ))
+        else:
+            raise CommandError("Koszty wizyt są niespójne - uruchom z --fix.")
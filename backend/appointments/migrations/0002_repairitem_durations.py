@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repairitem',
+            name='actual_duration',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='repairitem',
+            name='estimated_duration',
+            field=models.DurationField(blank=True, null=True),
+        ),
+    ]
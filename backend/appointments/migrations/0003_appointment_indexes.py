@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0002_repairitem_durations'),
+        ('clients', '0001_initial'),
+        ('employees', '0001_initial'),
+        ('vehicles', '0001_initial'),
+        ('workshops', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['workshop', '-scheduled_time', 'id'], name='appt_workshop_sched_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['workshop', 'status', '-scheduled_time', 'id'], name='appt_workshop_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['client', 'status'], name='appt_client_status_idx'),
+        ),
+    ]
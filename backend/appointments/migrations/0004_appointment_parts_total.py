@@ -0,0 +1,35 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:49
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_parts_total(apps, schema_editor):
+    # Suma części istniejących wizyt jednym UPDATE-em; total_cost zostaje - rozbieżności
+    # pokaże i poprawi reconcile_appointment_totals
+    Appointment = apps.get_model('appointments', 'Appointment')
+    Part = apps.get_model('appointments', 'Part')
+    money = DecimalField(max_digits=12, decimal_places=2)
+    total = (
+        Part.objects.filter(appointment=OuterRef('pk')).order_by().values('appointment')
+        .annotate(total=Sum(F('cost_part') * F('quantity'), output_field=money)).values('total')
+    )
+    Appointment.objects.update(parts_total=Coalesce(Subquery(total), Value(Decimal('0')), output_field=money))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0003_appointment_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='parts_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(fill_parts_total, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:21
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Round
+
+
+def store_discounts(apps, schema_editor):
+    # Tylko rabat - koszty wizyt zostają bez zmian (także zakończonych i wpisanych ręcznie).
+    # Rabat wynika z zapisanego kosztu: total_cost = parts_total * (100 - rabat) / 100. Gdy kosztu
+    # nie da się tak wyjaśnić (brak części, koszt wyższy niż części), bierzemy bieżący rabat klienta.
+    # Pozostałe rozbieżności pokazuje reconcile_appointment_totals.
+    Appointment = apps.get_model('appointments', 'Appointment')
+    Client = apps.get_model('clients', 'Client')
+    money = DecimalField(max_digits=12, decimal_places=2)
+    rate = DecimalField(max_digits=5, decimal_places=2)
+    zero = Value(Decimal('0'), output_field=money)
+    hundred = Value(Decimal('100'), output_field=money)
+
+    client_discount = Coalesce(
+        Subquery(Client.objects.filter(pk=OuterRef('client_id')).values('discount')[:1]), zero, output_field=rate,
+    )
+    stored_discount = Round(
+        ExpressionWrapper(hundred - F('total_cost') * hundred / F('parts_total'), output_field=money), 2, output_field=rate,
+    )
+    Appointment.objects.update(discount=Case(
+        When(Q(parts_total__gt=0, total_cost__isnull=False, total_cost__gte=0, total_cost__lte=F('parts_total')), then=stored_discount),
+        default=client_discount,
+        output_field=rate,
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0004_appointment_parts_total'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=5),
+        ),
+        migrations.RunPython(store_discounts, migrations.RunPython.noop),
+    ]
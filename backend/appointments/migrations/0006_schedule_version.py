@@ -0,0 +1,22 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_appointment_discount'),
+        ('workshops', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleVersion',
+            fields=[
+                ('workshop', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='schedule_version', serialize=False, to='workshops.workshop')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
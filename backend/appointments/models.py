@@ -1,5 +1,5 @@
-from decimal import Decimal
 import uuid
+from decimal import ROUND_HALF_UP, Decimal
 from django.db import models
 from django.core.exceptions import ValidationError
 from employees.models import Employee
@@ -45,25 +45,61 @@ class Appointment(models.Model):
     recommendations = models.TextField(null=True, blank=True)
     estimated_duration = models.DurationField(null=True, blank=True)
     total_cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    # Suma części przed rabatem - utrzymywana różnicowo przez sygnały części (appointments.rollups),
+    # `total_cost` to ta suma po rabacie zapisanym w `discount`
+    parts_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Rabat klienta (%) z chwili utworzenia lub zakończenia wizyty - późniejsza zmiana segmentu
+    # klienta nie zmienia kosztu wizyt już rozliczonych
+    discount = models.DecimalField(max_digits=5, decimal_places=2, default=0)
 
     def __str__(self):
         return f"Appointment for {self.client} on {self.scheduled_time}"
 
-    def calculate_total_cost(self):
-        parts_cost = sum(part.total_cost for part in self.parts.all())
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Status zapisany w bazie - przy przejściu na "zakończona" rabat jest pobierany od klienta na nowo
+        if 'status' in field_names:
+            instance._saved_status = instance.status
+        return instance
 
-        total_cost = parts_cost
+    def save(self, *args, **kwargs):
+        completing = self.status == 'completed' and getattr(self, '_saved_status', None) != 'completed'
+        if self._state.adding:
+            self.discount = self.client.discount
+        elif completing and self.apply_client_discount() and kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'discount', 'total_cost'}
+        super().save(*args, **kwargs)
+        self._saved_status = self.status
+
+    def apply_client_discount(self):
+        """
+        Ustawia bieżący rabat klienta i przelicza `total_cost` z `parts_total`
+        (bez zapisu). Zwraca True, gdy rabat się zmienił.
+        """
+        discount = Client.objects.filter(pk=self.client_id).values_list('discount', flat=True).first() or Decimal('0')
+        if discount == self.discount:
+            return False
+        self.discount = discount
+        self.total_cost = (self.parts_total * (100 - discount) / 100).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        return True
 
-        # Apply client's discount
-        discount_rate = Decimal(self.client.discount) / Decimal(100)
-        discount_amount = total_cost * discount_rate
-        total_cost_after_discount = total_cost - discount_amount
+    def calculate_total_cost(self):
+        # Pełne przeliczenie jednej wizyty; na co dzień koszt aktualizują różnicowo sygnały części
+        from appointments.rollups import reconcile_appointment_totals
 
-        self.total_cost = total_cost_after_discount
-        self.save()
+        reconcile_appointment_totals(Appointment.objects.filter(pk=self.pk), fix=True, include_completed=True)
+        self.refresh_from_db(fields=['parts_total', 'total_cost', 'updated_at'])
 
     class Meta:
         ordering = ['-scheduled_time']
+        indexes = [
+            # Lista wizyt warsztatu w kolejności paginacji (-scheduled_time, id) i zakresy dat
+            models.Index(fields=['workshop', '-scheduled_time', 'id'], name='appt_workshop_sched_idx'),
+            models.Index(fields=['workshop', 'status', '-scheduled_time', 'id'], name='appt_workshop_status_idx'),
+            # Historia klienta po statusie (m.in. agregacje wizyt zakończonych w ai_module)
+            models.Index(fields=['client', 'status'], name='appt_client_status_idx'),
+        ]
 
 class RepairItem(models.Model):
     STATUS_CHOICES = [
@@ -92,7 +128,10 @@ class RepairItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     order = models.PositiveIntegerField(default=0)
-    
+    # Szacunek z lokalnego estymatora (ai_module.duration) i faktyczny czas wpisany przez mechanika
+    estimated_duration = models.DurationField(null=True, blank=True)
+    actual_duration = models.DurationField(null=True, blank=True)
+
 
     def __str__(self):
         return f"{self.description} ({self.get_status_display()}), assigned to {self.appointment.client}"
@@ -121,6 +160,14 @@ class Part(models.Model):
         if self.quantity < 1:
             raise ValidationError("Ilość musi być większa lub równa 1.")
         
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Koszt zapisany w bazie - różnica dla sumy części wizyty przy zmianie lub usunięciu
+        if {'appointment_id', 'cost_part', 'quantity'} <= set(field_names):
+            instance._saved_cost = (instance.appointment_id, instance.total_cost)
+        return instance
+
     def save(self, *args, **kwargs):
         # Convert name to title case before saving
         self.name = self.name.title()
@@ -132,3 +179,18 @@ class Part(models.Model):
 
     def __str__(self):
         return f"{self.name} x{self.quantity} ({self.cost_part} zł)"
+
+
+class ScheduleVersion(models.Model):
+    """
+    Licznik zmian grafiku warsztatu (appointments.scheduling) - wspólny dla
+    wszystkich procesów, podbijany UPDATE-em z F() po każdej zmianie wizyt,
+    przypisań mechaników i zmian w grafiku.
+    """
+    workshop = models.OneToOneField(
+        Workshop,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='schedule_version'
+    )
+    version = models.BigIntegerField(default=0)
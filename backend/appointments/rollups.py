@@ -0,0 +1,137 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+from ai_module.feature_store import apply_completed_total_change
+from appointments.models import Appointment, Part, RepairItem
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+ZERO = Value(Decimal('0'), output_field=MONEY)
+HUNDRED = Value(Decimal('100'), output_field=MONEY)
+CHUNK_SIZE = 2000
+
+
+def discounted_total(parts_total):
+    """Wyrażenie `total_cost` wizyty: suma części po rabacie zapisanym w wizycie, zaokrąglona do groszy."""
+    return Round(
+        ExpressionWrapper(parts_total * (HUNDRED - F('discount')) / HUNDRED, output_field=MONEY),
+        2, output_field=MONEY,
+    )
+
+
+def parts_total_subquery():
+    """Suma części wizyty (cena * ilość) liczona z tabeli części - źródło prawdy dla `parts_total`."""
+    parts = Part.objects.filter(appointment=OuterRef('pk')).order_by().values('appointment')
+    total = parts.annotate(total=Sum(F('cost_part') * F('quantity'), output_field=MONEY)).values('total')
+    return Coalesce(Subquery(total), ZERO, output_field=MONEY)
+
+
+def appointment_rollups(appointment_ids):
+    """Liczniki pozycji wizyt potrzebne do statusu - jedno zapytanie dla całej listy."""
+    items = RepairItem.objects.filter(appointment=OuterRef('pk')).order_by().values('appointment')
+    return Appointment.objects.filter(pk__in=appointment_ids).annotate(
+        items_count=Subquery(items.annotate(count=Count('pk')).values('count')),
+        open_items_count=Subquery(items.exclude(status='completed').annotate(count=Count('pk')).values('count')),
+    ).values('pk', 'status', 'items_count', 'open_items_count')
+
+
+def refresh_appointments(appointment_ids):
+    """
+    Przelicza status wizyt (wszystkie pozycje zakończone -> wizyta zakończona).
+    Każda zmieniona wizyta jest zapisywana raz, przez `save()`, więc jej
+    sygnały (historia serwisowa, cechy klienta, segment) działają jak dotąd.
+    Zwraca liczbę zapisanych wizyt.
+    """
+    completed = [
+        row['pk'] for row in appointment_rollups(appointment_ids)
+        if row['items_count'] and not row['open_items_count'] and row['status'] != 'completed'
+    ]
+    for appointment in Appointment.objects.filter(pk__in=completed).select_related('client', 'vehicle'):
+        appointment.status = 'completed'
+        appointment.save(update_fields=['status', 'updated_at'])
+    return len(completed)
+
+
+def part_cost_deltas(parts, deleted=False):
+    """
+    Zmiany sumy części `{appointment_id: delta}` po zapisie (lub usunięciu) części.
+
+    Poprzedni koszt pochodzi ze stanu wczytanego z bazy (`Part.from_db`);
+    nowe części go nie mają. Po wyliczeniu stan jest przesuwany na bieżący.
+    """
+    deltas = defaultdict(Decimal)
+    for part in parts:
+        current = (part.appointment_id, part.total_cost)
+        previous = getattr(part, '_saved_cost', current if deleted else None)
+        if previous is not None:
+            deltas[previous[0]] -= previous[1]
+        if not deleted:
+            deltas[current[0]] += current[1]
+        part._saved_cost = None if deleted else current
+    return deltas
+
+
+def apply_parts_deltas(deltas):
+    """
+    Dodaje zmiany sumy części do wizyt jednym UPDATE-em na wizytę, z rabatem
+    liczonym w bazie - bez wczytywania części, wizyty i bez `save()`. Magazyn
+    cech klientów dostaje tę samą różnicę kosztu (dla wizyt zakończonych).
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        for appointment_id, delta in deltas.items():
+            if not delta:
+                continue
+            appointments = Appointment.objects.filter(pk=appointment_id)
+            parts_total = F('parts_total') + Value(delta, output_field=MONEY)
+            apply_completed_total_change(appointments, discounted_total(parts_total))
+            # total_cost przed parts_total - MySQL liczy kolejne SET już z nowymi wartościami
+            appointments.update(total_cost=discounted_total(parts_total), parts_total=parts_total, updated_at=now)
+
+
+def appointment_total_drift(appointments=None):
+    """
+    Wizyty, których `parts_total` lub `total_cost` nie zgadza się z częściami -
+    jedno zapytanie. Brak kosztu (NULL) przy wizycie bez części nie jest rozbieżnością.
+    """
+    if appointments is None:
+        appointments = Appointment.objects.all()
+    return (
+        appointments
+        .order_by()
+        .annotate(expected_parts_total=parts_total_subquery())
+        .annotate(
+            expected_total_cost=discounted_total(F('expected_parts_total')),
+            stored_total_cost=Coalesce(F('total_cost'), ZERO, output_field=MONEY),
+        )
+        .filter(~Q(parts_total=F('expected_parts_total')) | ~Q(stored_total_cost=F('expected_total_cost')))
+        .values('pk', 'status', 'parts_total', 'expected_parts_total', 'total_cost', 'expected_total_cost')
+    )
+
+
+def reconcile_appointment_totals(appointments=None, fix=False, include_completed=False):
+    """
+    Porównuje utrzymywane różnicowo koszty wizyt z pełnym przeliczeniem z części.
+    Z `fix=True` nadpisuje rozbieżne wiersze (porcjami, UPDATE-em z podzapytaniem)
+    i koryguje magazyn cech klientów. Wizyty zakończone są już rozliczone, więc
+    są tylko raportowane, chyba że `include_completed=True` (zmiana ich części).
+    Zwraca listę rozbieżności; poprawione wiersze mają `fixed=True`.
+    """
+    drift = list(appointment_total_drift(appointments))
+    if fix:
+        for row in drift:
+            row['fixed'] = include_completed or row['status'] != 'completed'
+        ids = [row['pk'] for row in drift if row['fixed']]
+        now = timezone.now()
+        for start in range(0, len(ids), CHUNK_SIZE):
+            with transaction.atomic():
+                chunk = Appointment.objects.filter(pk__in=ids[start:start + CHUNK_SIZE])
+                apply_completed_total_change(chunk, discounted_total(parts_total_subquery()))
+                chunk.update(
+                    total_cost=discounted_total(parts_total_subquery()),
+                    parts_total=parts_total_subquery(),
+                    updated_at=now,
+                )
+    return drift
@@ -0,0 +1,512 @@
+import datetime
+import random
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from appointments.models import Appointment, ScheduleVersion
+from employees.models import Employee, ScheduleEntry
+
+# Czas wizyty bez `estimated_duration` (minuty)
+DEFAULT_DURATION = 60
+# Ile dni wstecz indeks trzyma wizyty i zmiany - starszej historii się nie planuje
+DEFAULT_HISTORY_DAYS = 7
+# Ile warsztatów proces trzyma w pamięci naraz (najdawniej używane są porzucane)
+DEFAULT_MAX_WORKSHOPS = 100
+
+# Bitmapy zajętości: doba UTC podzielona na sloty po 15 minut, bit 0 = 00:00-00:15
+SLOT = datetime.timedelta(minutes=15)
+SLOTS_PER_DAY = 96
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class _Node:
+    __slots__ = ('start', 'end', 'key', 'priority', 'left', 'right', 'max_end')
+
+    def __init__(self, start, end, key):
+        self.start = start
+        self.end = end
+        self.key = key
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.max_end = end
+
+    def update(self):
+        self.max_end = self.end
+        if self.left is not None and self.left.max_end > self.max_end:
+            self.max_end = self.left.max_end
+        if self.right is not None and self.right.max_end > self.max_end:
+            self.max_end = self.right.max_end
+
+
+def _split(node, pivot):
+    """Dzieli drzewo na węzły o kluczu `(start, key)` < `pivot` i pozostałe."""
+    if node is None:
+        return None, None
+    if (node.start, node.key) < pivot:
+        node.right, right = _split(node.right, pivot)
+        node.update()
+        return node, right
+    left, node.left = _split(node.left, pivot)
+    node.update()
+    return left, node
+
+
+def _merge(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        left.update()
+        return left
+    right.left = _merge(left, right.left)
+    right.update()
+    return right
+
+
+def _remove(node, pivot):
+    if node is None:
+        return None
+    current = (node.start, node.key)
+    if current == pivot:
+        return _merge(node.left, node.right)
+    if pivot < current:
+        node.left = _remove(node.left, pivot)
+    else:
+        node.right = _remove(node.right, pivot)
+    node.update()
+    return node
+
+
+class IntervalTree:
+    """
+    Przedziały półotwarte `[start, end)` z kluczem, np. wizyty jednego mechanika.
+
+    Drzewo (treap) uporządkowane po `(start, klucz)`, w każdym węźle maksymalny
+    koniec poddrzewa - dodanie i usunięcie w O(log n), a przedziały nakładające
+    się na zadany w O(log n + k): poddrzewa, które kończą się przed szukanym
+    początkiem albo zaczynają po jego końcu, są pomijane w całości.
+    """
+
+    def __init__(self):
+        self._root = None
+        self._intervals = {}
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def __contains__(self, key):
+        return key in self._intervals
+
+    def get(self, key):
+        return self._intervals.get(key)
+
+    def add(self, key, start, end):
+        self.discard(key)
+        left, right = _split(self._root, (start, key))
+        self._root = _merge(_merge(left, _Node(start, end, key)), right)
+        self._intervals[key] = (start, end)
+
+    def discard(self, key):
+        interval = self._intervals.pop(key, None)
+        if interval is not None:
+            self._root = _remove(self._root, (interval[0], key))
+
+    def overlapping(self, start, end):
+        """Przedziały `(klucz, start, end)` nakładające się na `[start, end)`, w kolejności początku."""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            if node.max_end <= start:
+                continue
+            if node.right is not None and node.start < end:
+                stack.append(node.right)
+            if node.start < end and node.end > start:
+                found.append((node.key, node.start, node.end))
+            if node.left is not None:
+                stack.append(node.left)
+        found.sort(key=lambda interval: (interval[1], interval[0]))
+        return found
+
+    def covers(self, start, end):
+        """Czy suma przedziałów pokrywa całe `[start, end)` (np. dwie zmiany jedna po drugiej)."""
+        reached = start
+        for _, interval_start, interval_end in self.overlapping(start, end):
+            if interval_start > reached:
+                return False
+            reached = max(reached, interval_end)
+            if reached >= end:
+                return True
+        return reached >= end
+
+
+def slot_index(moment, ceil=False):
+    """Numer slotu od początku epoki zawierającego `moment` (z `ceil` - pierwszego zaczynającego się nie wcześniej)."""
+    index, rest = divmod(moment - EPOCH, SLOT)
+    return index + 1 if ceil and rest else index
+
+
+def _bits(first, last):
+    """Ustawione bity `[first, last)`."""
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
+def run_starts(bits, length):
+    """
+    Bity, od których zaczyna się `length` kolejnych ustawionych bitów.
+    Zamiast przesuwać o 1 `length` razy, podwaja sprawdzony odcinek - log2(length)
+    operacji na całej masce naraz.
+    """
+    span = 1
+    while span < length:
+        step = min(span, length - span)
+        bits &= bits >> step
+        span += step
+    return bits
+
+
+def appointment_interval(scheduled_time, estimated_duration):
+    duration = estimated_duration or datetime.timedelta(minutes=getattr(settings, 'SCHEDULING_DEFAULT_DURATION', DEFAULT_DURATION))
+    return scheduled_time, scheduled_time + duration
+
+
+class WorkshopSchedule:
+    """Indeks jednego warsztatu: zmiany i zarezerwowane wizyty, osobne drzewo na mechanika."""
+
+    def __init__(self, workshop_id, version, horizon=None):
+        self.workshop_id = workshop_id
+        self.version = version
+        # Początek okresu trzymanego w indeksie - starsze wpisy usuwa `prune`
+        self.horizon = horizon
+        self.employees = set()
+        self.shifts = {}
+        self.bookings = {}
+        # id wizyty -> (start, end, mechanicy)
+        self.appointments = {}
+        # (mechanik, dzień) -> (bitmapa zmian, bitmapa wizyt); liczone przy pierwszym użyciu,
+        # usuwane przy każdej zmianie dotykającej tego dnia
+        self.days = {}
+
+    def _touch(self, employee_id, start, end):
+        for day in range(slot_index(start) // SLOTS_PER_DAY, (slot_index(end, ceil=True) - 1) // SLOTS_PER_DAY + 1):
+            self.days.pop((employee_id, day), None)
+
+    def _tree(self, trees, employee_id):
+        tree = trees.get(employee_id)
+        if tree is None:
+            tree = trees[employee_id] = IntervalTree()
+        return tree
+
+    def set_shift(self, entry_id, employee_id, start, end):
+        self.remove_shift(entry_id)
+        self.employees.add(employee_id)
+        self._tree(self.shifts, employee_id).add(entry_id, start, end)
+        self._touch(employee_id, start, end)
+
+    def remove_shift(self, entry_id):
+        for employee_id, tree in self.shifts.items():
+            if entry_id in tree:
+                self._touch(employee_id, *tree.get(entry_id))
+                tree.discard(entry_id)
+                return
+
+    def set_appointment(self, appointment_id, start, end, mechanics):
+        self.remove_appointment(appointment_id)
+        self.appointments[appointment_id] = (start, end, set(mechanics))
+        for employee_id in mechanics:
+            self._tree(self.bookings, employee_id).add(appointment_id, start, end)
+            self._touch(employee_id, start, end)
+
+    def assign(self, appointment_id, employee_id):
+        if appointment_id not in self.appointments:
+            # Wizyta spoza indeksu (anulowana albo sprzed horyzontu)
+            return
+        start, end, mechanics = self.appointments[appointment_id]
+        mechanics.add(employee_id)
+        self._tree(self.bookings, employee_id).add(appointment_id, start, end)
+        self._touch(employee_id, start, end)
+
+    def unassign(self, appointment_id, employee_id):
+        if appointment_id in self.appointments and employee_id in self.appointments[appointment_id][2]:
+            start, end, mechanics = self.appointments[appointment_id]
+            mechanics.discard(employee_id)
+            self.bookings[employee_id].discard(appointment_id)
+            self._touch(employee_id, start, end)
+
+    def remove_appointment(self, appointment_id):
+        start, end, mechanics = self.appointments.pop(appointment_id, (None, None, ()))
+        for employee_id in mechanics:
+            self.bookings[employee_id].discard(appointment_id)
+            self._touch(employee_id, start, end)
+
+    def prune(self, horizon):
+        """Usuwa zmiany, wizyty i bitmapy dni kończące się przed `horizon` - indeks nie rośnie z czasem."""
+        for tree in self.shifts.values():
+            for entry_id, _, end in tree.overlapping(EPOCH, horizon):
+                if end <= horizon:
+                    tree.discard(entry_id)
+        for appointment_id, (_, end, _) in list(self.appointments.items()):
+            if end <= horizon:
+                self.remove_appointment(appointment_id)
+        first_day = slot_index(horizon) // SLOTS_PER_DAY
+        for key in [key for key in self.days if key[1] < first_day]:
+            del self.days[key]
+        self.horizon = horizon
+
+    def day_bitmaps(self, employee_id, day):
+        """
+        Bitmapy doby `day` (dni od epoki, UTC) mechanika: sloty w całości na
+        zmianie i sloty choć częściowo zajęte przez wizyty.
+        """
+        key = (employee_id, day)
+        if key not in self.days:
+            first = day * SLOTS_PER_DAY
+            start = EPOCH + first * SLOT
+            end = start + SLOTS_PER_DAY * SLOT
+            shifts = busy = 0
+            tree = self.shifts.get(employee_id)
+            for _, shift_start, shift_end in tree.overlapping(start, end) if tree else ():
+                shifts |= _bits(
+                    max(slot_index(shift_start, ceil=True), first) - first,
+                    min(slot_index(shift_end), first + SLOTS_PER_DAY) - first,
+                )
+            tree = self.bookings.get(employee_id)
+            for _, booked_start, booked_end in tree.overlapping(start, end) if tree else ():
+                busy |= _bits(
+                    max(slot_index(booked_start), first) - first,
+                    min(slot_index(booked_end, ceil=True), first + SLOTS_PER_DAY) - first,
+                )
+            self.days[key] = (shifts, busy)
+        return self.days[key]
+
+    def free_bits(self, employee_id, first_slot, last_slot):
+        """Wolne sloty mechanika `[first_slot, last_slot)` jako jedna liczba - bit 0 to `first_slot`."""
+        first_day, last_day = first_slot // SLOTS_PER_DAY, (last_slot - 1) // SLOTS_PER_DAY
+        shifts = busy = 0
+        for offset, day in enumerate(range(first_day, last_day + 1)):
+            day_shifts, day_busy = self.day_bitmaps(employee_id, day)
+            shifts |= day_shifts << (offset * SLOTS_PER_DAY)
+            busy |= day_busy << (offset * SLOTS_PER_DAY)
+        return ((shifts & ~busy) >> (first_slot - first_day * SLOTS_PER_DAY)) & _bits(0, last_slot - first_slot)
+
+    def free_slots(self, start, end, duration, mechanics=None, limit=10):
+        """
+        Najwcześniejsze wolne terminy `(start, mechanik)` długości `duration`
+        w oknie `[start, end)`, najwyżej `limit`. Terminy jednego mechanika się
+        nie nakładają. Brani są tylko mechanicy, którzy mają zmiany w grafiku.
+        """
+        first, last = slot_index(start, ceil=True), slot_index(end)
+        length = max(slot_index(EPOCH + duration, ceil=True), 1)
+        if last - first < length:
+            return []
+
+        found = []
+        for employee_id in self.employees if mechanics is None else mechanics:
+            if not self.shifts.get(employee_id):
+                continue
+            starts = run_starts(self.free_bits(employee_id, first, last), length)
+            for _ in range(limit):
+                if not starts:
+                    break
+                index = (starts & -starts).bit_length() - 1
+                found.append((EPOCH + (first + index) * SLOT, employee_id))
+                starts &= ~_bits(0, index + length)
+        found.sort(key=lambda slot: (slot[0], str(slot[1])))
+        return found[:limit]
+
+    def conflicts(self, start, end, mechanics, exclude=None):
+        """
+        Konflikty przedziału `[start, end)` dla mechaników:
+        - `booking` - mechanik ma w tym czasie inną wizytę,
+        - `shift` - przedział wychodzi poza zmiany mechanika (sprawdzane tylko
+          u mechaników, którzy mają jakiekolwiek zmiany w grafiku).
+        """
+        found = []
+        for employee_id in mechanics:
+            tree = self.bookings.get(employee_id)
+            for appointment_id, booked_start, booked_end in tree.overlapping(start, end) if tree else ():
+                if appointment_id != exclude:
+                    found.append({
+                        'type': 'booking', 'mechanic': employee_id, 'appointment': appointment_id,
+                        'start': booked_start, 'end': booked_end,
+                    })
+            shifts = self.shifts.get(employee_id)
+            if shifts and not shifts.covers(start, end):
+                found.append({'type': 'shift', 'mechanic': employee_id, 'appointment': None, 'start': start, 'end': end})
+        return found
+
+
+class ScheduleIndex:
+    """
+    Indeksy grafików warsztatów w pamięci procesu.
+
+    Warsztat jest wczytywany przy pierwszym sprawdzeniu (kilka zapytań), a
+    potem aktualizowany przyrostowo z sygnałów, po commicie. Każda zmiana
+    podbija wersję warsztatu w bazie (`ScheduleVersion`) - proces, którego
+    wersja się nie zgadza (zmiana w innym procesie), wczytuje warsztat od nowa.
+    Proces trzyma najwyżej `SCHEDULING_MAX_WORKSHOPS` warsztatów, a wpisy
+    sprzed `SCHEDULING_HISTORY_DAYS` są z nich usuwane raz na dobę.
+    """
+
+    def __init__(self):
+        self._schedules = OrderedDict()
+        self._lock = threading.RLock()
+
+    def clear(self):
+        with self._lock:
+            self._schedules.clear()
+
+    @staticmethod
+    def version(workshop_id):
+        return ScheduleVersion.objects.filter(workshop_id=workshop_id).values_list('version', flat=True).first() or 0
+
+    @staticmethod
+    def horizon():
+        # Dzień zapasu na wizyty zaczęte przed granicą historii
+        days = getattr(settings, 'SCHEDULING_HISTORY_DAYS', DEFAULT_HISTORY_DAYS) + 1
+        return timezone.now() - datetime.timedelta(days=days)
+
+    def get(self, workshop_id):
+        version = self.version(workshop_id)
+        with self._lock:
+            schedule = self._schedules.get(workshop_id)
+            if schedule is None or schedule.version != version:
+                schedule = self._schedules[workshop_id] = self._build(workshop_id, version)
+                limit = getattr(settings, 'SCHEDULING_MAX_WORKSHOPS', DEFAULT_MAX_WORKSHOPS)
+                while len(self._schedules) > limit:
+                    self._schedules.popitem(last=False)
+            else:
+                horizon = self.horizon()
+                if horizon - schedule.horizon >= datetime.timedelta(days=1):
+                    schedule.prune(horizon)
+            self._schedules.move_to_end(workshop_id)
+            return schedule
+
+    def _build(self, workshop_id, version):
+        horizon = self.horizon()
+        schedule = WorkshopSchedule(workshop_id, version, horizon)
+        schedule.employees.update(Employee.objects.filter(workshop_id=workshop_id).values_list('pk', flat=True))
+
+        for entry_id, employee_id, start, end in ScheduleEntry.objects.filter(
+            employee__workshop_id=workshop_id, end_time__gt=horizon,
+        ).values_list('pk', 'employee_id', 'start_time', 'end_time'):
+            schedule.set_shift(entry_id, employee_id, start, end)
+
+        appointments = Appointment.objects.filter(
+            workshop_id=workshop_id, scheduled_time__gte=horizon,
+        ).exclude(status='canceled')
+        mechanics = {}
+        for appointment_id, employee_id in Appointment.assigned_mechanics.through.objects.filter(
+            appointment__in=appointments,
+        ).values_list('appointment_id', 'employee_id'):
+            mechanics.setdefault(appointment_id, set()).add(employee_id)
+        for appointment_id, scheduled_time, duration in appointments.values_list('pk', 'scheduled_time', 'estimated_duration'):
+            schedule.set_appointment(appointment_id, *appointment_interval(scheduled_time, duration), mechanics.get(appointment_id, ()))
+        return schedule
+
+    def _bump(self, workshop_id):
+        versions = ScheduleVersion.objects.filter(workshop_id=workshop_id)
+        if not versions.update(version=F('version') + 1):
+            try:
+                with transaction.atomic():
+                    ScheduleVersion.objects.create(workshop_id=workshop_id, version=1)
+                return 1
+            except IntegrityError:
+                # Wiersz założył w tym czasie inny proces
+                versions.update(version=F('version') + 1)
+        # Odczyt po UPDATE może już widzieć zmianę innego procesu - wtedy indeks jest porzucany
+        return versions.values_list('version', flat=True).get()
+
+    def change(self, workshop_id, apply):
+        """
+        Wykonuje `apply(schedule)` na wczytanym indeksie warsztatu i podbija jego wersję.
+        Indeks, który przegapił zmianę z innego procesu, jest porzucany (wczyta się przy potrzebie).
+        """
+        with self._lock:
+            schedule = self._schedules.get(workshop_id)
+            version = self._bump(workshop_id)
+            if schedule is None:
+                return
+            if version != schedule.version + 1:
+                del self._schedules[workshop_id]
+                return
+            apply(schedule)
+            schedule.version = version
+
+    def change_on_commit(self, workshop_id, apply):
+        transaction.on_commit(lambda: self.change(workshop_id, apply))
+
+    def workshop_of(self, employee_id):
+        with self._lock:
+            for schedule in self._schedules.values():
+                if employee_id in schedule.employees:
+                    return schedule.workshop_id
+        return Employee.objects.filter(pk=employee_id).values_list('workshop_id', flat=True).first()
+
+    def appointment_mechanics(self, appointment):
+        """Mechanicy zapisanej wizyty - z indeksu, a gdy go tam nie ma, z bazy."""
+        schedule = self.get(appointment.workshop_id)
+        if appointment.pk in schedule.appointments:
+            return schedule.appointments[appointment.pk][2]
+        return set(appointment.assigned_mechanics.values_list('pk', flat=True))
+
+    def check(self, workshop_id, scheduled_time, estimated_duration, mechanics, exclude=None):
+        """Konflikty wizyty (patrz `WorkshopSchedule.conflicts`) dla podanych mechaników."""
+        if not mechanics or scheduled_time is None:
+            return []
+        start, end = appointment_interval(scheduled_time, estimated_duration)
+        schedule = self.get(workshop_id)
+        with self._lock:
+            return schedule.conflicts(start, end, mechanics, exclude=exclude)
+
+    def free_slots(self, workshop_id, start, end, duration, mechanics=None, limit=10):
+        """
+        Wolne terminy w warsztacie (patrz `WorkshopSchedule.free_slots`), potwierdzone
+        jednym zapytaniem o wizyty. Wizyta zapisana w innym procesie przed podbiciem
+        wersji wymusza wczytanie warsztatu od nowa; co nadal zajęte, jest pomijane.
+        """
+        schedule = self.get(workshop_id)
+        with self._lock:
+            slots = schedule.free_slots(start, end, duration, mechanics=mechanics, limit=limit)
+        booked = self._booked(workshop_id, slots, duration)
+        if booked:
+            with self._lock:
+                self._schedules.pop(workshop_id, None)
+            schedule = self.get(workshop_id)
+            with self._lock:
+                slots = schedule.free_slots(start, end, duration, mechanics=mechanics, limit=limit)
+            booked = self._booked(workshop_id, slots, duration)
+        return [slot for slot in slots if slot not in booked]
+
+    def _booked(self, workshop_id, slots, duration):
+        """Terminy `(start, mechanik)` z listy, które w bazie nakładają się na wizytę mechanika."""
+        if not slots:
+            return set()
+        first = min(slot_start for slot_start, _ in slots)
+        last = max(slot_start for slot_start, _ in slots) + duration
+        bookings = Appointment.assigned_mechanics.through.objects.filter(
+            employee_id__in={mechanic for _, mechanic in slots},
+            appointment__workshop_id=workshop_id,
+            # Wizyty zaczęte do doby przed pierwszym terminem - dłuższych się nie planuje
+            appointment__scheduled_time__gte=first - datetime.timedelta(days=1),
+            appointment__scheduled_time__lt=last,
+        ).exclude(appointment__status='canceled').values_list(
+            'employee_id', 'appointment__scheduled_time', 'appointment__estimated_duration',
+        )
+        intervals = {}
+        for employee_id, scheduled_time, estimated_duration in bookings:
+            intervals.setdefault(employee_id, []).append(appointment_interval(scheduled_time, estimated_duration))
+        return {
+            (slot_start, mechanic) for slot_start, mechanic in slots
+            if any(booked_start < slot_start + duration and booked_end > slot_start
+                   for booked_start, booked_end in intervals.get(mechanic, ()))
+        }
+
+
+schedules = ScheduleIndex()
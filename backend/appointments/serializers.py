@@ -1,16 +1,44 @@
+import uuid
+from django.conf import settings
 from rest_framework import serializers
 from appointments.models import Appointment, Part, RepairItem
+from appointments.scheduling import schedules
 from employees.models import Employee
-from employees.serializers import EmployeeSerializer
 from clients.models import Client
 from vehicles.models import Vehicle
 from clients.serializers import ClientSerializer
 from vehicles.serializers import VehicleSerializer
 
+class PrefetchedRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Jak PrimaryKeyRelatedField, ale przy operacjach zbiorczych bierze obiekty
+    z kontekstu (`context[context_key]`, słownik id -> obiekt, wczytany jednym
+    zapytaniem dla całej listy) zamiast pytać bazę o każdą pozycję.
+    """
+
+    def __init__(self, context_key, **kwargs):
+        self.context_key = context_key
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        objects = self.context.get(self.context_key)
+        if objects is None:
+            return super().to_internal_value(data)
+        try:
+            return objects[uuid.UUID(str(data))]
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+
 class RepairItemSerializer(serializers.ModelSerializer):
-    completed_by = EmployeeSerializer(read_only=True)
-    completed_by_id = serializers.PrimaryKeyRelatedField(
-        queryset=Employee.objects.all(),
+    # Płaska reprezentacja pracownika - pełny EmployeeSerializer zagnieżdżał grafik i użytkownika w każdej pozycji
+    completed_by = serializers.PrimaryKeyRelatedField(read_only=True)
+    completed_by_name = serializers.CharField(source='completed_by.user.get_full_name', read_only=True, default=None)
+    completed_by_id = PrefetchedRelatedField(
+        context_key='employees',
+        queryset=Employee.objects.select_related('user'),
         write_only=True,
         source='completed_by',
         allow_null=True,
@@ -22,8 +50,9 @@ class RepairItemSerializer(serializers.ModelSerializer):
         model = RepairItem
         fields = (
             'id', 'appointment', 'description', 'is_completed',
-            'completed_by', 'completed_by_id', 'status',
-            'created_at', 'updated_at', 'order'
+            'completed_by', 'completed_by_id', 'completed_by_name', 'status',
+            'created_at', 'updated_at', 'order',
+            'estimated_duration', 'actual_duration'
         )
         read_only_fields = ('id', 'appointment', 'estimated_duration', 'created_at', 'updated_at')
 
@@ -31,7 +60,7 @@ class RepairItemSerializer(serializers.ModelSerializer):
         appointment = self.context['appointment']
         completed_by = attrs.get('completed_by')
 
-        if completed_by and completed_by.workshop != appointment.workshop:
+        if completed_by and completed_by.workshop_id != appointment.workshop_id:
             raise serializers.ValidationError("Pracownik nie należy do tego warsztatu.")
 
         return attrs
@@ -63,20 +92,29 @@ class PartSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class BulkPartSerializer(PartSerializer):
+    """Część w operacji zbiorczej - wizyta pochodzi z adresu, nie z każdej pozycji."""
+    appointment = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
 class AppointmentSerializer(serializers.ModelSerializer):
     client = ClientSerializer(read_only=True)
     vehicle = VehicleSerializer(read_only=True)
     repair_items = RepairItemSerializer(many=True, read_only=True)  # Dodanie pola do zagnieżdżenia RepairItem
     parts = PartSerializer(many=True, read_only=True)  # Dodanie pola do zagnieżdżenia Part
 
-    client_id = serializers.PrimaryKeyRelatedField(queryset=Client.objects.all(), write_only=True, source='client')
-    vehicle_id = serializers.PrimaryKeyRelatedField(queryset=Vehicle.objects.all(), write_only=True, source='vehicle')
+    client_id = PrefetchedRelatedField(context_key='clients', queryset=Client.objects.all(), write_only=True, source='client')
+    vehicle_id = PrefetchedRelatedField(context_key='vehicles', queryset=Vehicle.objects.all(), write_only=True, source='vehicle')
+    assigned_mechanics = PrefetchedRelatedField(context_key='employees', queryset=Employee.objects.all(), many=True, required=False)
 
     class Meta:
         model = Appointment
         fields = '__all__'
         
-        read_only_fields = ('id', 'workshop', 'client', 'vehicle', 'created_at', 'updated_at')
+        # Koszt wynika z części i rabatu (appointments.rollups) - wpisany ręcznie i tak nadpisałaby go pierwsza zmiana części
+        read_only_fields = (
+            'id', 'workshop', 'client', 'vehicle', 'created_at', 'updated_at', 'parts_total', 'discount', 'total_cost',
+        )
 
     def validate(self, data):
         client = data.get('client')
@@ -88,6 +126,49 @@ class AppointmentSerializer(serializers.ModelSerializer):
         # if client.workshop != workshop:
         #     raise serializers.ValidationError("Klient nie jest powiązany z tym warsztatem.")
 
+        self.check_schedule(data)
+        return data
+
+    SCHEDULE_FIELDS = ('scheduled_time', 'estimated_duration', 'assigned_mechanics', 'status')
+
+    def check_schedule(self, data):
+        """
+        Sprawdza wizytę w indeksie grafików warsztatu (appointments.scheduling):
+        nakładające się wizyty mechaników i wyjście poza ich zmiany. Domyślnie
+        konflikty są tylko zwracane w odpowiedzi (`schedule_conflicts`), przy
+        `SCHEDULING_CONFLICTS = 'reject'` zapis jest odrzucany.
+        """
+        workshop = self.context.get('workshop')
+        instance = self.instance
+        if workshop is None or (instance is not None and not any(field in data for field in self.SCHEDULE_FIELDS)):
+            return
+        if data.get('status', getattr(instance, 'status', None)) == 'canceled':
+            return
+
+        if 'assigned_mechanics' in data:
+            mechanics = {employee.pk for employee in data['assigned_mechanics']}
+        else:
+            mechanics = schedules.appointment_mechanics(instance) if instance is not None else set()
+        conflicts = schedules.check(
+            workshop.pk,
+            data.get('scheduled_time', getattr(instance, 'scheduled_time', None)),
+            data.get('estimated_duration', getattr(instance, 'estimated_duration', None)),
+            mechanics,
+            exclude=getattr(instance, 'pk', None),
+        )
+        if conflicts and getattr(settings, 'SCHEDULING_CONFLICTS', 'flag') == 'reject':
+            raise serializers.ValidationError({'schedule_conflicts': [
+                f"Mechanik {conflict['mechanic']} ma w tym czasie wizytę {conflict['appointment']}."
+                if conflict['type'] == 'booking' else
+                f"Wizyta wychodzi poza grafik mechanika {conflict['mechanic']}."
+                for conflict in conflicts
+            ]})
+        self.schedule_conflicts = conflicts
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if hasattr(self, 'schedule_conflicts'):
+            data['schedule_conflicts'] = self.schedule_conflicts
         return data
 
     def update(self, instance, validated_data):
@@ -103,4 +184,35 @@ class AppointmentSerializer(serializers.ModelSerializer):
     def validate_mileage(self, value):
         if self.instance and self.instance.vehicle and value < self.instance.vehicle.mileage:
             raise serializers.ValidationError("Mileage cannot be less than the current vehicle mileage.")
-        return value
\ No newline at end of file
+        return value
+
+
+class BatchAppointmentSerializer(AppointmentSerializer):
+    """Wizyta z importu zbiorczego - klient, pojazd i mechanicy z kontekstu, pojazd musi należeć do klienta."""
+
+    def validate(self, data):
+        data = super().validate(data)
+        if data['vehicle'].client_id != data['client'].pk:
+            raise serializers.ValidationError({'vehicle_id': "Pojazd nie należy do tego klienta."})
+        return data
+
+
+class CalendarAppointmentSerializer(serializers.Serializer):
+    """Lekkie podsumowanie wizyty do kalendarza - czyta słowniki z `values()`, bez zagnieżdżeń."""
+    id = serializers.UUIDField()
+    scheduled_time = serializers.DateTimeField()
+    status = serializers.CharField()
+    client_name = serializers.SerializerMethodField()
+    license_plate = serializers.CharField(source='vehicle__license_plate')
+    vehicle = serializers.SerializerMethodField()
+    duration_minutes = serializers.SerializerMethodField()
+
+    def get_client_name(self, obj):
+        return ' '.join(filter(None, [obj['client__first_name'], obj['client__last_name']]))
+
+    def get_vehicle(self, obj):
+        return f"{obj['vehicle__make']} {obj['vehicle__model']}"
+
+    def get_duration_minutes(self, obj):
+        duration = obj['estimated_duration']
+        return int(duration.total_seconds() // 60) if duration is not None else None
@@ -1,11 +1,13 @@
 from datetime import timedelta
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import m2m_changed, post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
-from appointments.models import Appointment, RepairItem
-from ai_module.ml_model import predict_segment
+from appointments.models import Appointment, Part, RepairItem
+from appointments.scheduling import appointment_interval, schedules
+from appointments.rollups import apply_parts_deltas, part_cost_deltas, reconcile_appointment_totals, refresh_appointments
+from ai_module.segment_queue import segment_queue
+from employees.models import ScheduleEntry
 from service_records.models import ServiceRecord
-from ai_module.utils import SEGMENT_DISCOUNTS
 
 @receiver(post_save, sender=Appointment)
 def create_service_record(sender, instance, created, **kwargs):
@@ -30,19 +32,35 @@ def create_service_record(sender, instance, created, **kwargs):
             instance.vehicle.save()
 
                 
-@receiver(post_save, sender=RepairItem)
-def update_appointment_status(sender, instance, **kwargs):
-    appointment = instance.appointment
-    repair_items = appointment.repair_items.all()
-    if repair_items.exists() and all(item.status == 'completed' for item in repair_items):
-        appointment.status = 'completed'
-        appointment.save()
-        
+def _deleted_directly(origin, model):
+    # Pozycje usuwane kaskadowo razem z wizytą (klientem, warsztatem) nie zmieniają już niczego
+    return isinstance(origin, model) or getattr(origin, 'model', None) is model
+
+
 @receiver([post_save, post_delete], sender=RepairItem)
-def update_appointment_total_cost(sender, instance, **kwargs):
-    appointment = instance.appointment
-    appointment.calculate_total_cost()
-    
+def update_appointment_status(sender, instance, origin=None, **kwargs):
+    # Status wizyty z jednego zapytania agregującego; wizyta zapisywana tylko przy zmianie.
+    # Operacje zbiorcze (bulk_create/bulk_update) wołają refresh_appointments same, raz na wizytę.
+    if kwargs['signal'] is post_delete and not _deleted_directly(origin, RepairItem):
+        return
+    refresh_appointments([instance.appointment_id])
+
+
+@receiver(post_save, sender=Part)
+def add_part_to_total_cost(sender, instance, created, **kwargs):
+    if not created and not hasattr(instance, '_saved_cost'):
+        # Część zapisana bez wczytania z bazy - poprzedni koszt nieznany, wizyta liczona od nowa
+        reconcile_appointment_totals(Appointment.objects.filter(pk=instance.appointment_id), fix=True, include_completed=True)
+        instance._saved_cost = (instance.appointment_id, instance.total_cost)
+        return
+    apply_parts_deltas(part_cost_deltas([instance]))
+
+
+@receiver(post_delete, sender=Part)
+def remove_part_from_total_cost(sender, instance, origin=None, **kwargs):
+    if _deleted_directly(origin, Part):
+        apply_parts_deltas(part_cost_deltas([instance], deleted=True))
+
 # @receiver(post_save, sender=RepairItem)
 # def update_total_time(sender, instance, **kwargs):
 #     appointment = instance.appointment
@@ -53,13 +71,77 @@ def update_appointment_total_cost(sender, instance, **kwargs):
 
 @receiver(post_save, sender=Appointment)
 def update_client_segment(sender, instance, **kwargs):
+    # Segment przeliczany jest po commicie, w tle i zbiorczo dla wielu klientów
     if instance.status == 'completed':
-        client = instance.client
-        previous_segment = client.segment
-        predicted_segment = predict_segment(client)
-        client.segment = predicted_segment
-        client.discount = SEGMENT_DISCOUNTS.get(predicted_segment, 0.00)
-        client.save()
-        
-        if predicted_segment != previous_segment:
-            print(f"Segment klienta {client} zmieniony z {previous_segment} na {predicted_segment}")
+        segment_queue.enqueue_on_commit(instance.client_id)
+
+
+# Indeks grafików warsztatów (appointments.scheduling) - zmiany nakładane przyrostowo po commicie
+@receiver(post_save, sender=Appointment)
+def index_appointment(sender, instance, created, **kwargs):
+    appointment_id = instance.pk
+    canceled = instance.status == 'canceled'
+    start, end = appointment_interval(instance.scheduled_time, instance.estimated_duration)
+
+    def apply(schedule):
+        if canceled:
+            schedule.remove_appointment(appointment_id)
+            return
+        if appointment_id in schedule.appointments:
+            mechanics = schedule.appointments[appointment_id][2]
+        elif created:
+            # Mechanicy dochodzą później, sygnałem m2m_changed
+            mechanics = set()
+        else:
+            mechanics = set(instance.assigned_mechanics.values_list('pk', flat=True))
+        schedule.set_appointment(appointment_id, start, end, mechanics)
+
+    schedules.change_on_commit(instance.workshop_id, apply)
+
+
+@receiver(post_delete, sender=Appointment)
+def unindex_appointment(sender, instance, **kwargs):
+    appointment_id = instance.pk
+    schedules.change_on_commit(instance.workshop_id, lambda schedule: schedule.remove_appointment(appointment_id))
+
+
+@receiver(m2m_changed, sender=Appointment.assigned_mechanics.through)
+def index_assigned_mechanics(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    owner_id = instance.pk
+    pk_set = set(pk_set or ())
+
+    def apply(schedule):
+        if reverse:
+            # instance to pracownik, pk_set - wizyty
+            appointments = pk_set if action != 'post_clear' else list(schedule.appointments)
+            pairs = [(appointment_id, owner_id) for appointment_id in appointments]
+        elif action == 'post_clear':
+            pairs = [(owner_id, employee_id) for employee_id in list(schedule.appointments.get(owner_id, (0, 0, ()))[2])]
+        else:
+            pairs = [(owner_id, employee_id) for employee_id in pk_set]
+        for appointment_id, employee_id in pairs:
+            if action == 'post_add':
+                schedule.assign(appointment_id, employee_id)
+            else:
+                schedule.unassign(appointment_id, employee_id)
+
+    if instance.workshop_id is not None:
+        schedules.change_on_commit(instance.workshop_id, apply)
+
+
+@receiver(post_save, sender=ScheduleEntry)
+def index_schedule_entry(sender, instance, **kwargs):
+    entry = (instance.pk, instance.employee_id, instance.start_time, instance.end_time)
+    workshop_id = schedules.workshop_of(instance.employee_id)
+    if workshop_id is not None:
+        schedules.change_on_commit(workshop_id, lambda schedule: schedule.set_shift(*entry))
+
+
+@receiver(post_delete, sender=ScheduleEntry)
+def unindex_schedule_entry(sender, instance, **kwargs):
+    entry_id = instance.pk
+    workshop_id = schedules.workshop_of(instance.employee_id)
+    if workshop_id is not None:
+        schedules.change_on_commit(workshop_id, lambda schedule: schedule.remove_shift(entry_id))
@@ -1,3 +1,607 @@
-from django.test import TestCase
+import datetime
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from accounts.models import Role, User
+from ai_module.models import ClientFeatures
+from appointments.models import Appointment, Part, RepairItem
+from appointments.rollups import appointment_total_drift
+from appointments.scheduling import IntervalTree, ScheduleIndex, WorkshopSchedule, run_starts, schedules
+from clients.models import Client
+from employees.models import Employee, ScheduleEntry
+from vehicles.models import Vehicle
+from workshops.models import Workshop
 
-# Create your tests here.
+
+class AppointmentQueryCountTests(TestCase):
+    """Lista i szczegóły wizyt wykonują stałą liczbę zapytań, niezależnie od liczby wizyt."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='owner@example.com', password='test', first_name='Jan', last_name='Kowalski')
+        cls.workshop = Workshop.objects.create(name='Warsztat', owner=cls.user)
+        cls.mechanics = [
+            Employee.objects.create(
+                user=User.objects.create_user(email=f'mechanik{i}@example.com', password='test', first_name='Mechanik', last_name=str(i)),
+                workshop=cls.workshop, position='Mechanik', hire_date=timezone.now().date(), status='APPROVED',
+            )
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def create_appointments(self, count):
+        # bulk_create pomija sygnały (koszty, segmenty) - test dotyczy tylko odczytu
+        clients = Client.objects.bulk_create([
+            Client(workshop=self.workshop, first_name='Klient', last_name=str(i), phone=str(i)) for i in range(count)
+        ])
+        vehicles = Vehicle.objects.bulk_create([
+            Vehicle(client=client, make='Skoda', model='Octavia', license_plate=f'WX{i:05d}') for i, client in enumerate(clients)
+        ])
+        appointments = Appointment.objects.bulk_create([
+            Appointment(workshop=self.workshop, client=client, vehicle=vehicle,
+                        scheduled_time=timezone.now() + timedelta(hours=i))
+            for i, (client, vehicle) in enumerate(zip(clients, vehicles))
+        ])
+        RepairItem.objects.bulk_create([
+            RepairItem(appointment=appointment, description=f'Naprawa {j}', order=j,
+                       completed_by=self.mechanics[j % 2] if j else None)
+            for appointment in appointments for j in range(3)
+        ])
+        Part.objects.bulk_create([
+            Part(appointment=appointment, name=f'Część {j}') for appointment in appointments for j in range(2)
+        ])
+        for appointment in appointments:
+            appointment.assigned_mechanics.set(self.mechanics)
+        return appointments
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_list_query_count_does_not_depend_on_appointment_count(self):
+        url = reverse('appointment-list', kwargs={'workshop_pk': self.workshop.pk})
+        self.create_appointments(2)
+        few, data = self.count_queries(url)
+        self.assertEqual(len(data), 2)
+
+        self.create_appointments(20)
+        many, data = self.count_queries(url)
+        self.assertEqual(len(data), 22)
+        self.assertEqual(few, many)
+
+    def test_detail_query_count(self):
+        appointment = self.create_appointments(1)[0]
+        url = reverse('appointment-detail', kwargs={'workshop_pk': self.workshop.pk, 'pk': appointment.pk})
+        # kontekst (warsztat), wizyta z klientem i pojazdem, mechanicy, pozycje z pracownikami, części
+        with self.assertNumQueries(5):
+            response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_repair_items_use_flat_employee_representation(self):
+        appointment = self.create_appointments(1)[0]
+        url = reverse('appointment-detail', kwargs={'workshop_pk': self.workshop.pk, 'pk': appointment.pk})
+        items = self.api.get(url).json()['repair_items']
+
+        self.assertEqual([item['description'] for item in items], ['Naprawa 0', 'Naprawa 1', 'Naprawa 2'])
+        self.assertIsNone(items[0]['completed_by'])
+        self.assertIsNone(items[0]['completed_by_name'])
+        self.assertEqual(items[1]['completed_by'], str(self.mechanics[1].pk))
+        self.assertEqual(items[1]['completed_by_name'], 'Mechanik 1')
+
+
+class WorkshopFixtureMixin:
+    """Właściciel warsztatu z rolą, klient z pojazdem i wizyty o zadanych terminach."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='owner@example.com', password='test', first_name='Jan', last_name='Kowalski')
+        cls.user.roles.add(Role.objects.get_or_create(name='workshop_owner')[0])
+        cls.workshop = Workshop.objects.create(name='Warsztat', owner=cls.user)
+        cls.client_obj = Client.objects.create(workshop=cls.workshop, first_name='Klient', last_name='Testowy', phone='1')
+        cls.vehicle = Vehicle.objects.create(client=cls.client_obj, make='Skoda', model='Octavia', license_plate='WX00001')
+        cls.day = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def create_appointment(self, scheduled_time, **kwargs):
+        kwargs.setdefault('client', self.client_obj)
+        kwargs.setdefault('vehicle', self.vehicle)
+        return Appointment.objects.create(workshop=self.workshop, scheduled_time=scheduled_time, **kwargs)
+
+
+class KeysetPaginationTests(WorkshopFixtureMixin, TestCase):
+    """Kursor listy wizyt: kolejne strony bez duplikatów i luk, także przy równych terminach."""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('appointment-list', kwargs={'workshop_pk': self.workshop.pk})
+        # Trzy wizyty o tym samym terminie - o kolejności na granicy strony decyduje id
+        hours = [9, 9, 9, 10, 11, 12, 13]
+        appointments = [self.create_appointment(self.day + timedelta(hours=hour)) for hour in hours]
+        self.expected = [
+            str(appointment.pk)
+            for appointment in sorted(appointments, key=lambda a: (-a.scheduled_time.timestamp(), str(a.pk)))
+        ]
+
+    def pages(self, url, link):
+        pages = []
+        while url:
+            response = self.api.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.json()['results']])
+            url = response.json()[link]
+        return pages
+
+    def test_cursor_round_trip(self):
+        forward = self.pages(f'{self.url}?page_size=3', 'next')
+        self.assertEqual([len(page) for page in forward], [3, 3, 1])
+        self.assertEqual(sum(forward, []), self.expected)
+
+        # Z ostatniej strony wstecz - te same strony w odwrotnej kolejności
+        last = self.api.get(f'{self.url}?page_size=3').json()
+        last = self.api.get(self.api.get(last['next']).json()['next']).json()
+        backward = self.pages(last['previous'], 'previous')
+        self.assertEqual(backward, forward[-2::-1])
+
+    def test_plain_list_without_cursor(self):
+        response = self.api.get(self.url)
+        self.assertEqual(len(response.json()), 7)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.api.get(self.url, {'cursor': 'nie-kursor'}).status_code, 404)
+
+
+class AppointmentFilterTests(WorkshopFixtureMixin, TestCase):
+    """Filtry listy wizyt: status, zakres dat, klient, pojazd i mechanik."""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('appointment-list', kwargs={'workshop_pk': self.workshop.pk})
+        self.mechanic = Employee.objects.create(
+            user=User.objects.create_user(email='mechanik@example.com', password='test', first_name='Mechanik', last_name='1'),
+            workshop=self.workshop, position='Mechanik', hire_date=timezone.now().date(), status='APPROVED',
+        )
+        other_client = Client.objects.create(workshop=self.workshop, first_name='Inny', last_name='Klient', phone='2')
+        other_vehicle = Vehicle.objects.create(client=other_client, make='Fiat', model='Panda', license_plate='WX00002')
+        self.first = self.create_appointment(self.day + timedelta(hours=9))
+        self.second = self.create_appointment(self.day + timedelta(days=1, hours=9), status='completed')
+        self.other = self.create_appointment(self.day + timedelta(days=2, hours=9), status='canceled',
+                                             client=other_client, vehicle=other_vehicle)
+        self.first.assigned_mechanics.add(self.mechanic)
+        self.other.assigned_mechanics.add(self.mechanic)
+
+    def ids(self, **params):
+        response = self.api.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return {row['id'] for row in response.json()}
+
+    def test_status(self):
+        self.assertEqual(self.ids(status='completed'), {str(self.second.pk)})
+        self.assertEqual(self.ids(status='completed, canceled'), {str(self.second.pk), str(self.other.pk)})
+
+    def test_date_range(self):
+        second_day = (self.day + timedelta(days=1)).date().isoformat()
+        # Sama data w scheduled_to obejmuje cały dzień
+        self.assertEqual(self.ids(scheduled_from=second_day, scheduled_to=second_day), {str(self.second.pk)})
+        self.assertEqual(self.ids(scheduled_to=(self.day + timedelta(hours=8)).isoformat()), set())
+
+    def test_client_vehicle_and_mechanic(self):
+        self.assertEqual(self.ids(client=str(self.other.client_id)), {str(self.other.pk)})
+        self.assertEqual(self.ids(vehicle=str(self.vehicle.pk)), {str(self.first.pk), str(self.second.pk)})
+        self.assertEqual(self.ids(mechanic=str(self.mechanic.pk), status='pending'), {str(self.first.pk)})
+
+    def test_invalid_values(self):
+        for params in ({'status': 'zaginiona'}, {'scheduled_from': 'wczoraj'}, {'mechanic': '42'}):
+            response = self.api.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(next(iter(params)), response.json())
+
+
+class AppointmentCalendarTests(WorkshopFixtureMixin, TestCase):
+    """Kalendarz: wszystkie dni okna, wizyty w dniach strefy czasowej z zapytania."""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('appointment-calendar', kwargs={'workshop_pk': self.workshop.pk})
+        utc = datetime.timezone.utc
+        # Poniedziałek 23:30 UTC to już wtorek w Warszawie (UTC+2)
+        self.late = self.create_appointment(datetime.datetime(2026, 10, 12, 23, 30, tzinfo=utc),
+                                            estimated_duration=timedelta(minutes=90))
+        self.friday = self.create_appointment(datetime.datetime(2026, 10, 16, 8, 0, tzinfo=utc), status='completed')
+        self.create_appointment(datetime.datetime(2026, 10, 19, 8, 0, tzinfo=utc))
+
+    def test_week_buckets_in_requested_timezone(self):
+        # uprawnienia i jedno zapytanie zakresowe o wizyty
+        with self.assertNumQueries(2):
+            response = self.api.get(self.url, {'date': '2026-10-14', 'span': 'week', 'tz': 'Europe/Warsaw'})
+        data = response.json()
+        self.assertEqual((data['start'], data['end'], data['count']), ('2026-10-12', '2026-10-18', 2))
+        self.assertEqual([day['count'] for day in data['days']], [0, 1, 0, 0, 1, 0, 0])
+
+        late = data['days'][1]['appointments'][0]
+        self.assertEqual(late['id'], str(self.late.pk))
+        self.assertEqual(late['scheduled_time'], '2026-10-13T01:30:00+02:00')
+        self.assertEqual((late['client_name'], late['vehicle'], late['duration_minutes']), ('Klient Testowy', 'SKODA OCTAVIA', 90))
+
+    def test_filters_and_explicit_window(self):
+        response = self.api.get(self.url, {'start': '2026-10-12', 'end': '2026-10-19', 'status': 'completed'})
+        data = response.json()
+        self.assertEqual(len(data['days']), 8)
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['days'][4]['appointments'][0]['id'], str(self.friday.pk))
+
+    def test_invalid_window(self):
+        for params in ({'start': '2026-10-12'}, {'start': '2026-10-12', 'end': '2026-12-31'}, {'span': 'year'}, {'tz': 'Mars/Olympus'}):
+            self.assertEqual(self.api.get(self.url, params).status_code, 400)
+
+
+class BulkItemsTests(WorkshopFixtureMixin, TestCase):
+    """Zbiorcze prace i części jednej wizyty - zapis w całości albo wcale, wizyta przeliczana raz."""
+
+    def setUp(self):
+        super().setUp()
+        self.appointment = self.create_appointment(self.day + timedelta(hours=9))
+        kwargs = {'workshop_pk': self.workshop.pk, 'appointment_pk': self.appointment.pk}
+        self.items_url = reverse('repair-item-bulk', kwargs=kwargs)
+        self.reorder_url = reverse('repair-item-reorder', kwargs=kwargs)
+        self.parts_url = reverse('parts-bulk', kwargs=kwargs)
+
+    def test_repair_items_complete_the_appointment(self):
+        RepairItem.objects.create(appointment=self.appointment, description='Przegląd', order=1)
+        response = self.api.post(self.items_url, [{'description': 'Wymiana oleju'}, {'description': 'Filtry'}], format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([item['order'] for item in response.json()], [2, 3])
+
+        ids = list(RepairItem.objects.values_list('pk', flat=True))
+        response = self.api.patch(self.items_url, [{'id': str(pk), 'status': 'completed'} for pk in ids], format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, 'completed')
+
+    def test_invalid_entry_rolls_back_the_batch(self):
+        item = RepairItem.objects.create(appointment=self.appointment, description='Przegląd')
+        response = self.api.patch(self.items_url, [
+            {'id': str(item.pk), 'status': 'completed'},
+            {'id': str(uuid.uuid4()), 'status': 'completed'},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()[0], {})
+        self.assertIn('id', response.json()[1])
+        item.refresh_from_db()
+        self.assertEqual(item.status, 'pending')
+
+    def test_reorder(self):
+        first, second, third = [
+            RepairItem.objects.create(appointment=self.appointment, description=name, order=i)
+            for i, name in enumerate(['A', 'B', 'C'])
+        ]
+        response = self.api.post(self.reorder_url, {'order': [str(third.pk)]}, format='json')
+        self.assertEqual([item['description'] for item in response.json()], ['C', 'A', 'B'])
+        self.assertEqual(list(self.appointment.repair_items.values_list('description', flat=True)), ['C', 'A', 'B'])
+
+        response = self.api.post(self.reorder_url, {'order': [str(uuid.uuid4())]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_parts_update_appointment_totals(self):
+        response = self.api.post(self.parts_url, [
+            {'name': 'filtr oleju', 'cost_part': '40.00', 'quantity': 2},
+            {'name': 'olej', 'cost_part': '120.50'},
+        ], format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([part['name'] for part in response.json()], ['Filtr Oleju', 'Olej'])
+        self.appointment.refresh_from_db()
+        self.assertEqual((self.appointment.parts_total, self.appointment.total_cost), (Decimal('200.50'), Decimal('200.50')))
+
+        oil = Part.objects.get(name='Olej')
+        response = self.api.patch(self.parts_url, [{'id': str(oil.pk), 'quantity': 3}], format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.parts_total, Decimal('441.50'))
+
+
+class AppointmentTotalsTests(WorkshopFixtureMixin, TestCase):
+    """Koszt wizyty utrzymywany różnicowo równa się pełnemu przeliczeniu, z rabatem zapisanym w wizycie."""
+
+    def setUp(self):
+        super().setUp()
+        Client.objects.filter(pk=self.client_obj.pk).update(discount=Decimal('10.00'))
+        self.client_obj.refresh_from_db()
+        self.appointment = self.create_appointment(self.day + timedelta(hours=9))
+
+    def test_incremental_totals_match_full_recompute(self):
+        rng = random.Random(5)
+        parts = []
+        for step in range(40):
+            if parts and rng.random() < 0.3:
+                Part.objects.get(pk=parts.pop(rng.randrange(len(parts))).pk).delete()
+            elif parts and rng.random() < 0.5:
+                part = Part.objects.get(pk=rng.choice(parts).pk)
+                part.quantity = rng.randrange(1, 5)
+                part.cost_part = Decimal(rng.randrange(100, 10000)) / 100
+                part.save()
+            else:
+                parts.append(Part.objects.create(
+                    appointment=self.appointment, name=f'część {step}',
+                    cost_part=Decimal(rng.randrange(100, 10000)) / 100, quantity=rng.randrange(1, 5),
+                ))
+        self.assertEqual(list(appointment_total_drift()), [])
+
+        self.appointment.refresh_from_db()
+        expected = sum((part.cost_part * part.quantity for part in Part.objects.all()), Decimal('0'))
+        self.assertEqual(self.appointment.parts_total, expected)
+        self.assertEqual(self.appointment.discount, Decimal('10.00'))
+
+    def test_later_discount_change_does_not_cause_drift(self):
+        Part.objects.create(appointment=self.appointment, name='olej', cost_part=Decimal('100.00'))
+        Client.objects.filter(pk=self.client_obj.pk).update(discount=Decimal('3.00'))
+        self.assertEqual(list(appointment_total_drift()), [])
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.total_cost, Decimal('90.00'))
+
+        # Zakończenie wizyty rozlicza ją według rabatu z tej chwili
+        self.appointment.status = 'completed'
+        self.appointment.save(update_fields=['status', 'updated_at'])
+        self.appointment.refresh_from_db()
+        self.assertEqual((self.appointment.discount, self.appointment.total_cost), (Decimal('3.00'), Decimal('97.00')))
+        self.assertEqual(list(appointment_total_drift()), [])
+
+    def test_total_cost_is_not_client_writable(self):
+        Part.objects.create(appointment=self.appointment, name='olej', cost_part=Decimal('100.00'))
+        url = reverse('appointment-detail', kwargs={'workshop_pk': self.workshop.pk, 'pk': self.appointment.pk})
+        response = self.api.patch(url, {'total_cost': '1.00', 'discount': '50.00', 'notes': 'Olej 5W30'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual((response.json()['total_cost'], response.json()['notes']), ('90.00', 'Olej 5W30'))
+
+        Part.objects.create(appointment=self.appointment, name='filtr', cost_part=Decimal('20.00'))
+        self.appointment.refresh_from_db()
+        self.assertEqual((self.appointment.discount, self.appointment.total_cost), (Decimal('10.00'), Decimal('108.00')))
+
+    def test_fix_skips_completed_appointments(self):
+        Part.objects.create(appointment=self.appointment, name='olej', cost_part=Decimal('100.00'))
+        completed = self.create_appointment(self.day + timedelta(hours=12), status='completed')
+        Part.objects.create(appointment=completed, name='olej', cost_part=Decimal('100.00'))
+        # Koszty sprzed utrzymywania różnicowego (np. ustawione ręcznie)
+        Appointment.objects.filter(pk__in=[self.appointment.pk, completed.pk]).update(total_cost=Decimal('75.00'))
+
+        out = StringIO()
+        call_command('reconcile_appointment_totals', '--fix', stdout=out)
+        self.assertIn('Pominięto 1 wizyt zakończonych', out.getvalue())
+        self.assertEqual([row['pk'] for row in appointment_total_drift()], [completed.pk])
+        self.assertEqual(Appointment.objects.get(pk=completed.pk).total_cost, Decimal('75.00'))
+
+        call_command('reconcile_appointment_totals', '--fix', '--include-completed', stdout=StringIO())
+        self.assertEqual(list(appointment_total_drift()), [])
+
+
+class BatchCreateTests(WorkshopFixtureMixin, TestCase):
+    """Wizyty z importu zbiorczego wywołują te same sygnały co pojedynczy zapis."""
+
+    def setUp(self):
+        super().setUp()
+        schedules.clear()
+        self.url = reverse('appointment-batch', kwargs={'workshop_pk': self.workshop.pk})
+        self.mechanic = Employee.objects.create(
+            user=User.objects.create_user(email='mechanik@example.com', password='test', first_name='Mechanik', last_name='1'),
+            workshop=self.workshop, position='Mechanik', hire_date=timezone.now().date(), status='APPROVED',
+        )
+
+    def entry(self, hour, **kwargs):
+        return {
+            'client_id': str(self.client_obj.pk), 'vehicle_id': str(self.vehicle.pk),
+            'scheduled_time': (self.day + timedelta(hours=hour)).isoformat(),
+            'estimated_duration': str(timedelta(hours=1)),
+            'assigned_mechanics': [str(self.mechanic.pk)], **kwargs,
+        }
+
+    def test_batch_create_fires_signals(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.api.post(self.url, [
+                self.entry(9),
+                self.entry(12, status='completed', total_cost='150.00', discount='50.00'),
+                self.entry(14, vehicle_id=str(uuid.uuid4())),
+            ], format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([row['index'] for row in response.json()['created']], [0, 1])
+        self.assertEqual([row['index'] for row in response.json()['errors']], [2])
+        first = response.json()['created'][0]['id']
+        self.assertEqual(list(Appointment.objects.get(pk=first).assigned_mechanics.all()), [self.mechanic])
+
+        # Koszt i rabat nie są przyjmowane z importu - wynikają z części i rabatu klienta
+        imported = Appointment.objects.get(pk=response.json()['created'][1]['id'])
+        self.assertEqual((imported.total_cost, imported.discount), (None, Decimal('0.00')))
+
+        # Magazyn cech klienta (post_save)
+        features = ClientFeatures.objects.get(client=self.client_obj)
+        self.assertEqual(features.completed_count, 1)
+
+        # Indeks grafików (post_save + m2m_changed) - nowa wizyta koliduje z importowaną
+        conflicts = schedules.check(self.workshop.pk, self.day + timedelta(hours=9, minutes=30), timedelta(hours=1), {self.mechanic.pk})
+        self.assertEqual([str(conflict['appointment']) for conflict in conflicts], [first])
+
+    def test_empty_or_oversized_batch(self):
+        self.assertEqual(self.api.post(self.url, [], format='json').status_code, 400)
+        self.assertEqual(self.api.post(self.url, [self.entry(9)] * 201, format='json').status_code, 400)
+
+
+class IntervalTreeTests(SimpleTestCase):
+    def test_matches_brute_force(self):
+        rng = random.Random(7)
+        tree, intervals = IntervalTree(), {}
+        for step in range(2000):
+            key = rng.randrange(300)
+            if rng.random() < 0.3:
+                tree.discard(key)
+                intervals.pop(key, None)
+            else:
+                start = rng.randrange(1000)
+                intervals[key] = (start, start + rng.randrange(1, 60))
+                tree.add(key, *intervals[key])
+            if step % 50 == 0:
+                start = rng.randrange(1000)
+                end = start + rng.randrange(1, 80)
+                expected = {key for key, (s, e) in intervals.items() if s < end and e > start}
+                self.assertEqual({key for key, *_ in tree.overlapping(start, end)}, expected)
+        self.assertEqual(len(tree), len(intervals))
+
+    def test_covers_adjacent_intervals(self):
+        tree = IntervalTree()
+        tree.add('rano', 8, 12)
+        tree.add('popoludnie', 12, 16)
+        self.assertTrue(tree.covers(9, 15))
+        self.assertFalse(tree.covers(7, 9))
+        tree.discard('popoludnie')
+        self.assertFalse(tree.covers(11, 13))
+
+
+class RunStartsTests(SimpleTestCase):
+    def test_matches_brute_force(self):
+        rng = random.Random(3)
+        for _ in range(200):
+            bits = rng.getrandbits(96)
+            length = rng.randrange(1, 12)
+            expected = sum(1 << i for i in range(96) if all(bits >> j & 1 for j in range(i, i + length)))
+            self.assertEqual(run_starts(bits, length), expected)
+
+
+class ScheduleConflictTests(TestCase):
+    """Konflikty grafiku przy zapisie wizyty przez API; indeks aktualizowany z sygnałów."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='owner@example.com', password='test', first_name='Jan', last_name='Kowalski')
+        cls.user.roles.add(Role.objects.get_or_create(name='workshop_owner')[0])
+        cls.workshop = Workshop.objects.create(name='Warsztat', owner=cls.user)
+        cls.mechanic = Employee.objects.create(
+            user=User.objects.create_user(email='mechanik@example.com', password='test', first_name='Mechanik', last_name='1'),
+            workshop=cls.workshop, position='Mechanik', hire_date=timezone.now().date(), status='APPROVED',
+        )
+        cls.client_obj = Client.objects.create(workshop=cls.workshop, first_name='Klient', last_name='Testowy', phone='1')
+        cls.vehicle = Vehicle.objects.create(client=cls.client_obj, make='Skoda', model='Octavia', license_plate='WX00001')
+        cls.day = (timezone.now() + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def setUp(self):
+        schedules.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.url = reverse('appointment-list', kwargs={'workshop_pk': self.workshop.pk})
+
+    def book(self, hour, minutes=60):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.api.post(self.url, {
+                'client_id': str(self.client_obj.pk), 'vehicle_id': str(self.vehicle.pk),
+                'scheduled_time': (self.day + timedelta(hours=hour)).isoformat(),
+                'estimated_duration': str(timedelta(minutes=minutes)),
+                'assigned_mechanics': [str(self.mechanic.pk)],
+            }, format='json')
+
+    def test_overlapping_booking_is_flagged(self):
+        first = self.book(9)
+        self.assertEqual(first.json()['schedule_conflicts'], [])
+        self.assertEqual(self.book(10).json()['schedule_conflicts'], [])
+
+        conflicts = self.book(9, minutes=90).json()['schedule_conflicts']
+        self.assertEqual({conflict['type'] for conflict in conflicts}, {'booking'})
+        self.assertEqual(len(conflicts), 2)
+        self.assertIn(first.json()['id'], {conflict['appointment'] for conflict in conflicts})
+
+    def test_canceled_appointment_frees_the_slot(self):
+        first = self.book(9)
+        appointment = Appointment.objects.get(pk=first.json()['id'])
+        appointment.status = 'canceled'
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.save()
+        self.assertEqual(self.book(9).json()['schedule_conflicts'], [])
+
+    @override_settings(SCHEDULING_CONFLICTS='reject')
+    def test_booking_outside_shift_is_rejected(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ScheduleEntry.objects.create(employee=self.mechanic, start_time=self.day + timedelta(hours=8), end_time=self.day + timedelta(hours=16))
+        self.assertEqual(self.book(15, minutes=60).status_code, 201)
+
+        response = self.book(15, minutes=120)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('schedule_conflicts', response.json())
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_availability_skips_booked_and_off_shift_slots(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ScheduleEntry.objects.create(employee=self.mechanic, start_time=self.day + timedelta(hours=8), end_time=self.day + timedelta(hours=16))
+        self.book(9, minutes=50)
+
+        url = reverse('appointment-availability', kwargs={'workshop_pk': self.workshop.pk})
+        with self.assertNumQueries(4):
+            # uprawnienia, wersja grafiku, potwierdzenie terminów i nazwiska mechaników - grafik jest w indeksie
+            response = self.api.get(url, {'start': self.day.date().isoformat(), 'duration': 120, 'days': 1, 'tz': 'UTC'})
+        slots = response.json()['slots']
+        # 8:00-9:00 jest za krótkie, wizyta zajmuje slot do 10:00, zmiana kończy się o 16:00
+        self.assertEqual([slot['start'][11:16] for slot in slots], ['10:00', '12:00', '14:00'])
+        self.assertEqual(slots[0]['mechanic'], str(self.mechanic.pk))
+        self.assertEqual(slots[0]['mechanic_name'], 'Mechanik 1')
+
+    def test_availability_skips_slots_booked_by_another_process(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ScheduleEntry.objects.create(employee=self.mechanic, start_time=self.day + timedelta(hours=8), end_time=self.day + timedelta(hours=12))
+        url = reverse('appointment-availability', kwargs={'workshop_pk': self.workshop.pk})
+        params = {'start': self.day.date().isoformat(), 'duration': 120, 'days': 1, 'tz': 'UTC'}
+        self.assertEqual([slot['start'][11:16] for slot in self.api.get(url, params).json()['slots']], ['08:00', '10:00'])
+
+        # Zapis w innym procesie - bez callbacków po commicie indeks tego procesu ani wersja się nie zmieniają
+        appointment = Appointment.objects.create(
+            workshop=self.workshop, client=self.client_obj, vehicle=self.vehicle,
+            scheduled_time=self.day + timedelta(hours=8), estimated_duration=timedelta(hours=2),
+        )
+        appointment.assigned_mechanics.add(self.mechanic)
+        self.assertEqual([slot['start'][11:16] for slot in self.api.get(url, params).json()['slots']], ['10:00'])
+
+
+class ScheduleIndexTests(WorkshopFixtureMixin, TestCase):
+    """Wersja grafiku w bazie, limit warsztatów w pamięci i usuwanie przeszłości."""
+
+    def test_change_in_another_process_invalidates_the_index(self):
+        here, there = ScheduleIndex(), ScheduleIndex()
+        schedule = here.get(self.workshop.pk)
+        self.assertEqual(schedule.version, 0)
+
+        there.change(self.workshop.pk, lambda schedule: None)
+        self.assertEqual(ScheduleIndex.version(self.workshop.pk), 1)
+        self.assertIsNot(here.get(self.workshop.pk), schedule)
+        self.assertEqual(here.get(self.workshop.pk).version, 1)
+
+    @override_settings(SCHEDULING_MAX_WORKSHOPS=1)
+    def test_least_recently_used_workshop_is_dropped(self):
+        index = ScheduleIndex()
+        other = Workshop.objects.create(name='Drugi', owner=self.user)
+        first = index.get(self.workshop.pk)
+        index.get(other.pk)
+        self.assertIsNot(index.get(self.workshop.pk), first)
+
+    def test_prune_drops_past_entries(self):
+        schedule = WorkshopSchedule(self.workshop.pk, 0, self.day - timedelta(days=10))
+        mechanic = uuid.uuid4()
+        schedule.set_shift('stara', mechanic, self.day - timedelta(days=9), self.day - timedelta(days=9, hours=-8))
+        schedule.set_shift('nowa', mechanic, self.day, self.day + timedelta(hours=8))
+        schedule.set_appointment('stara', self.day - timedelta(days=9), self.day - timedelta(days=9, hours=-1), {mechanic})
+        schedule.set_appointment('nowa', self.day, self.day + timedelta(hours=1), {mechanic})
+        schedule.free_bits(mechanic, 0, 1)
+        schedule.day_bitmaps(mechanic, (self.day - datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)).days)
+
+        schedule.prune(self.day - timedelta(days=1))
+        self.assertEqual(list(schedule.appointments), ['nowa'])
+        self.assertEqual(len(schedule.shifts[mechanic]), 1)
+        self.assertEqual(len(schedule.days), 1)
@@ -1,10 +1,26 @@
 from pyexpat.errors import messages
+import datetime
+import os
+import uuid
+from django.db import transaction
+from django.db.models import Max, Prefetch, Q
+from django.db.models.signals import m2m_changed, post_save
+from django.utils import timezone
 from django.shortcuts import get_object_or_404, redirect
 from rest_framework import viewsets, permissions
+from appointments.filters import availability_query, calendar_window, filter_appointments
 from appointments.models import Appointment, RepairItem, Part
-from appointments.serializers import AppointmentSerializer, PartSerializer, RepairItemSerializer
-# from ai_module.signals import get_appointment_recommendations
+from appointments.rollups import apply_parts_deltas, part_cost_deltas, refresh_appointments
+from appointments.scheduling import schedules
+from appointments.serializers import (
+    AppointmentSerializer, BatchAppointmentSerializer, BulkPartSerializer, CalendarAppointmentSerializer, PartSerializer,
+    RepairItemSerializer,
+)
+from employees.models import Employee
+from vehicles.models import Vehicle
+from ai_module.registry import DURATION_INDEX_PATH
 from workshops.models import Workshop
+from backend.pagination import KeysetPagination
 from accounts.permissions import IsMechanic, IsWorkshopOwner, IsAdmin
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import IsAuthenticated
@@ -13,13 +29,36 @@ from rest_framework import status, views
 from rest_framework.exceptions import ValidationError
 
 
+def _parse_ids(values):
+    ids = []
+    for value in values:
+        try:
+            ids.append(uuid.UUID(str(value)))
+        except ValueError:
+            pass
+    return ids
+
+
 class AppointmentViewSet(viewsets.ModelViewSet):
     serializer_class = AppointmentSerializer
     permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin | IsMechanic]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-scheduled_time', 'id')
+    batch_limit = 200
 
     def get_queryset(self):
         workshop_id = self.kwargs['workshop_pk']
-        return Appointment.objects.filter(workshop__id=workshop_id)
+        queryset = Appointment.objects.filter(workshop__id=workshop_id)
+        if self.action == 'list':
+            queryset = filter_appointments(queryset, self.request.query_params)
+        # Stała liczba zapytań niezależnie od liczby wizyt - wszystko, co zagnieżdża AppointmentSerializer
+        return queryset.select_related(
+            'client', 'vehicle'
+        ).prefetch_related(
+            'assigned_mechanics',
+            Prefetch('repair_items', queryset=RepairItem.objects.select_related('completed_by__user')),
+            'parts',
+        )
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -41,14 +80,268 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         kwargs['partial'] = True
         return super().partial_update(request, *args, **kwargs)
     
+    def batch_create(self, request, *args, **kwargs):
+        """
+        Tworzy wiele wizyt jednym żądaniem - lista obiektów jak w zwykłym POST.
+
+        Klienci z pojazdami i mechanicy całej listy są wczytywani jednym
+        zapytaniem każde, wizyty zapisywane jednym `bulk_create`, a przypisania
+        mechaników jednym insertem do tabeli pośredniej. Błędne pozycje wracają
+        w `errors` (z indeksem) i nie przerywają zapisu pozostałych.
+        """
+        data = request.data
+        if not isinstance(data, list) or not data:
+            raise ValidationError("Oczekiwano niepustej listy wizyt.")
+        if len(data) > self.batch_limit:
+            raise ValidationError(f"Najwyżej {self.batch_limit} wizyt w jednym żądaniu.")
+        entries = [entry if isinstance(entry, dict) else {} for entry in data]
+
+        context = self.get_serializer_context()
+        workshop = context['workshop']
+        client_ids = _parse_ids(entry['client_id'] for entry in entries if entry.get('client_id'))
+        vehicle_ids = _parse_ids(entry['vehicle_id'] for entry in entries if entry.get('vehicle_id'))
+        mechanic_ids = _parse_ids(
+            mechanic for entry in entries if isinstance(entry.get('assigned_mechanics'), list)
+            for mechanic in entry['assigned_mechanics']
+        )
+        # Pojazdy wskazane wprost i pojazdy wskazanych klientów - klienci przychodzą razem z nimi
+        vehicles = Vehicle.objects.filter(client__workshop=workshop).filter(
+            Q(pk__in=vehicle_ids) | Q(client_id__in=client_ids)
+        ).select_related('client')
+        context['vehicles'] = {vehicle.pk: vehicle for vehicle in vehicles}
+        context['clients'] = {vehicle.client_id: vehicle.client for vehicle in context['vehicles'].values()}
+        context['employees'] = Employee.objects.filter(workshop=workshop).in_bulk(mechanic_ids)
+
+        appointments, assignments, created, errors = [], [], [], []
+        for index, entry in enumerate(data):
+            serializer = BatchAppointmentSerializer(data=entry, context=context)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+            validated_data = dict(serializer.validated_data)
+            mechanics = list(dict.fromkeys(validated_data.pop('assigned_mechanics', [])))
+            appointment = Appointment(workshop=workshop, **validated_data)
+            # Jak Appointment.save(), którego bulk_create nie wywołuje
+            appointment.discount = appointment.client.discount
+            appointments.append(appointment)
+            assignments.append(mechanics)
+            created.append(index)
+
+        through = Appointment.assigned_mechanics.through
+        with transaction.atomic():
+            Appointment.objects.bulk_create(appointments)
+            through.objects.bulk_create([
+                through(appointment_id=appointment.pk, employee_id=mechanic.pk)
+                for appointment, mechanics in zip(appointments, assignments) for mechanic in mechanics
+            ])
+            # bulk_create pomija sygnały - wysyłamy je jak save() i set(), żeby zależne dane
+            # (cechy klientów, historia, segmenty) widziały nowe wizyty
+            for appointment, mechanics in zip(appointments, assignments):
+                post_save.send(sender=Appointment, instance=appointment, created=True, update_fields=None, raw=False, using=appointment._state.db)
+                if mechanics:
+                    m2m_changed.send(
+                        sender=through, instance=appointment, action='post_add', reverse=False,
+                        model=Employee, pk_set={mechanic.pk for mechanic in mechanics}, using=appointment._state.db,
+                    )
+
+        return Response({
+            'created': [{'index': index, 'id': appointment.pk} for index, appointment in zip(created, appointments)],
+            'errors': errors,
+        }, status=status.HTTP_201_CREATED if appointments else status.HTTP_400_BAD_REQUEST)
+
     def get_permissions(self):
-        if self.action in ['update', 'patch' 'partial_update', 'destroy']:
+        if self.action == 'batch_create':
+            permission_classes = [permissions.IsAuthenticated, IsWorkshopOwner | IsAdmin | IsMechanic]
+        elif self.action in ['update', 'patch' 'partial_update', 'destroy']:
             permission_classes = [permissions.IsAuthenticated, IsWorkshopOwner | IsAdmin]
         else:
             permission_classes = [permissions.IsAuthenticated]
         return [permission() for permission in permission_classes]
     
-class RepairItemViewSet(viewsets.ModelViewSet):
+class AppointmentCalendarView(views.APIView):
+    """
+    Wizyty warsztatu w oknie dat (dzień, tydzień, miesiąc), pogrupowane po dniach.
+
+    Jedno zapytanie zakresowe po `scheduled_time` (indeks warsztat + termin)
+    z samymi polami potrzebnymi w kalendarzu; zwracane są wszystkie dni okna,
+    także puste. Filtry listy wizyt (`status`, `mechanic`, ...) też działają.
+    """
+    permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin | IsMechanic]
+
+    fields = (
+        'id', 'scheduled_time', 'status', 'estimated_duration',
+        'client__first_name', 'client__last_name',
+        'vehicle__license_plate', 'vehicle__make', 'vehicle__model',
+    )
+
+    def get(self, request, workshop_pk):
+        start, end, tz = calendar_window(request.query_params)
+        window_start = datetime.datetime.combine(start, datetime.time.min, tzinfo=tz)
+        window_end = datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min, tzinfo=tz)
+
+        appointments = filter_appointments(
+            Appointment.objects.filter(
+                workshop__id=workshop_pk, scheduled_time__gte=window_start, scheduled_time__lt=window_end
+            ),
+            request.query_params,
+        ).order_by('scheduled_time', 'id').values(*self.fields)
+
+        days = {start + datetime.timedelta(days=i): [] for i in range((end - start).days + 1)}
+        for appointment in appointments:
+            days[timezone.localtime(appointment['scheduled_time'], tz).date()].append(appointment)
+
+        # Godziny w odpowiedzi w tej samej strefie, w której liczone są dni
+        with timezone.override(tz):
+            buckets = [
+                {
+                    'date': day.isoformat(),
+                    'count': len(items),
+                    'appointments': CalendarAppointmentSerializer(items, many=True).data,
+                }
+                for day, items in days.items()
+            ]
+
+        return Response({
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'timezone': str(tz),
+            'count': sum(bucket['count'] for bucket in buckets),
+            'days': buckets,
+        }, status=status.HTTP_200_OK)
+
+class AppointmentAvailabilityView(views.APIView):
+    """
+    Najbliższe wolne terminy mechaników warsztatu, np. "pierwsze wolne 2 godziny".
+
+    Liczone w pamięci z bitmap zajętości indeksu grafików (appointments.scheduling):
+    sloty po 15 minut na zmianie i bez wizyt, szukanie odcinków wymaganej
+    długości operacjami bitowymi na całym oknie naraz. Znalezione terminy są
+    potwierdzane jednym zapytaniem o wizyty (rezerwacje z innych procesów).
+    """
+    permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin | IsMechanic]
+
+    def get(self, request, workshop_pk):
+        query = availability_query(request.query_params)
+        slots = schedules.free_slots(
+            workshop_pk, query['start'], query['end'], query['duration'],
+            mechanics=None if query['mechanic'] is None else [query['mechanic']],
+            limit=query['limit'],
+        )
+        names = {
+            employee.pk: employee.user.get_full_name()
+            for employee in Employee.objects.filter(pk__in={mechanic for _, mechanic in slots}).select_related('user')
+        }
+        tz = query['tz']
+        return Response({
+            'start': timezone.localtime(query['start'], tz).isoformat(),
+            'end': timezone.localtime(query['end'], tz).isoformat(),
+            'duration': int(query['duration'].total_seconds() // 60),
+            'timezone': str(tz),
+            'slots': [
+                {
+                    'mechanic': mechanic,
+                    'mechanic_name': names.get(mechanic),
+                    'start': timezone.localtime(start, tz).isoformat(),
+                    'end': timezone.localtime(start + query['duration'], tz).isoformat(),
+                }
+                for start, mechanic in slots
+            ],
+        }, status=status.HTTP_200_OK)
+
+
+class BulkItemsMixin:
+    """
+    Operacje zbiorcze na pozycjach jednej wizyty (prace, części).
+
+    Lista pozycji jest walidowana w całości, zapisywana jednym `bulk_create`
+    lub `bulk_update` w transakcji, a wizyta jest aktualizowana raz na żądanie
+    (`update_rollups`) zamiast w sygnałach każdej pozycji.
+    """
+    bulk_serializer_class = None
+    bulk_limit = 200
+
+    def get_bulk_context(self, data):
+        return self.get_serializer_context()
+
+    def get_bulk_serializer(self, *args, **kwargs):
+        return (self.bulk_serializer_class or self.get_serializer_class())(*args, **kwargs)
+
+    def get_bulk_payload(self, request):
+        data = request.data
+        if not isinstance(data, list) or not data:
+            raise ValidationError("Oczekiwano niepustej listy pozycji.")
+        if len(data) > self.bulk_limit:
+            raise ValidationError(f"Najwyżej {self.bulk_limit} pozycji w jednym żądaniu.")
+        return data
+
+    def prepare_created(self, appointment, objects, validated_data):
+        """Uzupełnia nowe obiekty przed bulk_create (to, co zwykle robi save() lub sygnał)."""
+
+    def prepare_updated(self, appointment, objects, fields):
+        """Jak `prepare_created` dla bulk_update; zwraca dodatkowe pola do zapisu."""
+        return set()
+
+    def update_rollups(self, appointment, objects):
+        """Aktualizuje wizytę po zapisie zbiorczym (bulk_* pomija sygnały pozycji)."""
+        refresh_appointments([appointment.pk])
+
+    def bulk_create(self, request, *args, **kwargs):
+        data = self.get_bulk_payload(request)
+        context = self.get_bulk_context(data)
+        serializer = self.get_bulk_serializer(data=data, many=True, context=context)
+        serializer.is_valid(raise_exception=True)
+
+        appointment = context['appointment']
+        model = self.get_queryset().model
+        objects = [model(appointment=appointment, **item) for item in serializer.validated_data]
+        self.prepare_created(appointment, objects, serializer.validated_data)
+        with transaction.atomic():
+            model.objects.bulk_create(objects)
+            self.update_rollups(appointment, objects)
+        return Response(self.get_bulk_serializer(objects, many=True, context=context).data, status=status.HTTP_201_CREATED)
+
+    def bulk_update(self, request, *args, **kwargs):
+        data = self.get_bulk_payload(request)
+        context = self.get_bulk_context(data)
+        appointment = context['appointment']
+        model = self.get_queryset().model
+        has_updated_at = any(field.name == 'updated_at' for field in model._meta.concrete_fields)
+
+        with transaction.atomic():
+            ids = _parse_ids(entry.get('id') for entry in data if isinstance(entry, dict))
+            instances = self.get_queryset().select_for_update(of=('self',)).in_bulk(ids)
+            errors, updated, fields = [], [], set()
+            now = timezone.now()
+            for entry in data:
+                entry_ids = _parse_ids([entry.get('id')]) if isinstance(entry, dict) else []
+                instance = instances.get(entry_ids[0]) if entry_ids else None
+                if instance is None:
+                    errors.append({'id': ["Nie znaleziono pozycji w tej wizycie."]})
+                    continue
+                serializer = self.get_bulk_serializer(instance, data=entry, partial=True, context=context)
+                if not serializer.is_valid():
+                    errors.append(serializer.errors)
+                    continue
+                for name, value in serializer.validated_data.items():
+                    setattr(instance, name, value)
+                if has_updated_at:
+                    instance.updated_at = now
+                fields.update(serializer.validated_data)
+                updated.append(instance)
+                errors.append({})
+            if any(errors):
+                raise ValidationError(errors)
+
+            fields |= self.prepare_updated(appointment, updated, fields)
+            if has_updated_at:
+                fields.add('updated_at')
+            if fields:
+                model.objects.bulk_update(updated, list(fields))
+            self.update_rollups(appointment, updated)
+        return Response(self.get_bulk_serializer(updated, many=True, context=context).data, status=status.HTTP_200_OK)
+
+
+class RepairItemViewSet(BulkItemsMixin, viewsets.ModelViewSet):
     serializer_class = RepairItemSerializer
     permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin | IsMechanic] 
 
@@ -58,7 +351,7 @@ class RepairItemViewSet(viewsets.ModelViewSet):
         return RepairItem.objects.filter(
             appointment__id=appointment_id,
             appointment__workshop__id=workshop_id
-        )
+        ).select_related('completed_by__user')
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -78,8 +371,69 @@ class RepairItemViewSet(viewsets.ModelViewSet):
         kwargs['partial'] = True
         return self.update(request, *args, **kwargs)
 
+    def get_bulk_context(self, data):
+        # Pracownicy z całej listy jednym zapytaniem (patrz PrefetchedRelatedField)
+        context = super().get_bulk_context(data)
+        employee_ids = _parse_ids(
+            entry['completed_by_id'] for entry in data if isinstance(entry, dict) and entry.get('completed_by_id')
+        )
+        context['employees'] = Employee.objects.select_related('user').in_bulk(employee_ids)
+        return context
+
+    def prepare_created(self, appointment, objects, validated_data):
+        # Pozycje bez podanej kolejności trafiają na koniec listy, w kolejności z żądania
+        next_order = (appointment.repair_items.aggregate(last=Max('order'))['last'] or 0) + 1
+        for item, data in zip(objects, validated_data):
+            if 'order' not in data:
+                item.order = next_order
+                next_order += 1
+        # bulk_create pomija sygnał pre_save z szacowaniem czasu - liczymy go tutaj
+        if os.path.exists(DURATION_INDEX_PATH):
+            from ai_module.duration import estimate_repair_items
+            estimate_repair_items(objects, appointment.vehicle)
+
+    def prepare_updated(self, appointment, objects, fields):
+        if 'description' in fields and os.path.exists(DURATION_INDEX_PATH):
+            from ai_module.duration import estimate_repair_items
+            estimate_repair_items(objects, appointment.vehicle)
+            return {'estimated_duration'}
+        return set()
+
+    def reorder(self, request, *args, **kwargs):
+        """
+        Ustawia kolejność prac: `{"order": [id, ...]}`. Wymienione pozycje dostają
+        kolejne numery od 0, pozostałe trafiają za nimi w dotychczasowej kolejności.
+        """
+        ids = request.data.get('order') if isinstance(request.data, dict) else None
+        if not isinstance(ids, list) or not ids:
+            raise ValidationError({'order': ["Oczekiwano listy identyfikatorów pozycji."]})
+        ids = [str(value) for value in ids]
+
+        context = self.get_serializer_context()
+        with transaction.atomic():
+            items = list(
+                self.get_queryset().select_for_update(of=('self',)).order_by('order', 'created_at')
+            )
+            by_id = {str(item.pk): item for item in items}
+            unknown = [value for value in ids if value not in by_id]
+            if unknown:
+                raise ValidationError({'order': [f"Pozycje spoza tej wizyty: {', '.join(unknown)}."]})
+
+            listed = [by_id[value] for value in dict.fromkeys(ids)]
+            listed_ids = {item.pk for item in listed}
+            ordered = listed + [item for item in items if item.pk not in listed_ids]
+            now = timezone.now()
+            changed = []
+            for position, item in enumerate(ordered):
+                if item.order != position:
+                    item.order = position
+                    item.updated_at = now
+                    changed.append(item)
+            RepairItem.objects.bulk_update(changed, ['order', 'updated_at'])
+        return Response(self.get_serializer(ordered, many=True, context=context).data, status=status.HTTP_200_OK)
+
     def get_permissions(self):
-        if self.action in ['patch','update', 'partial_update', 'destroy']:
+        if self.action in ['patch','update', 'partial_update', 'destroy', 'bulk_create', 'bulk_update', 'reorder']:
             permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin | IsMechanic]
         else:
             permission_classes = [IsAuthenticated]
@@ -88,10 +442,11 @@ class RepairItemViewSet(viewsets.ModelViewSet):
 class GenerateRecommendationsAPIView(views.APIView):
     permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin | IsMechanic] 
 
-    def post(self, request, appointment_id):
-        appointment = get_object_or_404(Appointment, id=appointment_id)
+    def post(self, request, workshop_pk, appointment_pk):
+        appointment = get_object_or_404(
+            Appointment.objects.select_related('vehicle'), id=appointment_pk, workshop__id=workshop_pk
+        )
         repair_items = appointment.repair_items.all()
-        appointment_description = appointment.notes or "Brak opisu wizyty."
 
         if not repair_items:
             return Response(
@@ -99,23 +454,55 @@ class GenerateRecommendationsAPIView(views.APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # recommendations = get_appointment_recommendations(appointment_description, repair_items)
-
-        # if recommendations:
-        #     appointment.recommendations = recommendations
-        #     appointment.save()
-        #     serializer = AppointmentSerializer(appointment)
-        #     return Response(serializer.data, status=status.HTTP_200_OK)
-        # else:
-        #     return Response(
-        #         {"detail": "Nie udało się wygenerować rekomendacji."},
-        #         status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        #     )
-        
-class PartViewSet(viewsets.ModelViewSet):
+        # Lokalny indeks współwystępowania prac (numpy ładowany dopiero tutaj)
+        from ai_module.recommendations import recommend_for_appointment
+
+        result = recommend_for_appointment(appointment, repair_items)
+        if result is None:
+            return Response(
+                {"detail": "Indeks rekomendacji nie został jeszcze zbudowany."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        if not result['recommendations']:
+            return Response(
+                {"detail": "Brak rekomendacji dla tej wizyty."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        recommendations = '\n'.join(
+            f"- {r['item']} ({r['confidence']:.0%} podobnych wizyt"
+            + (f", razem z: {r['because']})" if r['because'] else ")")
+            for r in result['recommendations']
+        )
+        # update() zamiast save() - same rekomendacje nie mają wyzwalać sygnałów wizyty
+        Appointment.objects.filter(pk=appointment.pk).update(recommendations=recommendations)
+        appointment.recommendations = recommendations
+
+        data = AppointmentSerializer(appointment, context={'request': request}).data
+        data['recommendation_items'] = result['recommendations']
+        data['recommendation_context'] = result['context']
+        return Response(data, status=status.HTTP_200_OK)
+
+class PartViewSet(BulkItemsMixin, viewsets.ModelViewSet):
     serializer_class = PartSerializer
+    bulk_serializer_class = BulkPartSerializer
     permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin | IsMechanic]
 
+    def prepare_created(self, appointment, objects, validated_data):
+        # Jak Part.save(), którego bulk_create nie wywołuje
+        for part in objects:
+            part.name = part.name.title()
+
+    def prepare_updated(self, appointment, objects, fields):
+        if 'name' in fields:
+            for part in objects:
+                part.name = part.name.title()
+        return set()
+
+    def update_rollups(self, appointment, objects):
+        # Status wizyty nie zależy od części - tylko różnica sumy części, jednym UPDATE
+        apply_parts_deltas(part_cost_deltas(objects))
+
     def get_queryset(self):
         workshop_id = self.kwargs['workshop_pk']
         appointment_id = self.kwargs['appointment_pk']
@@ -2,9 +2,35 @@
 
 import os
 from celery import Celery
+from celery.schedules import crontab
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 app = Celery('backend')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+
+app.conf.beat_schedule = {
+    'train-model-every-week': {
+        'task': 'ai_module.tasks.train_model_task',
+        'schedule': crontab(day_of_week='sun', hour=0, minute=0),
+    },
+    # Pełne przeliczenie segmentów co noc - wyrównuje też zmiany, których kolejka
+    # ai_module.segment_queue nie zdołała zlecić (np. niedostępny broker)
+    'update-client-segments-every-night': {
+        'task': 'ai_module.tasks.update_client_segments_task',
+        'schedule': crontab(hour=1, minute=0),
+    },
+    # Dopisywanie nowo zakończonych wizyt do indeksu rekomendacji - jeden przebieg
+    # na kwadrans zamiast przebudowy przy każdej wizycie; bez zmian plik zostaje
+    'update-recommendation-index-every-15-minutes': {
+        'task': 'ai_module.tasks.update_recommendation_index_task',
+        'schedule': crontab(minute='*/15'),
+    },
+    # Pełna przebudowa indeksu rekomendacji (uwzględnia też edycje już policzonych wizyt)
+    'rebuild-recommendation-index-every-week': {
+        'task': 'ai_module.tasks.update_recommendation_index_task',
+        'schedule': crontab(day_of_week='sun', hour=2, minute=0),
+        'kwargs': {'full': True},
+    },
+}
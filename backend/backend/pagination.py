@@ -0,0 +1,151 @@
+import base64
+import binascii
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def _flip(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginacja kursorem po złożonym kluczu sortowania, np. `(-scheduled_time, id)`.
+
+    Kursor zapisuje wartości klucza z krawędzi strony, a kolejna strona to
+    `WHERE (klucz) > (kursor) ... LIMIT n` - koszt nie rośnie z głębokością
+    historii (w przeciwieństwie do OFFSET). Ostatnie pole klucza musi być
+    unikalne (`id`), a pola klucza nie mogą mieć wartości NULL.
+
+    Widok wskazuje klucz atrybutem `keyset_ordering`. Żeby nie zmieniać formatu
+    odpowiedzi dotychczasowym klientom, stronicowanie włącza się dopiero, gdy
+    żądanie zawiera `cursor` lub `page_size` (albo zawsze, przy
+    `KEYSET_PAGINATION_DEFAULT = True` w ustawieniach).
+    """
+    ordering = ('-created_at', 'id')
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Nieprawidłowy kursor.'
+
+    def is_requested(self, request):
+        params = request.query_params
+        return (
+            self.cursor_query_param in params
+            or self.page_size_query_param in params
+            or getattr(settings, 'KEYSET_PAGINATION_DEFAULT', False)
+        )
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = tuple(getattr(view, 'keyset_ordering', self.ordering))
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor[0]
+        ordering = tuple(_flip(field) for field in self.ordering) if reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.after(ordering, cursor[1]))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            # Strona poprzednia była czytana wstecz - przywracamy właściwą kolejność
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = rows
+        return rows
+
+    def after(self, ordering, values):
+        """Warunek "wiersz leży za kursorem" dla złożonego klucza (porównanie krotek)."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        # Nadmiarowy warunek na pierwszym polu pozwala bazie zacząć odczyt indeksu od kursora
+        first, value = ordering[0], values[0]
+        return Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": value}) & condition
+
+    def key(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def encode_cursor(self, reverse, values):
+        # str() zamiast DjangoJSONEncoder - ten obcina czas do milisekund, a klucz musi być dokładny
+        payload = json.dumps([int(reverse), values], default=str, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            reverse, values = json.loads(payload)
+            if len(values) != len(self.ordering):
+                raise ValueError
+            values = [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (binascii.Error, UnicodeDecodeError, TypeError, ValueError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return bool(reverse), values
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(False, self.key(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # Za ostatnim wierszem nic nie ma - wracamy na pierwszą stronę
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(True, self.key(self.page[0]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
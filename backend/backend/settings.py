@@ -1,13 +1,10 @@
 import os
 from pathlib import Path
-import pymysql
 from datetime import timedelta
 from dotenv import load_dotenv
-from celery.schedules import crontab
 from decouple import config
 
 
-pymysql.install_as_MySQLdb()
 load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -66,6 +63,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'ai_module.metrics.RequestMetricsMiddleware',
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True  # For development only, specify domains in production
@@ -160,6 +158,11 @@ DATABASES = {
     }
 }
 
+# Sterownik MySQL (pymysql) jest potrzebny tylko przy bazie MySQL
+if DATABASES['default']['ENGINE'] == 'django.db.backends.mysql':
+    import pymysql
+    pymysql.install_as_MySQLdb()
+
 # #dodaj database sqlite
 # DATABASES = {
 #     'default': {
@@ -215,21 +218,15 @@ DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000  # or any other value that suits your need
 # Import api key form .env file
 API_KEY = os.getenv('API_KEY')
 
-# CELERY_BROKER_URL = 'redis://localhost:6379/0'  # Używamy Redis jako brokera
-# CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
-
-from celery.schedules import crontab
+# Np. CELERY_BROKER_URL=redis://localhost:6379/0 (Redis jako broker i backend wyników).
+# Broker musi być wspólny dla web, beat i workerów - brak ustawienia zgłasza `manage.py check`
+# (ai_module.checks); do lokalnych testów wystarcza CELERY_TASK_ALWAYS_EAGER=True.
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default=None)
+CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default=None)
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=False, cast=bool)
+CELERY_TASK_EAGER_PROPAGATES = True
 
-CELERY_BEAT_SCHEDULE = {
-    'train-model-every-week': {
-        'task': 'ai_module.tasks.train_model_task',
-        'schedule': crontab(day_of_week='sun', hour=0, minute=0),
-    },
-    'update-client-segments-every-week': {
-        'task': 'ai_module.tasks.update_client_segments_task',
-        'schedule': crontab(day_of_week='mon', hour=0, minute=0),
-    },
-}
+# Harmonogram celery beat jest zdefiniowany w backend/celery.py
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.example.com'
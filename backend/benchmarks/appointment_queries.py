@@ -0,0 +1,252 @@
+"""
+Benchmark zapytań listy wizyt: plany wykonania (EXPLAIN) i czasy przy ~1M wizyt.
+
+Skrypt tworzy osobną bazę testową (jak `manage.py test`), dosiewa do niej
+warsztaty, klientów, pojazdy, mechaników i wizyty, aktualizuje statystyki
+planera (ANALYZE), a potem dla typowych filtrów listy wizyt - zbudowanych tą
+samą ścieżką co `AppointmentViewSet` (`filter_appointments` + kolejność
+paginacji) - zapisuje plan, użyte indeksy, czas pierwszej strony i to, czy
+planer nie skanuje całej tabeli ani nie sortuje wyniku.
+
+    python benchmarks/appointment_queries.py --appointments 1000000 --keepdb --output plans.json
+
+Z `--check` kod wyjścia 1 oznacza, że któreś zapytanie nie użyło
+oczekiwanego indeksu albo skanuje całą tabelę wizyt.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import uuid
+from decimal import Decimal
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.hashers import make_password  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from accounts.models import User  # noqa: E402
+from appointments.filters import filter_appointments  # noqa: E402
+from appointments.models import Appointment  # noqa: E402
+from backend.pagination import KeysetPagination  # noqa: E402
+from clients.models import Client  # noqa: E402
+from employees.models import Employee  # noqa: E402
+from vehicles.models import Vehicle  # noqa: E402
+from workshops.models import Workshop  # noqa: E402
+
+DEFAULT_APPOINTMENTS = 1_000_000
+DEFAULT_WORKSHOPS = 20
+APPOINTMENTS_PER_CLIENT = 5
+MECHANICS_PER_WORKSHOP = 4
+SEED_CHUNK = 20_000
+PAGE_SIZE = 50
+REPEATS = 5
+HISTORY_DAYS = 5 * 365
+
+STATUSES = ('completed',) * 6 + ('canceled', 'pending', 'in_progress')
+ORDERING = ('-scheduled_time', 'id')
+INDEX_NAMES = [index.name for index in Appointment._meta.indexes]
+
+
+def seed(target, workshops_count, rng):
+    """Dosiewa wizyty do `target` (z klientami, pojazdami i przypisanymi mechanikami)."""
+    existing = Appointment.objects.count()
+    if existing >= target:
+        return 0.0
+
+    started = time.perf_counter()
+    owner = User.objects.filter(email='benchmark@example.com').first()
+    if owner is None:
+        owner = User.objects.create_user(email='benchmark@example.com', password=None, first_name='Benchmark', last_name='Owner')
+    workshops = list(Workshop.objects.filter(owner=owner).order_by('created_at'))
+    workshops += Workshop.objects.bulk_create(
+        [Workshop(name=f'Warsztat {i}', owner=owner) for i in range(len(workshops), workshops_count)]
+    )
+
+    mechanics = {}
+    for workshop in workshops:
+        mechanics[workshop.pk] = list(Employee.objects.filter(workshop=workshop))
+        missing = MECHANICS_PER_WORKSHOP - len(mechanics[workshop.pk])
+        if missing > 0:
+            users = User.objects.bulk_create([
+                User(email=f'mechanik-{uuid.uuid4().hex[:12]}@example.com', password=make_password(None),
+                     first_name='Mechanik', last_name=str(i))
+                for i in range(missing)
+            ])
+            mechanics[workshop.pk] += Employee.objects.bulk_create([
+                Employee(user=user, workshop=workshop, position='Mechanik', hire_date=timezone.now().date(), status='APPROVED')
+                for user in users
+            ])
+
+    through = Appointment.assigned_mechanics.through
+    now = timezone.now()
+    for start in range(existing, target, SEED_CHUNK):
+        size = min(SEED_CHUNK, target - start)
+        clients, vehicles, appointments, assignments = [], [], [], []
+        for i in range(start, start + size, APPOINTMENTS_PER_CLIENT):
+            workshop = workshops[rng.randrange(len(workshops))]
+            client = Client(id=uuid.uuid4(), workshop=workshop, first_name=f'Klient{i}', last_name='Testowy', phone=f'{500000000 + i}')
+            vehicle = Vehicle(id=uuid.uuid4(), client=client, make='Skoda', model='Octavia', license_plate=f'B{i:08d}'[-10:])
+            clients.append(client)
+            vehicles.append(vehicle)
+            for _ in range(min(APPOINTMENTS_PER_CLIENT, start + size - i)):
+                appointment = Appointment(
+                    id=uuid.uuid4(), workshop=workshop, client=client, vehicle=vehicle,
+                    scheduled_time=now - datetime.timedelta(days=rng.randint(-30, HISTORY_DAYS), minutes=rng.randint(0, 1440)),
+                    status=rng.choice(STATUSES),
+                    total_cost=Decimal(rng.randint(5_000, 500_000)) / 100,
+                )
+                appointments.append(appointment)
+                if rng.random() < 0.7:
+                    assignments.append(through(appointment_id=appointment.id, employee=rng.choice(mechanics[workshop.pk])))
+        # bulk_create pomija sygnały (magazyn cech, segmenty) - tu liczą się tylko zapytania listy
+        Client.objects.bulk_create(clients, batch_size=2000)
+        Vehicle.objects.bulk_create(vehicles, batch_size=2000)
+        Appointment.objects.bulk_create(appointments, batch_size=2000)
+        through.objects.bulk_create(assignments, batch_size=2000)
+        print(f"  {start + size} wizyt", file=sys.stderr)
+
+    return time.perf_counter() - started
+
+
+def analyze():
+    """Aktualne statystyki dla planera - bez nich plan przy świeżych danych bywa przypadkowy."""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def scenarios():
+    """Typowe zapytania listy wizyt: (nazwa, parametry filtrów, oczekiwany indeks albo None)."""
+    workshop = Workshop.objects.filter(owner__email='benchmark@example.com').order_by('created_at').first()
+    appointment = Appointment.objects.filter(workshop=workshop).order_by('?').first()
+    mechanic = Employee.objects.filter(workshop=workshop).first()
+    month_ago = (timezone.now() - datetime.timedelta(days=30)).date().isoformat()
+    year_ago = (timezone.now() - datetime.timedelta(days=365)).date().isoformat()
+    half_year_ago = (timezone.now() - datetime.timedelta(days=182)).date().isoformat()
+
+    return workshop, [
+        ('list', {}, 'appt_workshop_sched_idx'),
+        ('status', {'status': 'pending'}, 'appt_workshop_status_idx'),
+        ('date_range', {'scheduled_from': year_ago, 'scheduled_to': half_year_ago}, 'appt_workshop_sched_idx'),
+        ('status_date_range', {'status': 'completed', 'scheduled_from': month_ago}, 'appt_workshop_status_idx'),
+        ('client_status', {'client': str(appointment.client_id), 'status': 'completed'}, 'appt_client_status_idx'),
+        ('vehicle', {'vehicle': str(appointment.vehicle_id)}, None),
+        ('mechanic', {'mechanic': str(mechanic.pk)}, None),
+    ]
+
+
+def base_queryset(workshop, params):
+    queryset = filter_appointments(Appointment.objects.filter(workshop__id=workshop.pk), params)
+    return queryset.order_by(*ORDERING)
+
+
+def deep_page(workshop):
+    """Strona z końca historii warsztatu (keyset), jak po wielu kliknięciach "dalej"."""
+    queryset = base_queryset(workshop, {})
+    total = queryset.count()
+    edge = queryset.values_list('scheduled_time', 'id')[max(total - PAGE_SIZE * 2, 0)]
+    return queryset.filter(KeysetPagination().after(ORDERING, list(edge)))
+
+
+def scans_table(plan, table):
+    """Pełny skan tabeli: `Seq Scan on` (PostgreSQL) albo `SCAN <tabela>` bez indeksu (SQLite)."""
+    pattern = re.compile(rf'(Seq Scan on {table}\b|\bSCAN {table}\b(?!.*\bINDEX\b))')
+    return any(pattern.search(line) for line in plan.splitlines())
+
+
+def sorts_rows(plan):
+    """Czy wynik jest sortowany osobno, zamiast czytany w kolejności indeksu."""
+    return bool(re.search(r'(->\s+|^)(Incremental )?Sort\b|TEMP B-TREE FOR ORDER BY', plan, re.MULTILINE))
+
+
+def inspect(queryset, expected_index, analyze_plan):
+    page = queryset[:PAGE_SIZE]
+    plan = page.explain(analyze=True) if analyze_plan and connection.vendor == 'postgresql' else page.explain()
+
+    timings = []
+    for _ in range(REPEATS):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            rows = list(page.values_list('id', flat=True))
+            timings.append(time.perf_counter() - started)
+
+    full_scan = scans_table(plan, Appointment._meta.db_table)
+    result = {
+        'rows': len(rows),
+        'queries': len(queries),
+        'ms_median': round(statistics.median(timings) * 1000, 3),
+        'indexes': [name for name in INDEX_NAMES if name in plan],
+        'expected_index': expected_index,
+        'full_scan': full_scan,
+        'sort': sorts_rows(plan),
+        'plan': plan.splitlines(),
+    }
+    result['ok'] = not full_scan and (expected_index is None or expected_index in result['indexes'])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--appointments', type=int, default=DEFAULT_APPOINTMENTS)
+    parser.add_argument('--workshops', type=int, default=DEFAULT_WORKSHOPS)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Plik JSON z wynikami (domyślnie stdout)')
+    parser.add_argument('--keepdb', action='store_true', help='Nie usuwaj bazy testowej (kolejne przebiegi pominą seedowanie)')
+    parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (PostgreSQL) - plan z rzeczywistymi czasami')
+    parser.add_argument('--check', action='store_true', help='Kod wyjścia 1, gdy zapytanie nie używa oczekiwanego indeksu')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=args.keepdb)
+    try:
+        print(f"Seedowanie {args.appointments} wizyt...", file=sys.stderr)
+        seed_seconds = seed(args.appointments, args.workshops, rng)
+        analyze()
+        workshop, cases = scenarios()
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'appointments': Appointment.objects.count(),
+            'workshop_appointments': Appointment.objects.filter(workshop=workshop).count(),
+            'seed_seconds': round(seed_seconds, 2),
+            'page_size': PAGE_SIZE,
+            'queries': {},
+        }
+        for name, params, expected_index in cases:
+            report['queries'][name] = {'params': params, **inspect(base_queryset(workshop, params), expected_index, args.analyze)}
+        report['queries']['deep_page'] = {
+            'params': {'cursor': '...'}, **inspect(deep_page(workshop), 'appt_workshop_sched_idx', args.analyze),
+        }
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=args.keepdb)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    failed = [name for name, result in report['queries'].items() if not result['ok']]
+    for name in failed:
+        print(f"Zapytanie {name} nie używa oczekiwanego indeksu lub skanuje całą tabelę", file=sys.stderr)
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
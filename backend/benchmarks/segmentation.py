@@ -0,0 +1,241 @@
+"""
+Benchmark segmentacji klientów w kilku skalach (domyślnie 1k / 100k / 1M).
+
+Skrypt tworzy osobną bazę testową (jak `manage.py test`, więc działa na
+PostgreSQL i SQLite z bieżących ustawień), dosiewa do niej syntetycznych
+klientów, pojazdy i wizyty, a potem osobno mierzy:
+
+- `features_aggregate` / `features_stored` - ekstrakcję cech (agregacja
+  historii wizyt vs odczyt z `ClientFeatures`),
+- `inference` - predykcję modelu dla całej macierzy cech,
+- `write_back` - zapis segmentu i rabatu wszystkim klientom,
+- `update_segments` - cały przebieg jak w `update_client_segments`,
+- `predict_segment` - opóźnienie pojedynczej predykcji (p50/p95).
+
+Dla każdego etapu zapisywany jest czas, liczba zapytań SQL i szczyt
+pamięci Pythona (tracemalloc). Wynik to JSON, do porównywania przebiegów:
+
+    python benchmarks/segmentation.py --scales 1000 100000 --output before.json
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+import numpy as np  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from accounts.models import User  # noqa: E402
+from appointments.models import Appointment  # noqa: E402
+from clients.models import Client  # noqa: E402
+from vehicles.models import Vehicle  # noqa: E402
+from workshops.models import Workshop  # noqa: E402
+from ai_module.feature_store import rebuild_client_features  # noqa: E402
+from ai_module.features import iter_client_features  # noqa: E402
+from ai_module.ml_model import predict_segment  # noqa: E402
+from ai_module.registry import get_model  # noqa: E402
+from ai_module.segmentation import BATCH_SIZE, apply_segments, predict_matrix, update_segments  # noqa: E402
+
+DEFAULT_SCALES = (1_000, 100_000, 1_000_000)
+CLIENTS_PER_WORKSHOP = 10_000
+SEED_CHUNK = 10_000
+MAX_APPOINTMENTS_PER_CLIENT = 6
+LATENCY_SAMPLES = 200
+
+STATUSES = ('pending', 'in_progress', 'completed', 'completed', 'completed', 'canceled')
+SEGMENTS = ('A', 'B', 'C', 'D')
+MAKES = (('Opel', 'Astra'), ('Skoda', 'Octavia'), ('Toyota', 'Corolla'), ('VW', 'Golf'), ('Ford', 'Focus'))
+
+
+class Stage:
+    def __init__(self):
+        self.result = {}
+
+
+@contextmanager
+def measure(results, name, rows=None, trace_memory=True):
+    """Mierzy czas, liczbę zapytań i szczyt pamięci bloku; wynik trafia do `results[name]`."""
+    stage = Stage()
+    if trace_memory:
+        tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        yield stage
+        seconds = time.perf_counter() - started
+    result = {'seconds': round(seconds, 4), 'queries': len(queries)}
+    if trace_memory:
+        result['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        tracemalloc.stop()
+    if rows:
+        result['rows'] = rows
+        result['rows_per_second'] = round(rows / seconds) if seconds > 0 else None
+    result.update(stage.result)
+    results[name] = result
+
+
+def seed(target, rng):
+    """Dosiewa klientów (z pojazdami i wizytami) do `target`; zwraca czas seedowania."""
+    existing = Client.objects.count()
+    if existing >= target:
+        return 0.0
+
+    started = time.perf_counter()
+    owner = User.objects.filter(email='benchmark@example.com').first()
+    if owner is None:
+        owner = User.objects.create_user(
+            email='benchmark@example.com', password=None, first_name='Benchmark', last_name='Owner',
+        )
+    workshops = list(Workshop.objects.filter(owner=owner))
+    needed = -(-target // CLIENTS_PER_WORKSHOP) - len(workshops)
+    workshops += Workshop.objects.bulk_create(
+        [Workshop(name=f'Warsztat {len(workshops) + i}', owner=owner) for i in range(max(needed, 0))]
+    )
+
+    now = timezone.now()
+    for start in range(existing, target, SEED_CHUNK):
+        clients, vehicles, appointments = [], [], []
+        for i in range(start, min(start + SEED_CHUNK, target)):
+            workshop = workshops[i // CLIENTS_PER_WORKSHOP]
+            client = Client(
+                id=uuid.uuid4(), workshop=workshop, first_name=f'Klient{i}', last_name='Testowy',
+                phone=f'{500000000 + i}', segment=rng.choice(SEGMENTS),
+            )
+            clients.append(client)
+            client_vehicles = []
+            for j in range(rng.choice((0, 1, 1, 1, 2))):
+                make, model = rng.choice(MAKES)
+                vehicle = Vehicle(
+                    id=uuid.uuid4(), client=client, make=make, model=model,
+                    year=rng.choice((None, rng.randint(1995, now.year))),
+                    license_plate=f'B{i % 10 ** 7:07d}{j}', mileage=rng.randint(0, 350_000),
+                )
+                client_vehicles.append(vehicle)
+            vehicles += client_vehicles
+            if not client_vehicles:
+                continue
+            for _ in range(rng.randint(0, MAX_APPOINTMENTS_PER_CLIENT)):
+                appointments.append(Appointment(
+                    id=uuid.uuid4(), workshop=workshop, client=client, vehicle=rng.choice(client_vehicles),
+                    scheduled_time=now - datetime.timedelta(days=rng.randint(1, 1500), minutes=rng.randint(0, 1440)),
+                    status=rng.choice(STATUSES),
+                    total_cost=Decimal(rng.randint(5_000, 500_000)) / 100,
+                ))
+        # bulk_create pomija sygnały - magazyn cech przebudowujemy na końcu jednym przebiegiem
+        Client.objects.bulk_create(clients, batch_size=2000)
+        Vehicle.objects.bulk_create(vehicles, batch_size=2000)
+        Appointment.objects.bulk_create(appointments, batch_size=2000)
+
+    rebuild_client_features()
+    return time.perf_counter() - started
+
+
+def bench_scale(scale, rng, trace_memory):
+    results = {'clients': scale}
+    results['seed_seconds'] = round(seed(scale, rng), 2)
+    results['appointments'] = Appointment.objects.count()
+
+    loaded = get_model()
+    feature_order = loaded.features
+    clients = Client.objects.all()
+
+    for stored in (False, True):
+        name = 'features_stored' if stored else 'features_aggregate'
+        with measure(results, name, rows=scale, trace_memory=trace_memory):
+            X = np.empty((scale, len(feature_order)), dtype=np.float64)
+            client_ids = []
+            for row, features in iter_client_features(clients, stored=stored):
+                X[len(client_ids)] = [features.get(feature, 0) for feature in feature_order]
+                client_ids.append(row['id'])
+
+    with measure(results, 'inference', rows=scale, trace_memory=trace_memory):
+        predicted = np.concatenate([
+            predict_matrix(loaded.model, feature_order, X[start:start + BATCH_SIZE])
+            for start in range(0, scale, BATCH_SIZE)
+        ])
+
+    # Najgorszy przypadek: każdy klient dostaje zapis (poprzedni segment nieznany)
+    with measure(results, 'write_back', rows=scale, trace_memory=trace_memory) as stage:
+        stage.result['changed'] = apply_segments(client_ids, [None] * scale, predicted)
+
+    # Wyzerowane segmenty - pełny przebieg zapisuje wszystkich, jak przy pierwszym uruchomieniu
+    Client.objects.update(segment=None)
+    with measure(results, 'update_segments', rows=scale, trace_memory=trace_memory) as stage:
+        stats = update_segments(clients, stored=True)
+        stage.result['changed'] = stats.changed
+
+    sample = rng.sample(client_ids, min(LATENCY_SAMPLES, scale))
+    timings = []
+    with CaptureQueriesContext(connection) as queries:
+        for client_id in sample:
+            client = Client(pk=client_id)
+            started = time.perf_counter()
+            predict_segment(client)
+            timings.append(time.perf_counter() - started)
+    timings.sort()
+    results['predict_segment'] = {
+        'samples': len(sample),
+        'p50_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1] * 1000, 3),
+        'queries_per_call': round(len(queries) / len(sample), 2),
+    }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=list(DEFAULT_SCALES))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Plik JSON z wynikami (domyślnie stdout)')
+    parser.add_argument('--keepdb', action='store_true', help='Nie usuwaj bazy testowej (kolejne przebiegi pominą seedowanie)')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='Bez pomiaru pamięci (tracemalloc spowalnia etapy)')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=args.keepdb)
+    try:
+        loaded = get_model()
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': sys.version.split()[0],
+            'model': {'version': loaded.version, 'type': type(loaded.model).__name__},
+            'tracemalloc': not args.no_tracemalloc,
+            'scales': [],
+        }
+        for scale in sorted(args.scales):
+            print(f"Skala {scale} klientów...", file=sys.stderr)
+            report['scales'].append(bench_scale(scale, rng, trace_memory=not args.no_tracemalloc))
+        report['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=args.keepdb)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
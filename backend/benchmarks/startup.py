@@ -0,0 +1,87 @@
+"""
+Benchmark startu Django: czas `django.setup()` i RSS procesu po imporcie.
+
+Każdy pomiar to osobny, świeży interpreter (bez ciepłego cache modułów),
+wynik to mediana z `--runs` prób. Skrypt kończy się kodem 1, gdy czas lub
+pamięć przekroczą budżet albo gdy przy starcie załadował się któryś
+z ciężkich modułów, które powinny być importowane leniwie.
+
+    python benchmarks/startup.py --runs 5 --max-seconds 1.5 --max-rss-mb 120
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Moduły, które nie mogą być ładowane przy samym starcie aplikacji
+LAZY_MODULES = ('numpy', 'pandas', 'sklearn', 'joblib', 'imblearn', 'openai', 'pymysql')
+
+DEFAULT_MAX_SECONDS = 1.5
+DEFAULT_MAX_RSS_MB = 120
+
+PROBE = r"""
+import json, resource, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+elapsed = time.perf_counter() - started
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == 'darwin':
+    rss //= 1024
+print(json.dumps({
+    'seconds': elapsed,
+    'rss_mb': rss / 1024,
+    'modules': len(sys.modules),
+    'loaded': sorted(m for m in LAZY_MODULES if m in sys.modules),
+}))
+"""
+
+
+def measure(settings_module):
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    code = f"LAZY_MODULES = {LAZY_MODULES!r}\n" + PROBE
+    result = subprocess.run(
+        [sys.executable, '-c', code], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--settings', default='backend.settings')
+    parser.add_argument('--max-seconds', type=float, default=DEFAULT_MAX_SECONDS)
+    parser.add_argument('--max-rss-mb', type=float, default=DEFAULT_MAX_RSS_MB)
+    args = parser.parse_args(argv)
+
+    samples = [measure(args.settings) for _ in range(args.runs)]
+    report = {
+        'runs': args.runs,
+        'seconds': statistics.median(s['seconds'] for s in samples),
+        'rss_mb': statistics.median(s['rss_mb'] for s in samples),
+        'modules': samples[-1]['modules'],
+        'eagerly_loaded': sorted({m for s in samples for m in s['loaded']}),
+        'budget': {'seconds': args.max_seconds, 'rss_mb': args.max_rss_mb},
+    }
+
+    failures = []
+    if report['seconds'] > args.max_seconds:
+        failures.append(f"django.setup() trwa {report['seconds']:.3f} s (budżet {args.max_seconds} s)")
+    if report['rss_mb'] > args.max_rss_mb:
+        failures.append(f"RSS po starcie {report['rss_mb']:.1f} MB (budżet {args.max_rss_mb} MB)")
+    if report['eagerly_loaded']:
+        failures.append(f"Przy starcie załadowano: {', '.join(report['eagerly_loaded'])}")
+    report['failures'] = failures
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
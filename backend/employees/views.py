@@ -7,6 +7,7 @@ from accounts.models import Role
 from employees.models import Employee, ScheduleEntry, TemporaryCode
 from employees.serializers import EmployeeSerializer, EmployeeStatusUpdateSerializer, ScheduleEntrySerializer, EmployeeAssignmentSerializer
 from workshops.models import Workshop
+from backend.pagination import KeysetPagination
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -16,6 +17,8 @@ from accounts.permissions import IsWorkshopOwner, IsAdmin, IsMechanic
 class EmployeeViewSet(viewsets.ModelViewSet):
     serializer_class = EmployeeSerializer
     permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin | IsMechanic]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', 'id')
     
     def get_queryset(self):
         workshop_id = self.kwargs['workshop_pk']
@@ -4,12 +4,15 @@ from rest_framework.exceptions import PermissionDenied, ValidationError
 from .models import Quotation, QuotationPart
 from .serializers import QuotationSerializer, QuotationPartSerializer
 from workshops.models import Workshop
+from backend.pagination import KeysetPagination
 from accounts.permissions import IsWorkshopOwner, IsAdmin, IsMechanic
 from rest_framework.permissions import IsAuthenticated
 
 class QuotationViewSet(viewsets.ModelViewSet):
     serializer_class = QuotationSerializer
     permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin | IsMechanic]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', 'id')
 
     def get_queryset(self):
         workshop_id = self.kwargs['workshop_pk']
@@ -2,6 +2,7 @@ from rest_framework import viewsets, permissions
 from service_orders.models import ServiceOrder
 from service_orders.serializers import ServiceOrderSerializer
 from workshops.models import Workshop
+from backend.pagination import KeysetPagination
 from accounts.permissions import IsWorkshopOwner, IsAdmin
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import IsAuthenticated
@@ -9,6 +10,8 @@ from rest_framework.permissions import IsAuthenticated
 class ServiceOrderViewSet(viewsets.ModelViewSet):
     serializer_class = ServiceOrderSerializer
     permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', 'id')
 
     def get_queryset(self):
         workshop_id = self.kwargs['workshop_pk']
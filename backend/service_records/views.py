@@ -4,6 +4,7 @@ from service_records.serializers import ServiceRecordSerializer
 from vehicles.models import Vehicle
 from clients.models import Client
 from workshops.models import Workshop
+from backend.pagination import KeysetPagination
 from accounts.permissions import IsWorkshopOwner, IsAdmin, IsMechanic
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import IsAuthenticated
@@ -11,6 +12,8 @@ from rest_framework.permissions import IsAuthenticated
 class VehicleServiceHistoryView(generics.ListAPIView):
     serializer_class = ServiceRecordSerializer
     permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin | IsMechanic]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-date', '-created_at', 'id')
 
     def get_queryset(self):
         workshop_id = self.kwargs['workshop_pk']
@@ -29,6 +32,8 @@ class VehicleServiceHistoryView(generics.ListAPIView):
 class ClientServiceHistoryView(generics.ListAPIView):
     serializer_class = ServiceRecordSerializer
     permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin | IsMechanic]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-date', '-created_at', 'id')
 
     def get_queryset(self):
         workshop_id = self.kwargs['workshop_pk']
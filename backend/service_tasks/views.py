@@ -3,6 +3,7 @@ from service_tasks.models import ServiceTask
 from service_tasks.serializers import ServiceTaskSerializer
 from service_orders.models import ServiceOrder
 from workshops.models import Workshop
+from backend.pagination import KeysetPagination
 from accounts.permissions import IsWorkshopOwner, IsAdmin
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import IsAuthenticated
@@ -10,6 +11,8 @@ from rest_framework.permissions import IsAuthenticated
 class ServiceTaskViewSet(viewsets.ModelViewSet):
     serializer_class = ServiceTaskSerializer
     permission_classes = [IsAuthenticated, IsWorkshopOwner | IsAdmin]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', 'id')
 
     def get_queryset(self):
         workshop_id = self.kwargs['workshop_pk']
@@ -3,6 +3,7 @@ from vehicles.models import Vehicle
 from vehicles.serializers import VehicleSerializer
 from clients.models import Client
 from workshops.models import Workshop
+from backend.pagination import KeysetPagination
 from accounts.permissions import IsWorkshopOwner, IsAdmin, IsMechanic
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import IsAuthenticated
@@ -11,6 +12,8 @@ from rest_framework.permissions import IsAuthenticated
 class VehicleViewSet(viewsets.ModelViewSet):
     serializer_class = VehicleSerializer
     permission_classes = [IsAuthenticated, IsWorkshopOwner | IsMechanic | IsAdmin]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', 'id')
 
     def get_queryset(self):
         workshop_id = self.kwargs.get('workshop_pk')